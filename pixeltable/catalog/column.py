@@ -28,6 +28,8 @@ class Column:
     stored: bool
     is_pk: bool
     _media_validation: Optional[MediaValidation]  # if not set, TableVersion.media_validation applies
+    image_format: Optional[str]  # for stored computed image columns: jpeg, png or webp
+    image_quality: Optional[int]
     schema_version_add: Optional[int]
     schema_version_drop: Optional[int]
     _records_errors: Optional[bool]
@@ -47,6 +49,7 @@ class Column:
             col_id: Optional[int] = None, schema_version_add: Optional[int] = None,
             schema_version_drop: Optional[int] = None, sa_col_type: Optional[sql.sqltypes.TypeEngine] = None,
             records_errors: Optional[bool] = None, value_expr_dict: Optional[dict[str, Any]] = None,
+            image_format: Optional[str] = None, image_quality: Optional[int] = None
     ):
         """Column constructor.
 
@@ -57,6 +60,8 @@ class Column:
             is_pk: if True, this column is part of the primary key
             stored: determines whether a computed column is present in the stored table or recomputed on demand
             col_id: column ID (only used internally)
+            image_format: file format of the images of a stored computed image column ('jpeg', 'png' or 'webp')
+            image_quality: encoder quality (1-100) for image_format 'jpeg' or 'webp'
 
         Computed columns: those have a non-None ``computed_with`` argument
         - when constructed by the user: ``computed_with`` was constructed explicitly and is passed in;
@@ -95,6 +100,8 @@ class Column:
         self.id = col_id
         self.is_pk = is_pk
         self._media_validation = media_validation
+        self.image_format = image_format
+        self.image_quality = image_quality
         self.schema_version_add = schema_version_add
         self.schema_version_drop = schema_version_drop
 
@@ -27,6 +27,8 @@ class UpdateStatus:
     # TODO: disambiguate what this means: # of slots computed or # of columns computed?
     num_computed_values: int = 0
     num_excs: int = 0
+    # number of computed values that an earlier, interrupted attempt had already produced
+    num_resumed_rows: int = 0
     updated_cols: list[str] = dataclasses.field(default_factory=list)
     cols_with_excs: list[str] = dataclasses.field(default_factory=list)
 
@@ -34,6 +36,7 @@ class UpdateStatus:
         self.num_rows += other.num_rows
         self.num_computed_values += other.num_computed_values
         self.num_excs += other.num_excs
+        self.num_resumed_rows += other.num_resumed_rows
         self.updated_cols = list(dict.fromkeys(self.updated_cols + other.updated_cols))
         self.cols_with_excs = list(dict.fromkeys(self.cols_with_excs + other.cols_with_excs))
         return self
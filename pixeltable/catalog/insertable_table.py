@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import itertools
 import logging
-from typing import Any, Iterable, Literal, Optional, overload
+from typing import Any, Iterable, Iterator, Literal, Optional, overload
 from uuid import UUID
 
 import sqlalchemy.orm as orm
@@ -107,21 +108,25 @@ class InsertableTable(Table):
     ) -> UpdateStatus:
         if rows is None:
             rows = [kwargs]
-        else:
-            rows = list(rows)
-            if len(kwargs) > 0:
-                raise excs.Error('`kwargs` cannot be specified unless `rows is None`.')
+        elif len(kwargs) > 0:
+            raise excs.Error('`kwargs` cannot be specified unless `rows is None`.')
 
         fail_on_exception = on_error == 'abort'
 
-        if not isinstance(rows, list):
+        if isinstance(rows, dict) or not isinstance(rows, Iterable):
             raise excs.Error('rows must be a list of dictionaries')
-        if len(rows) == 0:
-            raise excs.Error('rows must not be empty')
-        for row in rows:
-            if not isinstance(row, dict):
-                raise excs.Error('rows must be a list of dictionaries')
-        self._validate_input_rows(rows)
+        if isinstance(rows, list):
+            # the rows are already in memory: validate them upfront
+            rows = list(self._validate_input_rows(rows))
+            if len(rows) == 0:
+                raise excs.Error('rows must not be empty')
+        else:
+            # stream the rows: they're validated and inserted in chunks as they're being consumed
+            rows_iter = iter(rows)
+            first_row = next(rows_iter, None)
+            if first_row is None:
+                raise excs.Error('rows must not be empty')
+            rows = self._validate_input_rows(itertools.chain([first_row], rows_iter))
         status = self._tbl_version.insert(rows, None, print_stats=print_stats, fail_on_exception=fail_on_exception)
 
         if status.num_excs == 0:
@@ -139,13 +144,14 @@ class InsertableTable(Table):
         FileCache.get().emit_eviction_warnings()
         return status
 
-    def _validate_input_rows(self, rows: list[dict[str, Any]]) -> None:
-        """Verify that the input rows match the table schema"""
+    def _validate_input_rows(self, rows: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        """Verify that the input rows match the table schema; rows are validated as they are being consumed"""
         valid_col_names = set(self._schema.keys())
         reqd_col_names = set(self._tbl_version_path.tbl_version.get_required_col_names())
         computed_col_names = set(self._tbl_version_path.tbl_version.get_computed_col_names())
         for row in rows:
-            assert isinstance(row, dict)
+            if not isinstance(row, dict):
+                raise excs.Error('rows must be a list of dictionaries')
             col_names = set(row.keys())
             if len(reqd_col_names - col_names) > 0:
                 raise excs.Error(f'Missing required column(s) ({", ".join(reqd_col_names - col_names)}) in row {row}')
@@ -165,6 +171,7 @@ class InsertableTable(Table):
                 except TypeError as e:
                     msg = str(e)
                     raise excs.Error(f'Error in column {col.name}: {msg[0].lower() + msg[1:]}\nRow: {row}')
+            yield row
 
     def delete(self, where: Optional['pxt.exprs.Expr'] = None) -> UpdateStatus:
         """Delete rows in this table.
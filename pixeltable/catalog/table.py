@@ -6,7 +6,7 @@ import json
 import logging
 from pathlib import Path
 from typing import _GenericAlias  # type: ignore[attr-defined]
-from typing import TYPE_CHECKING, Any, Callable, Iterable, Literal, Optional, Sequence, Union, overload
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Literal, Optional, Sequence, Union, overload
 from uuid import UUID
 
 import pandas as pd
@@ -24,6 +24,7 @@ import pixeltable.type_system as ts
 from ..exprs import ColumnRef
 from ..utils.description_helper import DescriptionHelper
 from ..utils.filecache import FileCache
+from ..utils.image_encoder import ImageEncoder
 from .column import Column
 from .globals import _ROWID_COLUMN_NAME, MediaValidation, UpdateStatus, is_system_column_name, is_valid_identifier
 from .schema_object import SchemaObject
@@ -225,6 +226,16 @@ class Table(SchemaObject):
         """Return rows from this table."""
         return self._df().collect()
 
+    def similarity_search(
+            self, col: 'exprs.ColumnRef', items: Sequence[Any], *, k: int = 10, idx: Optional[str] = None,
+            ef_search: Optional[int] = None, probes: Optional[int] = None
+    ) -> list['pxt.dataframe.DataFrameResultSet']:
+        """Find the k rows that are most similar to each of a list of query items, according to an embedding index.
+
+        See [`DataFrame.similarity_search`][pixeltable.DataFrame.similarity_search] for more details.
+        """
+        return self._df().similarity_search(col, items, k=k, idx=idx, ef_search=ef_search, probes=probes)
+
     def show(
             self, *args, **kwargs
     ) -> 'pxt.dataframe.DataFrameResultSet':
@@ -244,6 +255,14 @@ class Table(SchemaObject):
         """Return the last n rows inserted into this table."""
         return self._df().tail(*args, **kwargs)
 
+    def iter_batches(self, *args, **kwargs) -> Iterator['pxt.dataframe.DataFrameResultSet']:
+        """Return the rows of this table incrementally, in batches; see DataFrame.iter_batches()."""
+        return self._df().iter_batches(*args, **kwargs)
+
+    def iter_rows(self, *args, **kwargs) -> Iterator[dict[str, Any]]:
+        """Return the rows of this table incrementally, one at a time; see DataFrame.iter_rows()."""
+        return self._df().iter_rows(*args, **kwargs)
+
     def count(self) -> int:
         """Return the number of rows in this table."""
         return self._df().count()
@@ -551,6 +570,8 @@ class Table(SchemaObject):
         stored: Optional[bool] = None,
         print_stats: bool = False,
         on_error: Literal['abort', 'ignore'] = 'abort',
+        image_format: Optional[Literal['jpeg', 'png', 'webp']] = None,
+        image_quality: Optional[int] = None,
         **kwargs: exprs.Expr
     ) -> UpdateStatus:
         """
@@ -558,6 +579,9 @@ class Table(SchemaObject):
 
         Args:
             kwargs: Exactly one keyword argument of the form `col_name=expression`.
+            image_format: For stored image columns: the file format of the computed images. If not specified,
+                images are stored as JPEG, or as WebP if they have a transparency layer.
+            image_quality: For `image_format` `'jpeg'` or `'webp'`: the encoder quality, between 1 and 100.
 
         Returns:
             Information about the execution status of the operation.
@@ -574,6 +598,10 @@ class Table(SchemaObject):
             Do the same, but now the column is unstored:
 
             >>> tbl.add_computed_column(rotated=tbl.frame.rotate(90), stored=False)
+
+            Store the rotated images losslessly:
+
+            >>> tbl.add_computed_column(rotated=tbl.frame.rotate(90), image_format='png')
         """
         self._check_is_dropped()
         if len(kwargs) != 1:
@@ -588,6 +616,10 @@ class Table(SchemaObject):
         col_schema: dict[str, Any] = {'value': spec}
         if stored is not None:
             col_schema['stored'] = stored
+        if image_format is not None:
+            col_schema['image_format'] = image_format
+        if image_quality is not None:
+            col_schema['image_quality'] = image_quality
 
         new_col = self._create_columns({col_name: col_schema})[0]
         self._verify_column(new_col, set(self._schema.keys()), set(self._query_names))
@@ -595,6 +627,52 @@ class Table(SchemaObject):
         FileCache.get().emit_eviction_warnings()
         return status
 
+    def resume(
+        self, *, print_stats: bool = False, on_error: Optional[Literal['abort', 'ignore']] = None
+    ) -> UpdateStatus:
+        """
+        Resumes an interrupted [`add_computed_column()`][pixeltable.catalog.Table.add_computed_column] (or
+        [`add_column()`][pixeltable.catalog.Table.add_column] of a computed column).
+
+        Populating a stored computed column of a large table records its progress as it goes along. If that
+        process gets interrupted (eg, by an error or a crash), the values computed so far are retained, and
+        `resume()` adds the column again, computing only the values that are still missing. Adding the same column
+        again with `add_computed_column()` has the same effect, as long as the table data hasn't changed in the
+        meantime.
+
+        Args:
+            print_stats: If `True`, print execution metrics during evaluation.
+            on_error: Determines the behavior if an error occurs while evaluating the column expression; the
+                default is the `on_error` setting of the interrupted call.
+
+        Returns:
+            Information about the execution status of the operation; `num_resumed_rows` is the number of values
+            that had already been computed.
+
+        Raises:
+            Error: If there is no interrupted computed column to resume.
+
+        Examples:
+            >>> tbl.add_computed_column(caption=expensive_udf(tbl.img))  # interrupted
+            ... tbl.resume()
+        """
+        self._check_is_dropped()
+        if self._tbl_version_path.is_snapshot():
+            raise excs.Error('Cannot resume a computed column of a snapshot')
+        with env.Env.get().engine.begin() as conn:
+            backfill_md = self._tbl_version.store_tbl.get_backfill_md(conn)
+        if backfill_md is None:
+            raise excs.Error(f'Table {self._name!r} has no interrupted computed column to resume')
+        col_name = backfill_md['name']
+        if col_name in self._schema:
+            raise excs.Error(f'Cannot resume computed column {col_name!r}: column already exists')
+        value_expr = exprs.Expr.from_dict(backfill_md['value_expr'])
+        return self.add_computed_column(
+            stored=backfill_md['stored'], print_stats=print_stats,
+            on_error=on_error if on_error is not None else backfill_md['on_error'],
+            image_format=backfill_md.get('image_format'), image_quality=backfill_md.get('image_quality'),
+            **{col_name: value_expr})
+
     @classmethod
     def _validate_column_spec(cls, name: str, spec: dict[str, Any]) -> None:
         """Check integrity of user-supplied Column spec
@@ -603,7 +681,7 @@ class Table(SchemaObject):
         (on account of containing Python Callables or Exprs).
         """
         assert isinstance(spec, dict)
-        valid_keys = {'type', 'value', 'stored', 'media_validation'}
+        valid_keys = {'type', 'value', 'stored', 'media_validation', 'image_format', 'image_quality'}
         for k in spec.keys():
             if k not in valid_keys:
                 raise excs.Error(f'Column {name}: invalid key {k!r}')
@@ -628,6 +706,20 @@ class Table(SchemaObject):
         if 'stored' in spec and not isinstance(spec['stored'], bool):
             raise excs.Error(f'Column {name}: "stored" must be a bool, got {spec["stored"]}')
 
+        if 'image_format' in spec and spec['image_format'] not in ImageEncoder.FORMATS:
+            raise excs.Error(
+                f'Column {name}: "image_format" must be one of {", ".join(ImageEncoder.FORMATS)}, '
+                f'got {spec["image_format"]!r}')
+
+        if 'image_quality' in spec:
+            quality = spec['image_quality']
+            if not isinstance(quality, int) or isinstance(quality, bool) or not 1 <= quality <= 100:
+                raise excs.Error(f'Column {name}: "image_quality" must be an int between 1 and 100, got {quality!r}')
+            if spec.get('image_format') not in ImageEncoder.LOSSY_FORMATS:
+                raise excs.Error(
+                    f'Column {name}: "image_quality" requires "image_format" '
+                    f'{" or ".join(repr(f) for f in ImageEncoder.LOSSY_FORMATS)}')
+
     @classmethod
     def _create_columns(cls, schema: dict[str, Any]) -> list[Column]:
         """Construct list of Columns, given schema"""
@@ -637,6 +729,8 @@ class Table(SchemaObject):
             value_expr: Optional[exprs.Expr] = None
             primary_key: Optional[bool] = None
             media_validation: Optional[catalog.MediaValidation] = None
+            image_format: Optional[str] = None
+            image_quality: Optional[int] = None
             stored = True
 
             if isinstance(spec, (ts.ColumnType, type, _GenericAlias)):
@@ -660,12 +754,14 @@ class Table(SchemaObject):
                     catalog.MediaValidation[media_validation_str.upper()] if media_validation_str is not None
                     else None
                 )
+                image_format = spec.get('image_format')
+                image_quality = spec.get('image_quality')
             else:
                 raise excs.Error(f'Invalid value for column {name!r}')
 
             column = Column(
                 name, col_type=col_type, computed_with=value_expr, stored=stored, is_pk=primary_key,
-                media_validation=media_validation)
+                media_validation=media_validation, image_format=image_format, image_quality=image_quality)
             columns.append(column)
         return columns
 
@@ -688,6 +784,9 @@ class Table(SchemaObject):
             raise excs.Error((
                 f'Column {col.name!r}: stored={col.stored} is not valid for image columns computed with a streaming '
                 f'function'))
+        if col.image_format is not None \
+                and not (col.is_computed and col.col_type.is_image_type() and col.stored is not False):
+            raise excs.Error(f'Column {col.name!r}: image_format only applies to stored computed image columns')
 
     @classmethod
     def _verify_schema(cls, schema: list[Column]) -> None:
@@ -784,7 +883,9 @@ class Table(SchemaObject):
     def add_embedding_index(
             self, column: Union[str, ColumnRef], *, idx_name: Optional[str] = None,
             string_embed: Optional[pxt.Function] = None, image_embed: Optional[pxt.Function] = None,
-            metric: str = 'cosine'
+            metric: str = 'cosine', index_type: Literal['hnsw', 'ivfflat'] = 'hnsw',
+            build_params: Optional[dict[str, int]] = None, precision: Literal['vector', 'halfvec', 'binary'] = 'vector',
+            rerank_factor: Optional[int] = None
     ) -> None:
         """
         Add an embedding index to the table. Once the index is added, it will be automatically kept up to data as new
@@ -803,6 +904,18 @@ class Table(SchemaObject):
             image_embed: A function to embed images; required if the column is an `Image` column.
             metric: Distance metric to use for the index; one of `'cosine'`, `'ip'`, or `'l2'`;
                 the default is `'cosine'`.
+            index_type: The pgvector index type; one of `'hnsw'` (the default) or `'ivfflat'`. IVFFlat indices are
+                faster to build and use less memory, but have a lower recall for a given query latency; they should be
+                created after the table has been populated.
+            build_params: Index build parameters: `m` (default 16) and `ef_construction` (default 64) for `'hnsw'`
+                indices, `lists` (default 100) for `'ivfflat'` indices.
+            precision: The representation of the embeddings in the index: `'vector'` (the default; 32-bit floats),
+                `'halfvec'` (16-bit floats, which halves the size of the index) or `'binary'` (binary quantization:
+                one bit per dimension). The table always stores the embeddings with full precision.
+            rerank_factor: For `'binary'` indices only: queries with an `order_by(similarity(...)).limit(k)` retrieve
+                `rerank_factor * k` candidates from the index and return the `k` candidates that are closest according
+                to their full-precision embeddings. The default is 4. For `'hnsw'` indices, the number of candidates
+                is limited by `ef_search` (see `similarity()`).
 
         Raises:
             Error: If an index with that name already exists for the table, or if the specified column does not exist.
@@ -837,6 +950,12 @@ class Table(SchemaObject):
             ...     string_embed=my_string_func,
             ...     metric='ip'
             ... )
+
+            Add a memory-efficient index with half-precision embeddings and a denser HNSW graph:
+
+            >>> tbl.add_embedding_index(
+            ...     'img', image_embed=my_image_func, precision='halfvec', build_params={'m': 32, 'ef_construction': 128}
+            ... )
         """
         if self._tbl_version_path.is_snapshot():
             raise excs.Error('Cannot add an index to a snapshot')
@@ -853,7 +972,9 @@ class Table(SchemaObject):
         from pixeltable.index import EmbeddingIndex
 
         # create the EmbeddingIndex instance to verify args
-        idx = EmbeddingIndex(col, metric=metric, string_embed=string_embed, image_embed=image_embed)
+        idx = EmbeddingIndex(
+            col, metric=metric, string_embed=string_embed, image_embed=image_embed, index_type=index_type,
+            build_params=build_params, precision=precision, rerank_factor=rerank_factor)
         status = self._tbl_version.add_index(col, idx_name=idx_name, idx=idx)
         # TODO: how to deal with exceptions here? drop the index and raise?
         FileCache.get().emit_eviction_warnings()
@@ -1037,7 +1158,8 @@ class Table(SchemaObject):
 
         Args:
             rows: (if inserting multiple rows) A list of rows to insert, each of which is a dictionary mapping column
-                names to values.
+                names to values. This can also be an iterator (such as a generator), which is consumed in chunks: the
+                rows don't need to fit into memory, and they are still inserted as a single table version.
             kwargs: (if inserting a single row) Keyword-argument pairs representing column names and values.
             print_stats: If `True`, print statistics about the cost of computed columns.
             on_error: Determines the behavior if an error occurs while evaluating a computed column or detecting an
@@ -1069,6 +1191,10 @@ class Table(SchemaObject):
             Insert a single row using the alternative syntax:
 
             >>> tbl.insert(a=3, b=3, c=3)
+
+            Stream rows from a generator:
+
+            >>> tbl.insert({'a': i, 'b': i} for i in range(1_000_000))
         """
         raise NotImplementedError
 
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import dataclasses
+import hashlib
 import importlib
 import inspect
+import json
 import logging
+import multiprocessing
 import time
 import uuid
 from typing import TYPE_CHECKING, Any, Iterable, Iterator, Literal, Optional
@@ -84,6 +87,11 @@ class TableVersion:
     external_stores: dict[str, pxt.io.ExternalStore]
     store_tbl: 'store.StoreBase'
 
+    # computed columns of smaller tables are always populated serially (see the backfill_workers config parameter)
+    PARALLEL_BACKFILL_MIN_ROWS = 10_000
+    # computed columns of larger tables are populated in resumable chunks (see StoreBase.backfill_column())
+    CHECKPOINTED_BACKFILL_MIN_ROWS = 10_000
+
     @dataclasses.dataclass
     class IndexInfo:
         id: int
@@ -309,7 +317,8 @@ class TableVersion:
                 col_id=col_md.id, name=col_name, col_type=ts.ColumnType.from_dict(col_md.col_type),
                 is_pk=col_md.is_pk, stored=col_md.stored, media_validation=media_val,
                 schema_version_add=col_md.schema_version_add, schema_version_drop=col_md.schema_version_drop,
-                value_expr_dict=col_md.value_expr)
+                value_expr_dict=col_md.value_expr, image_format=col_md.image_format,
+                image_quality=col_md.image_quality)
             col.tbl = self
             self.cols.append(col)
 
@@ -531,6 +540,8 @@ class TableVersion:
             f'Added {status.num_rows} column value{"" if status.num_rows == 1 else "s"} '
             f'with {status.num_excs} error{"" if status.num_excs == 1 else "s"}.'
         )
+        if status.num_resumed_rows > 0:
+            msg += f' Resumed an interrupted attempt: {status.num_resumed_rows} values had already been computed.'
         print(msg)
         _logger.info(f'Columns {[col.name for col in cols]}: {msg}')
         return status
@@ -553,6 +564,8 @@ class TableVersion:
 
         num_excs = 0
         cols_with_excs: list[Column] = []
+        num_resumed_rows = 0
+        stats_plan: Optional[exec.ExecNode] = None
         for col in cols:
             col.schema_version_add = self.schema_version
             # add the column to the lookup structures now, rather than after the store changes executed successfully,
@@ -573,14 +586,39 @@ class TableVersion:
 
             # populate the column
             from pixeltable.plan import Planner
-            plan, value_expr_slot_idx = Planner.create_add_column_plan(self.path, col)
-            plan.ctx.num_rows = row_count
+            num_workers = self._num_backfill_workers(row_count)
+            plan = None
 
             try:
-                plan.ctx.set_conn(conn)
-                plan.open()
                 try:
-                    num_excs = self.store_tbl.load_column(col, plan, value_expr_slot_idx, conn, on_error)
+                    # window functions need to see all rows in order: those columns can't be computed in chunks
+                    has_window_fn = any(
+                        fn_call.is_window_fn_call for fn_call in col.value_expr.subexprs(expr_class=exprs.FunctionCall))
+                    if has_window_fn:
+                        num_workers = 1
+                    if not has_window_fn and (num_workers > 1 or row_count >= self.CHECKPOINTED_BACKFILL_MIN_ROWS):
+                        # this can take a while: make it resumable
+                        plans: list[exec.ExecNode] = []
+
+                        def create_plan(
+                            rowid_ranges: list[tuple[Optional[int], Optional[int]]]
+                        ) -> tuple[exec.ExecNode, Optional[int]]:
+                            plan, value_expr_slot_idx = Planner.create_add_column_plan(self.path, col, rowid_ranges)
+                            plans.append(plan)
+                            return plan, value_expr_slot_idx
+
+                        backfill_key, backfill_md = self._backfill_key(col, on_error, conn)
+                        num_excs, num_resumed_rows = self.store_tbl.backfill_column(
+                            col, create_plan, backfill_key, backfill_md, row_count, num_workers, conn, on_error)
+                        # plans created in worker processes don't show up here
+                        stats_plan = plans[-1] if len(plans) > 0 else None
+                    else:
+                        plan, value_expr_slot_idx = Planner.create_add_column_plan(self.path, col)
+                        plan.ctx.num_rows = row_count
+                        plan.ctx.set_conn(conn)
+                        plan.open()
+                        num_excs = self.store_tbl.load_column(col, plan, value_expr_slot_idx, conn, on_error)
+                        stats_plan = plan
                 except sql.exc.DBAPIError as exc:
                     # Wrap the DBAPIError in an excs.Error to unify processing in the subsequent except block
                     raise excs.Error(f'SQL error during execution of computed column `{col.name}`:\n{exc}') from exc
@@ -599,15 +637,52 @@ class TableVersion:
                 self.store_tbl.create_sa_tbl()
                 raise exc
             finally:
-                plan.close()
-
-        if print_stats:
-            plan.ctx.profile.print(num_rows=row_count)
+                if plan is not None:
+                    plan.close()
+
+        if print_stats and stats_plan is not None:
+            stats_plan.ctx.profile.print(num_rows=row_count)
+            for stage_stats in stats_plan.ctx.stage_stats:
+                print(stage_stats)
+            for download_stats in stats_plan.ctx.download_stats:
+                print(download_stats)
         # TODO(mkornacker): what to do about system columns with exceptions?
         return UpdateStatus(
-            num_rows=row_count, num_computed_values=row_count, num_excs=num_excs,
+            num_rows=row_count, num_computed_values=row_count, num_excs=num_excs, num_resumed_rows=num_resumed_rows,
             cols_with_excs=[f'{col.tbl.name}.{col.name}'for col in cols_with_excs if col.name is not None])
 
+    def _backfill_key(
+        self, col: Column, on_error: Literal['abort', 'ignore'], conn: sql.engine.Connection
+    ) -> tuple[str, dict[str, Any]]:
+        """
+        Returns the key and metadata for StoreBase.backfill_column(): an interrupted backfill can be resumed as long
+        as neither the column definition nor the data it's computed from have changed.
+        """
+        md = {
+            'name': col.name, 'value_expr': col.value_expr.as_dict(), 'stored': col.stored, 'on_error': on_error,
+            'image_format': col.image_format, 'image_quality': col.image_quality,
+        }
+        key_md = {
+            'name': col.name,
+            'value_expr': md['value_expr'],
+            'image_format': col.image_format,
+            'image_quality': col.image_quality,
+            'col_type': col.col_type.as_dict(),
+            'data': [tbl_version.store_tbl.data_version(conn) for tbl_version in self.path.get_tbl_versions()],
+        }
+        key = hashlib.sha256(json.dumps(key_md, sort_keys=True, default=str).encode()).hexdigest()
+        return key, md
+
+    def _num_backfill_workers(self, row_count: int) -> int:
+        """Returns the number of worker processes for populating a computed column of a table with row_count rows"""
+        num_workers = Env.get().config.get_int_value('backfill_workers')
+        if num_workers is None or num_workers <= 1 or row_count < self.PARALLEL_BACKFILL_MIN_ROWS:
+            return 1
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            _logger.info('Parallel backfill requires the fork start method; populating columns serially')
+            return 1
+        return num_workers
+
     def drop_column(self, col: Column) -> None:
         """Drop a column from the table.
         """
@@ -705,14 +780,15 @@ class TableVersion:
 
     def insert(
             self,
-            rows: Optional[list[dict[str, Any]]],
+            rows: Optional[Iterable[dict[str, Any]]],
             df: Optional[pxt.DataFrame],
             conn: Optional[sql.engine.Connection] = None,
             print_stats: bool = False,
             fail_on_exception: bool = True
     ) -> UpdateStatus:
         """
-        Insert rows into this table, either from an explicit list of dicts or from a `DataFrame`.
+        Insert rows into this table, either from an iterable of dicts (which is consumed in chunks) or from a
+        `DataFrame`.
         """
         from pixeltable.plan import Planner
 
@@ -746,8 +822,13 @@ class TableVersion:
         # we're creating a new version
         self.version += 1
         result = UpdateStatus()
-        num_rows, num_excs, cols_with_excs = self.store_tbl.insert_rows(
-            exec_plan, conn, v_min=self.version, rowids=rowids, abort_on_exc=abort_on_exc)
+        try:
+            num_rows, num_excs, cols_with_excs = self.store_tbl.insert_rows(
+                exec_plan, conn, v_min=self.version, rowids=rowids, abort_on_exc=abort_on_exc)
+        except BaseException:
+            # the rows are written in chunks, and the ones that made it into the store need to go away again
+            self._discard_failed_insert(conn)
+            raise
         result.num_rows = num_rows
         result.num_excs = num_excs
         result.num_computed_values += exec_plan.ctx.num_computed_exprs * num_rows
@@ -766,10 +847,20 @@ class TableVersion:
 
         result.cols_with_excs = list(dict.fromkeys(result.cols_with_excs).keys())  # remove duplicates
         if print_stats:
-            plan.ctx.profile.print(num_rows=num_rows)
+            exec_plan.ctx.profile.print(num_rows=num_rows)
+            for stage_stats in exec_plan.ctx.stage_stats:
+                print(stage_stats)
+            for download_stats in exec_plan.ctx.download_stats:
+                print(download_stats)
         _logger.info(f'TableVersion {self.name}: new version {self.version}')
         return result
 
+    def _discard_failed_insert(self, conn: sql.engine.Connection) -> None:
+        """Remove the data of an insert that failed before the new version was recorded"""
+        MediaStore.delete(self.id, version=self.version)
+        conn.execute(sql.delete(self.store_tbl.sa_tbl).where(self.store_tbl.sa_tbl.c.v_min == self.version))
+        self.version -= 1
+
     def update(
         self, value_spec: dict[str, Any], where: Optional[exprs.Expr] = None, cascade: bool = True
     ) -> UpdateStatus:
@@ -1187,7 +1278,8 @@ class TableVersion:
             column_md[col.id] = schema.ColumnMd(
                 id=col.id, col_type=col.col_type.as_dict(), is_pk=col.is_pk,
                 schema_version_add=col.schema_version_add, schema_version_drop=col.schema_version_drop,
-                value_expr=value_expr_dict, stored=col.stored)
+                value_expr=value_expr_dict, stored=col.stored, image_format=col.image_format,
+                image_quality=col.image_quality)
         return column_md
 
     @classmethod
@@ -10,6 +10,7 @@ import traceback
 from pathlib import Path
 from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterator, Optional, Sequence, Union, Literal
 
+import PIL.Image
 import pandas as pd
 import pandas.io.formats.style
 import sqlalchemy as sql
@@ -247,11 +248,26 @@ class DataFrame:
         vars = self._vars()
         return {name: var.col_type for name, var in vars.items()}
 
-    def _exec(self, conn: Optional[sql.engine.Connection] = None) -> Iterator[exprs.DataRow]:
+    def _exec(
+            self, conn: Optional[sql.engine.Connection] = None, batch_size: Optional[int] = None,
+            one_shot: bool = False, query_plan: Optional[exec.ExecNode] = None
+    ) -> Iterator[exprs.DataRow]:
         """Run the query and return rows as a generator.
         This function must not modify the state of the DataFrame, otherwise it breaks dataset caching.
+
+        Args:
+            batch_size: if not None, stream the result: rows are fetched from the store through a server-side cursor,
+                batch_size rows at a time, instead of materializing the entire result set first
+            one_shot: if True, the query is a one-shot scan as far as the file cache is concerned
+            query_plan: if not None, the plan to run instead of the one for this DataFrame
         """
-        plan = self._create_query_plan()
+        plan = query_plan if query_plan is not None else self._create_query_plan()
+        plan.ctx.one_shot_scan = one_shot
+        if batch_size is not None:
+            plan.ctx.stream_results = True
+            if plan.ctx.batch_size == 0:
+                # the plan doesn't need a specific batch size (ie, it doesn't aggregate)
+                plan.ctx.batch_size = batch_size
 
         def exec_plan(conn: sql.engine.Connection) -> Iterator[exprs.DataRow]:
             plan.ctx.set_conn(conn)
@@ -262,7 +278,13 @@ class DataFrame:
             finally:
                 plan.close()
 
-        if conn is None:
+        if conn is None and batch_size is not None:
+            # server-side cursors only exist within a transaction; REPEATABLE READ gives us a consistent snapshot
+            # for the duration of the scan
+            with Env.get().engine.connect().execution_options(isolation_level='REPEATABLE READ') as conn, \
+                    conn.begin():
+                yield from exec_plan(conn)
+        elif conn is None:
             with Env.get().engine.begin() as conn:
                 yield from exec_plan(conn)
         else:
@@ -392,9 +414,12 @@ class DataFrame:
             group_by_clause=group_by_clause, grouping_tbl=self.grouping_tbl,
             order_by_clause=order_by_clause, limit=self.limit_val)
 
-    def _output_row_iterator(self, conn: Optional[sql.engine.Connection] = None) -> Iterator[list]:
+    def _output_row_iterator(
+            self, conn: Optional[sql.engine.Connection] = None, batch_size: Optional[int] = None,
+            one_shot: bool = False, query_plan: Optional[exec.ExecNode] = None
+    ) -> Iterator[list]:
         try:
-            for data_row in self._exec(conn):
+            for data_row in self._exec(conn, batch_size=batch_size, one_shot=one_shot, query_plan=query_plan):
                 yield [data_row[e.slot_idx] for e in self._select_list_exprs]
         except excs.ExprEvalError as e:
             msg = f'In row {e.row_num} the {e.expr_msg} encountered exception ' f'{type(e.exc).__name__}:\n{str(e.exc)}'
@@ -415,11 +440,63 @@ class DataFrame:
         except sql.exc.DBAPIError as e:
             raise excs.Error(f'Error during SQL execution:\n{e}')
 
-    def collect(self) -> DataFrameResultSet:
-        return self._collect()
+    def collect(self, *, one_shot: bool = False) -> DataFrameResultSet:
+        """Run the query and return its result.
+
+        Args:
+            one_shot: If `True`, this is a one-shot scan: media files that need to be downloaded are evicted from the
+                file cache ahead of the files used by other queries, and cached files read by this query don't
+                count as accesses. Use this for large scans that would otherwise flush the cache.
+        """
+        return self._collect(one_shot=one_shot)
+
+    def _collect(self, conn: Optional[sql.engine.Connection] = None, one_shot: bool = False) -> DataFrameResultSet:
+        return DataFrameResultSet(list(self._output_row_iterator(conn, one_shot=one_shot)), self.schema)
+
+    def iter_batches(self, batch_size: int = 1024, *, one_shot: bool = False) -> Iterator[DataFrameResultSet]:
+        """Run the query and return its result incrementally, as a sequence of result sets of batch_size rows each
+        (the last one can be smaller).
+
+        In contrast to collect(), the result is streamed from the store through a server-side cursor, and memory
+        consumption is bounded by the batch size rather than the size of the result. The query runs in a single
+        transaction, which stays open until the iterator is exhausted or closed.
+
+        Args:
+            batch_size: Number of rows per batch. Default is 1024.
+            one_shot: If `True`, this is a one-shot scan; see [`collect()`][pixeltable.DataFrame.collect].
+
+        Returns:
+            An iterator over DataFrameResultSets.
+
+        Examples:
+            >>> for batch in t.select(t.img, t.label).iter_batches(batch_size=256):
+            ...     train_step(batch['img'], batch['label'])
+        """
+        if not isinstance(batch_size, int) or isinstance(batch_size, bool) or batch_size < 1:
+            raise excs.Error(f'batch_size must be a positive integer, got {batch_size!r}')
+        rows: list[list[Any]] = []
+        for row in self._output_row_iterator(batch_size=batch_size, one_shot=one_shot):
+            rows.append(row)
+            if len(rows) == batch_size:
+                yield DataFrameResultSet(rows, self.schema)
+                rows = []
+        if len(rows) > 0:
+            yield DataFrameResultSet(rows, self.schema)
+
+    def iter_rows(self, batch_size: int = 1024, *, one_shot: bool = False) -> Iterator[dict[str, Any]]:
+        """Run the query and return its result incrementally, one row at a time, as a dict.
+
+        The result is fetched from the store in batches of batch_size rows; see iter_batches().
+
+        Args:
+            batch_size: Number of rows that are fetched at a time. Default is 1024.
+            one_shot: If `True`, this is a one-shot scan; see [`collect()`][pixeltable.DataFrame.collect].
 
-    def _collect(self, conn: Optional[sql.engine.Connection] = None) -> DataFrameResultSet:
-        return DataFrameResultSet(list(self._output_row_iterator(conn)), self.schema)
+        Returns:
+            An iterator over dicts that map column names to values.
+        """
+        for batch in self.iter_batches(batch_size=batch_size, one_shot=one_shot):
+            yield from batch
 
     def count(self) -> int:
         """Return the number of rows in the DataFrame.
@@ -435,6 +512,87 @@ class DataFrame:
             assert isinstance(result, int)
             return result
 
+    def similarity_search(
+            self, col: exprs.ColumnRef, items: Sequence[Any], *, k: int = 10, idx: Optional[str] = None,
+            ef_search: Optional[int] = None, probes: Optional[int] = None
+    ) -> list[DataFrameResultSet]:
+        """Find the k rows that are most similar to each of a list of query items, according to an embedding index.
+
+        This returns the same rows as running `df.select(..., sim=col.similarity(item)).order_by(sim, asc=False)
+        .limit(k)` once per item, but is much faster for a large number of items: the items are embedded together
+        (in batches, if the embedding function is batched), and all searches run as a single query.
+
+        Args:
+            col: The column with the embedding index.
+            items: The query items (strings or images).
+            k: The number of rows to return per item.
+            idx: The name of the index to use; required if the column has more than one embedding index.
+            ef_search: For `'hnsw'` indices: see `similarity()`.
+            probes: For `'ivfflat'` indices: see `similarity()`.
+
+        Returns:
+            A list with one DataFrameResultSet per item, in the order of `items`. Each result set contains the
+            columns of this DataFrame plus a `similarity` column, ordered by decreasing similarity (or increasing
+            distance, for the `l2` metric), and only contains rows that satisfy the where clause.
+
+        Raises:
+            Error: If the DataFrame contains joins, groupings, an ordering or a limit, if its where clause can't be
+                evaluated by the store, or if the column doesn't have a suitable embedding index.
+
+        Examples:
+            >>> results = t.select(t.id, t.text).similarity_search(t.text, ['query 1', 'query 2'], k=5)
+            >>> results[1]  # the 5 rows closest to 'query 2'
+        """
+        if not isinstance(col, exprs.ColumnRef):
+            raise excs.Error(f'similarity_search(): col must be a column reference, not {col!r}')
+        if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            raise excs.Error(f'similarity_search(): k must be a positive integer, got {k!r}')
+        if (self._has_joins() or self.group_by_clause is not None or self.grouping_tbl is not None
+                or self.order_by_clause is not None or self.limit_val is not None):
+            raise excs.Error(
+                'similarity_search(): not supported for DataFrames with join(), group_by(), order_by() or limit()')
+        items = list(items)
+        if len(items) == 0:
+            return []
+        for item in items:
+            if not isinstance(item, (str, PIL.Image.Image)):
+                raise excs.Error(
+                    f'similarity_search(): query items must be strings or PIL.Image.Image objects, not {type(item)}')
+
+        # this also verifies that there is a matching index, and that it can embed items of each type
+        sim_exprs = [
+            col.similarity(
+                next(item for item in items if isinstance(item, item_type)), idx=idx, ef_search=ef_search,
+                probes=probes)
+            for item_type in (str, PIL.Image.Image) if any(isinstance(item, item_type) for item in items)
+        ]
+        sim_expr = sim_exprs[0]
+        assert isinstance(sim_expr, exprs.SimilarityExpr)
+        embeddings = sim_expr.idx_info.idx.embed_queries(items)
+
+        search_df = DataFrame(
+            from_clause=self._from_clause,
+            select_list=[
+                *((e, name) for e, name in zip(self._select_list_exprs, self._schema.keys())), (sim_expr, None)
+            ],
+            where_clause=self.where_clause)
+        query_plan = search_df._create_query_plan()
+        scan_node = query_plan.get_node(exec.SqlScanNode)
+        assert scan_node is not None
+        if scan_node.py_filter is not None:
+            raise excs.Error(
+                f'similarity_search(): the where clause needs to be evaluated by the store, which is not possible for '
+                f'{scan_node.py_filter}')
+        scan_node.set_similarity_search(sim_expr, embeddings, k)
+
+        rows = list(search_df._output_row_iterator(query_plan=query_plan))
+        # the scan node returns the rows of each query contiguously, in the order of the query idxs
+        assert len(rows) == len(scan_node.query_idxs)
+        results: list[list[list]] = [[] for _ in items]
+        for query_idx, row in zip(scan_node.query_idxs, rows):
+            results[query_idx].append(row)
+        return [DataFrameResultSet(result_rows, search_df.schema) for result_rows in results]
+
     def _descriptors(self) -> DescriptionHelper:
         helper = DescriptionHelper()
         helper.append(self._col_descriptor())
@@ -26,6 +26,7 @@ from tqdm import TqdmWarning
 
 import pixeltable.exceptions as excs
 from pixeltable import metadata
+from pixeltable.utils import register_fork_reset
 from pixeltable.utils.http_server import make_server
 
 if TYPE_CHECKING:
@@ -100,6 +101,7 @@ class Env:
         self._spacy_nlp = None
         self._httpd = None
         self._http_address = None
+        self._client_lock = threading.Lock()  # clients can be requested concurrently by I/O-bound udfs
 
         # logging-related state
         self._logger = logging.getLogger('pixeltable')
@@ -431,6 +433,23 @@ class Env:
     def _upgrade_metadata(self) -> None:
         metadata.upgrade_md(self._sa_engine)
 
+    @classmethod
+    def _reset_after_fork(cls) -> None:
+        """
+        Runs in a forked process (eg, a worker for UDFs with executor='process'): the child must not share the
+        parent's database and client connections; it creates its own if it needs them.
+        """
+        env = cls._instance
+        if env is None:
+            return
+        if env._sa_engine is not None:
+            # leave the parent's connections alone
+            env._sa_engine.dispose(close=False)
+        env._client_lock = threading.Lock()  # might have been held by another thread at the time of the fork
+        for cl in _registered_clients.values():
+            # each worker initializes its own clients on first use
+            cl.client_obj = None
+
     def get_client(self, name: str) -> Any:
         """
         Gets the client with the specified name, initializing it if necessary.
@@ -442,23 +461,27 @@ class Env:
         if cl.client_obj is not None:
             return cl.client_obj  # Already initialized
 
-        # Construct a client, retrieving each parameter from config.
+        with self._client_lock:
+            if cl.client_obj is not None:
+                return cl.client_obj  # Initialized by another thread
 
-        init_kwargs: dict[str, str] = {}
-        for param in cl.param_names:
-            arg = self._config.get_string_value(param, section=name)
-            if arg is not None and len(arg) > 0:
-                init_kwargs[param] = arg
-            else:
-                raise excs.Error(
-                    f'`{name}` client not initialized: parameter `{param}` is not configured.\n'
-                    f'To fix this, specify the `{name.upper()}_{param.upper()}` environment variable, or put `{param.lower()}` in '
-                    f'the `{name.lower()}` section of $PIXELTABLE_HOME/config.toml.'
-                )
+            # Construct a client, retrieving each parameter from config.
+
+            init_kwargs: dict[str, str] = {}
+            for param in cl.param_names:
+                arg = self._config.get_string_value(param, section=name)
+                if arg is not None and len(arg) > 0:
+                    init_kwargs[param] = arg
+                else:
+                    raise excs.Error(
+                        f'`{name}` client not initialized: parameter `{param}` is not configured.\n'
+                        f'To fix this, specify the `{name.upper()}_{param.upper()}` environment variable, or put `{param.lower()}` in '
+                        f'the `{name.lower()}` section of $PIXELTABLE_HOME/config.toml.'
+                    )
 
-        cl.client_obj = cl.init_fn(**init_kwargs)
-        self._logger.info(f'Initialized `{name}` client.')
-        return cl.client_obj
+            cl.client_obj = cl.init_fn(**init_kwargs)
+            self._logger.info(f'Initialized `{name}` client.')
+            return cl.client_obj
 
     def _start_web_server(self) -> None:
         """
@@ -745,6 +768,9 @@ class Config:
         return self.get_value(key, bool, section)
 
 
+register_fork_reset(Env._reset_after_fork)
+
+
 _registered_clients: dict[str, ApiClient] = {}
 
 
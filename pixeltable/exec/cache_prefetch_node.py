@@ -4,6 +4,7 @@ import dataclasses
 import itertools
 import logging
 import threading
+import time
 import urllib.parse
 import urllib.request
 from collections import deque
@@ -12,6 +13,9 @@ from pathlib import Path
 from typing import Optional, Any, Iterator
 from uuid import UUID
 
+import requests
+import requests.adapters
+
 import pixeltable.env as env
 import pixeltable.exceptions as excs
 import pixeltable.exprs as exprs
@@ -27,16 +31,143 @@ _logger = logging.getLogger('pixeltable')
 class CachePrefetchNode(ExecNode):
     """Brings files with external URLs into the cache
 
-    TODO:
-    - adapting the number of download threads at runtime to maximize throughput
+    The number of concurrent downloads is adapted at runtime to the observed throughput and error rate (see
+    ConcurrencyTuner). HTTP downloads go through a session that keeps a pool of connections per host, and they're
+    streamed to disk in chunks.
+
+    Files that are larger than the part size (the `download_part_size_m` config parameter) are downloaded as parts
+    in parallel, so that a single large file isn't limited by the throughput of a single connection: S3 files via
+    multipart downloads, HTTP files via range requests (if the server supports them). The parts are written directly
+    into their place in the downloaded file.
     """
     BATCH_SIZE = 16
-    NUM_EXECUTOR_THREADS = 16
+    # bounds on the number of concurrent downloads
+    MIN_CONCURRENCY = 2
+    INITIAL_CONCURRENCY = 16
+    MAX_CONCURRENCY = 64
+    # max. number of rows we hold on to while keeping the download slots busy
+    MAX_PENDING_ROWS = 1024
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 30
+    CHUNK_SIZE = 1 << 20  # size of the chunks in which HTTP downloads are written to disk
+    DEFAULT_PART_SIZE_M = 16
+    # max. number of parts that are downloaded in parallel, across all files
+    PART_CONCURRENCY = 8
+
+    @dataclasses.dataclass
+    class Stats:
+        """Download metrics"""
+        num_downloads: int = 0
+        num_errors: int = 0
+        num_bytes: int = 0
+        busy_time: float = 0.0  # wall-clock time during which requests were in flight
+        max_queue_depth: int = 0  # max. number of urls waiting for a download slot
+        min_concurrency: int = 0
+        max_concurrency: int = 0
+
+        @property
+        def bytes_per_s(self) -> float:
+            return self.num_bytes / self.busy_time if self.busy_time > 0 else 0.0
+
+        def __str__(self) -> str:
+            return (
+                f'CachePrefetchNode: {self.num_downloads} downloads ({self.num_errors} errors), '
+                f'{self.num_bytes} bytes in {self.busy_time:.3f}s ({self.bytes_per_s / (1 << 20):.2f} MiB/s), '
+                f'max_queue_depth={self.max_queue_depth}, '
+                f'concurrency={self.min_concurrency}-{self.max_concurrency}'
+            )
+
+    class ConcurrencyTuner:
+        """
+        Adapts the number of concurrent downloads to the observed throughput (by hill climbing) and error rate.
+
+        Completed requests are evaluated in windows of WINDOW_SIZE requests: if the throughput of a window improved on
+        that of the previous one, we keep moving the concurrency in the same direction, if it got worse we reverse
+        direction. If it didn't change noticeably, we try to get by with fewer connections. Windows during which we
+        couldn't keep `concurrency` requests in flight (eg, because we ran out of input or the consumer fell behind)
+        say nothing about the effect of the concurrency and are ignored. A high error rate (eg, because the server
+        throttles us) cuts the concurrency in half.
+        """
+        WINDOW_SIZE = 16
+        MAX_ERROR_RATE = 0.1
+        NOISE_THRESHOLD = 0.05  # relative throughput changes below this are treated as noise
+
+        concurrency: int
+        min_concurrency: int
+        max_concurrency: int
+        direction: int  # +1 or -1
+        prev_throughput: Optional[float]  # bytes/s of the last evaluated window
+
+        # current window
+        window_start: float
+        window_requests: int
+        window_errors: int
+        window_bytes: int
+        window_saturated: bool  # True if `concurrency` requests were in flight for every completion
+
+        def __init__(self, initial: int, min_concurrency: int, max_concurrency: int):
+            self.concurrency = initial
+            self.min_concurrency = min_concurrency
+            self.max_concurrency = max_concurrency
+            self.direction = 1
+            self.prev_throughput = None
+            self._reset_window()
+
+        def _reset_window(self) -> None:
+            self.window_start = time.perf_counter()
+            self.window_requests = 0
+            self.window_errors = 0
+            self.window_bytes = 0
+            self.window_saturated = True
+
+        def record(self, num_bytes: int, is_error: bool, saturated: bool) -> None:
+            """Records a completed request
+
+            Args:
+                num_bytes: the number of bytes downloaded by the request
+                is_error: True if the request failed
+                saturated: True if all download slots were occupied when the request completed
+            """
+            self.window_requests += 1
+            self.window_errors += int(is_error)
+            self.window_bytes += num_bytes
+            self.window_saturated = self.window_saturated and saturated
+            if self.window_requests < self.WINDOW_SIZE:
+                return
+
+            throughput = self.window_bytes / max(time.perf_counter() - self.window_start, 1e-6)
+            if self.window_errors / self.window_requests > self.MAX_ERROR_RATE:
+                self._set_concurrency(self.concurrency // 2)
+                # start probing upwards again once the errors subside
+                self.direction = 1
+                self.prev_throughput = None
+            elif self.window_saturated and self.window_bytes > 0:
+                if self.prev_throughput is not None:
+                    change = (throughput - self.prev_throughput) / max(self.prev_throughput, 1e-6)
+                    if change < -self.NOISE_THRESHOLD:
+                        self.direction = -self.direction
+                    elif change <= self.NOISE_THRESHOLD:
+                        self.direction = -1
+                self._set_concurrency(self.concurrency + self.direction * max(1, self.concurrency // 4))
+                self.prev_throughput = throughput
+            self._reset_window()
+
+        def _set_concurrency(self, concurrency: int) -> None:
+            concurrency = min(max(concurrency, self.min_concurrency), self.max_concurrency)
+            if concurrency != self.concurrency:
+                _logger.debug(f'download concurrency: {self.concurrency} -> {concurrency}')
+            self.concurrency = concurrency
 
     retain_input_order: bool  # if True, return rows in the exact order they were received
     file_col_info: list[exprs.ColumnSlotIdx]
     boto_client: Optional[Any]
     boto_client_lock: threading.Lock
+    http_session: Optional[requests.Session]
+    http_session_lock: threading.Lock
+    part_size: int  # in bytes; 0: don't split up downloads
+    part_executor: Optional[futures.ThreadPoolExecutor]  # downloads the parts of ranged HTTP downloads
+    tuner: ConcurrencyTuner
+    stats: Stats
 
     # execution state
     batch_tbl_version: Optional[catalog.TableVersion]  # needed to construct output batches
@@ -49,6 +180,8 @@ class CachePrefetchNode(ExecNode):
     in_flight_rows: dict[int, CachePrefetchNode.RowState]  # rows with in-flight urls; id(row) -> RowState
     in_flight_requests: dict[futures.Future, str]  # in-flight requests for urls; future -> URL
     in_flight_urls: dict[str, list[tuple[exprs.DataRow, exprs.ColumnSlotIdx]]]  # URL -> [(row, info)]
+    queued_urls: deque[str]  # cache misses that are waiting for a download slot
+    busy_start: float  # time at which the in-flight requests went from 0 to 1
     input_finished: bool
     row_idx: Iterator[Optional[int]]
 
@@ -69,6 +202,13 @@ class CachePrefetchNode(ExecNode):
         # clients for specific services are constructed as needed, because it's time-consuming
         self.boto_client = None
         self.boto_client_lock = threading.Lock()
+        self.http_session = None
+        self.http_session_lock = threading.Lock()
+        part_size_m = env.Env.get().config.get_int_value('download_part_size_m')
+        self.part_size = (part_size_m if part_size_m is not None else self.DEFAULT_PART_SIZE_M) << 20
+        self.part_executor = None
+        self.tuner = self.ConcurrencyTuner(self.INITIAL_CONCURRENCY, self.MIN_CONCURRENCY, self.MAX_CONCURRENCY)
+        self.stats = self.Stats(min_concurrency=self.INITIAL_CONCURRENCY, max_concurrency=self.INITIAL_CONCURRENCY)
 
         self.batch_tbl_version = None
         self.num_returned_rows = 0
@@ -76,23 +216,40 @@ class CachePrefetchNode(ExecNode):
         self.in_flight_rows = {}
         self.in_flight_requests = {}
         self.in_flight_urls = {}
+        self.queued_urls = deque()
+        self.busy_start = 0.0
         self.input_finished = False
         self.row_idx = itertools.count() if retain_input_order else itertools.repeat(None)
 
+    def _open(self) -> None:
+        self.ctx.download_stats.append(self.stats)
+
+    def _close(self) -> None:
+        if self.http_session is not None:
+            self.http_session.close()
+            self.http_session = None
+        if self.part_executor is not None:
+            self.part_executor.shutdown()
+            self.part_executor = None
+        _logger.debug(str(self.stats))
+
     def __iter__(self) -> Iterator[DataRowBatch]:
         input_iter = iter(self.input)
-        with futures.ThreadPoolExecutor(max_workers=self.NUM_EXECUTOR_THREADS) as executor:
+        with futures.ThreadPoolExecutor(max_workers=self.MAX_CONCURRENCY) as executor:
             # we create enough in-flight requests to fill the first batch
-            while not self.input_finished and self.__num_pending_rows() < self.BATCH_SIZE:
+            while self.__needs_input():
                 self.__submit_input_batch(input_iter, executor)
 
             while True:
                 # try to assemble a full batch of output rows
                 if not self.__has_ready_batch() and len(self.in_flight_requests) > 0:
-                    self.__wait_for_requests()
+                    self.__wait_for_requests(executor)
+                else:
+                    # free up the download slots of requests that completed in the meantime
+                    self.__collect_requests(executor, block=False)
 
-                # try to create enough in-flight requests to fill the next batch
-                while not self.input_finished and self.__num_pending_rows() < self.BATCH_SIZE:
+                # try to create enough in-flight requests to fill the next batch and keep the download slots busy
+                while self.__needs_input():
                     self.__submit_input_batch(input_iter, executor)
 
                 if len(self.ready_rows) > 0:
@@ -112,6 +269,17 @@ class CachePrefetchNode(ExecNode):
     def __num_pending_rows(self) -> int:
         return len(self.in_flight_rows) + len(self.ready_rows)
 
+    def __needs_input(self) -> bool:
+        if self.input_finished:
+            return False
+        if self.__num_pending_rows() < self.BATCH_SIZE:
+            return True
+        # read ahead to keep the download slots busy, but only up to a point
+        return (
+            len(self.in_flight_requests) + len(self.queued_urls) < self.tuner.concurrency
+            and self.__num_pending_rows() < self.MAX_PENDING_ROWS
+        )
+
     def __has_ready_batch(self) -> bool:
         """True if there are >= BATCH_SIZES entries in ready_rows and the first BATCH_SIZE ones are all non-None"""
         return (
@@ -132,36 +300,51 @@ class CachePrefetchNode(ExecNode):
                 self.ready_rows.extend([None] * (idx - len(self.ready_rows) + 1))
             self.ready_rows[idx] = row
 
-    def __wait_for_requests(self) -> None:
+    def __wait_for_requests(self, executor: futures.ThreadPoolExecutor) -> None:
         """Wait for in-flight requests to complete until we have a full batch of rows"""
-        file_cache = FileCache.get()
         _logger.debug(f'waiting for requests; ready_batch_size={self.__ready_prefix_len()}')
         while not self.__has_ready_batch() and len(self.in_flight_requests) > 0:
-            done, _ = futures.wait(self.in_flight_requests, return_when=futures.FIRST_COMPLETED)
-            for f in done:
-                url = self.in_flight_requests.pop(f)
-                tmp_path, exc = f.result()
-                local_path: Optional[Path] = None
-                if tmp_path is not None:
-                    # register the file with the cache for the first column in which it's missing
-                    assert url in self.in_flight_urls
-                    _, info = self.in_flight_urls[url][0]
-                    local_path = file_cache.add(info.col.tbl.id, info.col.id, url, tmp_path)
-                    _logger.debug(f'cached {url} as {local_path}')
-
-                # add the local path/exception to the slots that reference the url
-                for row, info in self.in_flight_urls.pop(url):
-                    if exc is not None:
-                        self.row_builder.set_exc(row, info.slot_idx, exc)
-                    else:
-                        assert local_path is not None
-                        row.set_file_path(info.slot_idx, str(local_path))
-                    state = self.in_flight_rows[id(row)]
-                    state.num_missing -= 1
-                    if state.num_missing == 0:
-                        del self.in_flight_rows[id(row)]
-                        self.__add_ready_row(row, state.idx)
-                        _logger.debug(f'row {state.idx} is ready (ready_batch_size={self.__ready_prefix_len()})')
+            self.__collect_requests(executor, block=True)
+
+    def __collect_requests(self, executor: futures.ThreadPoolExecutor, block: bool) -> None:
+        """Processes completed requests and submits queued urls in their place
+
+        Args:
+            block: if True, waits for at least one request to complete
+        """
+        if len(self.in_flight_requests) == 0:
+            return
+        done, _ = futures.wait(
+            self.in_flight_requests, timeout=None if block else 0, return_when=futures.FIRST_COMPLETED)
+        for f in done:
+            saturated = len(self.in_flight_requests) >= self.tuner.concurrency
+            url = self.in_flight_requests.pop(f)
+            local_path, exc, num_bytes = f.result()
+            self.tuner.record(num_bytes, exc is not None, saturated)
+            self.stats.num_downloads += int(num_bytes > 0)
+            self.stats.num_errors += int(exc is not None)
+            self.stats.num_bytes += num_bytes
+            if local_path is not None:
+                _logger.debug(f'cached {url} as {local_path}')
+
+            # add the local path/exception to the slots that reference the url
+            for row, info in self.in_flight_urls.pop(url):
+                if exc is not None:
+                    self.row_builder.set_exc(row, info.slot_idx, exc)
+                else:
+                    assert local_path is not None
+                    row.set_file_path(info.slot_idx, str(local_path))
+                state = self.in_flight_rows[id(row)]
+                state.num_missing -= 1
+                if state.num_missing == 0:
+                    del self.in_flight_rows[id(row)]
+                    self.__add_ready_row(row, state.idx)
+                    _logger.debug(f'row {state.idx} is ready (ready_batch_size={self.__ready_prefix_len()})')
+        if len(self.in_flight_requests) == 0:
+            self.stats.busy_time += time.perf_counter() - self.busy_start
+        self.stats.min_concurrency = min(self.stats.min_concurrency, self.tuner.concurrency)
+        self.stats.max_concurrency = max(self.stats.max_concurrency, self.tuner.concurrency)
+        self.__submit_queued_urls(executor)
 
     def __submit_input_batch(self, input: Iterator[DataRowBatch], executor: futures.ThreadPoolExecutor) -> None:
         assert not self.input_finished
@@ -197,7 +380,7 @@ class CachePrefetchNode(ExecNode):
                     num_missing += 1
                     continue
 
-                local_path = file_cache.lookup(url)
+                local_path = file_cache.lookup(url, scan=self.ctx.one_shot_scan)
                 if local_path is None:
                     cache_misses.append(url)
                     self.in_flight_urls[url] = [(row, info)]
@@ -212,14 +395,54 @@ class CachePrefetchNode(ExecNode):
             else:
                 self.__add_ready_row(row, row_idx)
 
-        _logger.debug(f'submitting {len(cache_misses)} urls')
+        _logger.debug(f'queueing {len(cache_misses)} urls')
         for url in cache_misses:
-            f = executor.submit(self.__fetch_url, url)
-            _logger.debug(f'submitted {url} for idx {url_pos[url]}')
+            _logger.debug(f'queued {url} for idx {url_pos[url]}')
+        self.queued_urls.extend(cache_misses)
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self.queued_urls))
+        self.__submit_queued_urls(executor)
+
+    def __submit_queued_urls(self, executor: futures.ThreadPoolExecutor) -> None:
+        """Submits queued urls until all download slots are occupied"""
+        while len(self.queued_urls) > 0 and len(self.in_flight_requests) < self.tuner.concurrency:
+            url = self.queued_urls.popleft()
+            if len(self.in_flight_requests) == 0:
+                self.busy_start = time.perf_counter()
+            # the file gets registered with the cache for the first column in which it's missing
+            _, info = self.in_flight_urls[url][0]
+            f = executor.submit(self.__fetch_url, url, info.col)
             self.in_flight_requests[f] = url
 
-    def __fetch_url(self, url: str) -> tuple[Optional[Path], Optional[Exception]]:
-        """Fetches a remote URL into Env.tmp_dir and returns its path"""
+    def __fetch_url(self, url: str, col: catalog.Column) -> tuple[Optional[Path], Optional[Exception], int]:
+        """Fetches a remote URL into the file cache
+
+        If another process (or node) is already fetching the same URL, this waits for it instead.
+
+        Returns:
+            the path of the cached file, the exception (if the download failed and we ignore errors) and the number
+            of bytes we downloaded
+        """
+        num_bytes = 0
+
+        def download() -> Path:
+            nonlocal num_bytes
+            path = self.__download(url)
+            num_bytes = path.stat().st_size
+            return path
+
+        try:
+            local_path = FileCache.get().fetch(col.tbl.id, col.id, url, download, scan=self.ctx.one_shot_scan)
+            return local_path, None, num_bytes
+        except Exception as e:
+            # we want to add the file url to the exception message
+            exc = excs.Error(f'Failed to download {url}: {e}')
+            _logger.debug(f'Failed to download {url}: {e}', exc_info=e)
+            if not self.ctx.ignore_errors:
+                raise exc from None  # suppress original exception
+            return None, exc, num_bytes
+
+    def __download(self, url: str) -> Path:
+        """Downloads a remote URL into Env.tmp_dir and returns its path"""
         _logger.debug(f'fetching url={url} thread_name={threading.current_thread().name}')
         parsed = urllib.parse.urlparse(url)
         # Use len(parsed.scheme) > 1 here to ensure we're not being passed
@@ -231,32 +454,161 @@ class CachePrefetchNode(ExecNode):
             p = Path(urllib.parse.unquote(urllib.request.url2pathname(parsed.path)))
             extension = p.suffix
         tmp_path = env.Env.get().create_tmp_path(extension=extension)
+        _logger.debug(f'Downloading {url} to {tmp_path}')
         try:
-            _logger.debug(f'Downloading {url} to {tmp_path}')
             if parsed.scheme == 's3':
                 from pixeltable.utils.s3 import get_client
                 with self.boto_client_lock:
                     if self.boto_client is None:
                         config = {
-                            'max_pool_connections': self.NUM_EXECUTOR_THREADS + 4,  # +4: leave some headroom
-                            'connect_timeout': 5,
-                            'read_timeout': 30,
+                            # +4: leave some headroom
+                            'max_pool_connections': self.MAX_CONCURRENCY + self.PART_CONCURRENCY + 4,
+                            'connect_timeout': self.CONNECT_TIMEOUT,
+                            'read_timeout': self.READ_TIMEOUT,
                             'retries': {'max_attempts': 3, 'mode': 'adaptive'},
                         }
                         self.boto_client = get_client(**config)
-                self.boto_client.download_file(parsed.netloc, parsed.path.lstrip('/'), str(tmp_path))
+                from boto3.s3.transfer import TransferConfig
+                if self.part_size > 0:
+                    transfer_config = TransferConfig(
+                        multipart_threshold=self.part_size, multipart_chunksize=self.part_size,
+                        max_concurrency=self.PART_CONCURRENCY)
+                else:
+                    transfer_config = TransferConfig(use_threads=False, multipart_threshold=1 << 62)
+                self.boto_client.download_file(
+                    parsed.netloc, parsed.path.lstrip('/'), str(tmp_path), Config=transfer_config)
             elif parsed.scheme == 'http' or parsed.scheme == 'https':
-                with urllib.request.urlopen(url) as resp, open(tmp_path, 'wb') as f:
-                    data = resp.read()
-                    f.write(data)
+                self.__http_download(url, tmp_path)
             else:
                 assert False, f'Unsupported URL scheme: {parsed.scheme}'
-            _logger.debug(f'Downloaded {url} to {tmp_path}')
-            return tmp_path, None
-        except Exception as e:
-            # we want to add the file url to the exception message
-            exc = excs.Error(f'Failed to download {url}: {e}')
-            _logger.debug(f'Failed to download {url}: {e}', exc_info=e)
-            if not self.ctx.ignore_errors:
-                raise exc from None  # suppress original exception
-            return None, exc
+        except BaseException:
+            # don't leave partial downloads behind
+            tmp_path.unlink(missing_ok=True)
+            raise
+        _logger.debug(f'Downloaded {url} to {tmp_path}')
+        return tmp_path
+
+    def __http_download(self, url: str, path: Path) -> None:
+        """Downloads url to path, as parallel parts if the file is large and the server supports range requests"""
+        session = self.__get_http_session()
+        headers: dict[str, str] = {}
+        if self.part_size > 0:
+            # the first part also tells us whether the server supports ranges, and how large the file is;
+            # ranges refer to the encoded content, so we can't have it compressed
+            headers = {'Range': f'bytes=0-{self.part_size - 1}', 'Accept-Encoding': 'identity'}
+        part_futures: list[futures.Future] = []
+        try:
+            with session.get(
+                url, headers=headers, stream=True, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT)
+            ) as resp, open(path, 'wb') as f:
+                resp.raise_for_status()
+                file_size = self.__ranged_file_size(resp)
+                if file_size is not None and file_size > self.part_size:
+                    # make room for all parts and fetch the remaining ones while we're receiving the first one
+                    f.truncate(file_size)
+                    validator = self.__range_validator(resp)
+                    part_executor = self.__get_part_executor()
+                    part_futures = [
+                        part_executor.submit(
+                            self.__download_part, session, url, path, start,
+                            min(start + self.part_size, file_size) - 1, validator)
+                        for start in range(self.part_size, file_size, self.part_size)
+                    ]
+                num_bytes = 0
+                for chunk in resp.iter_content(chunk_size=self.CHUNK_SIZE):
+                    f.write(chunk)
+                    num_bytes += len(chunk)
+            if len(part_futures) == 0:
+                # the server sent us the entire file
+                return
+            if num_bytes != self.part_size:
+                raise excs.Error(f'Expected {self.part_size} bytes for range 0-{self.part_size - 1}, '
+                                 f'but received {num_bytes}')
+            is_complete = True
+            for future in futures.as_completed(part_futures):
+                is_complete &= future.result()
+        except BaseException:
+            for future in part_futures:
+                future.cancel()
+            futures.wait(part_futures)  # don't let parts write to the file after it's been removed
+            raise
+        if not is_complete:
+            # the file changed while we were downloading it, or the server stopped honoring ranges
+            _logger.debug(f'Range requests for {url} were answered with the entire file; downloading it in one go')
+            self.__single_stream_download(session, url, path)
+            return
+        _logger.debug(f'Downloaded {url} in {len(part_futures) + 1} parts')
+
+    def __single_stream_download(self, session: requests.Session, url: str, path: Path) -> None:
+        """Downloads the entire file at url to path with a single request"""
+        with session.get(
+            url, stream=True, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT)
+        ) as resp, open(path, 'wb') as f:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=self.CHUNK_SIZE):
+                f.write(chunk)
+
+    @classmethod
+    def __range_validator(cls, resp: requests.Response) -> Optional[str]:
+        """Returns the If-Range value that makes sure the parts come from the same version of the file as resp"""
+        etag = resp.headers.get('ETag')
+        # If-Range requires a strong validator: weak ETags never match
+        if etag is not None and not etag.startswith('W/'):
+            return etag
+        return resp.headers.get('Last-Modified')
+
+    @classmethod
+    def __ranged_file_size(cls, resp: requests.Response) -> Optional[int]:
+        """Returns the size of the entire file if resp is a partial response, otherwise None"""
+        if resp.status_code != 206:
+            # the server ignored the range
+            return None
+        # Content-Range: bytes <start>-<end>/<size>
+        content_range = resp.headers.get('Content-Range', '')
+        _, _, size = content_range.partition('/')
+        return int(size) if size.isdigit() else None
+
+    def __download_part(
+            self, session: requests.Session, url: str, path: Path, start: int, end: int, validator: Optional[str]
+    ) -> bool:
+        """
+        Downloads bytes start..end (inclusive) of url into their place in path.
+        Returns False if the server responded with the entire file instead, which we don't read.
+        """
+        headers = {'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}
+        if validator is not None:
+            # if the file changed in the meantime, we get the entire new file instead of a part of it
+            headers['If-Range'] = validator
+        with session.get(
+            url, headers=headers, stream=True, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT)
+        ) as resp, open(path, 'r+b') as f:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                return False
+            f.seek(start)
+            num_bytes = 0
+            for chunk in resp.iter_content(chunk_size=self.CHUNK_SIZE):
+                f.write(chunk)
+                num_bytes += len(chunk)
+        if num_bytes != end - start + 1:
+            raise excs.Error(f'Expected {end - start + 1} bytes for range {start}-{end}, but received {num_bytes}')
+        return True
+
+    def __get_part_executor(self) -> futures.ThreadPoolExecutor:
+        with self.http_session_lock:
+            if self.part_executor is None:
+                self.part_executor = futures.ThreadPoolExecutor(
+                    max_workers=self.PART_CONCURRENCY, thread_name_prefix='pxt-download-part')
+            return self.part_executor
+
+    def __get_http_session(self) -> requests.Session:
+        """Returns a session that keeps a pool of connections per host"""
+        with self.http_session_lock:
+            if self.http_session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.INITIAL_CONCURRENCY, pool_maxsize=self.MAX_CONCURRENCY + self.PART_CONCURRENCY)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.http_session = session
+            return self.http_session
@@ -1,9 +1,14 @@
 from __future__ import annotations
-from typing import Iterator, Optional
+
+import concurrent.futures
+from typing import Any, Iterator, Optional, Sequence
 import logging
 
+import numpy as np
+
 import pixeltable.exprs as exprs
 import pixeltable.catalog as catalog
+from pixeltable.utils.image_encoder import ImageEncoder
 from pixeltable.utils.media_store import MediaStore
 
 
@@ -12,29 +17,29 @@ _logger = logging.getLogger('pixeltable')
 class DataRowBatch:
     """Set of DataRows, indexed by rowid.
 
-    Contains the metadata needed to initialize DataRows.
+    Contains the metadata needed to initialize DataRows. Slot values can also be read and written column-wise, which
+    avoids per-row dispatch when a whole slot gets populated at once (eg, with the result of a batched function call).
     """
     tbl: Optional[catalog.TableVersion]
     row_builder: exprs.RowBuilder
-    img_slot_idxs: list[int]
-    media_slot_idxs: list[int]  # non-image media slots
-    array_slot_idxs: list[int]
+    img_slot_idxs: frozenset[int]
+    media_slot_idxs: frozenset[int]  # non-image media slots
+    array_slot_idxs: frozenset[int]
     rows: list[exprs.DataRow]
+    # images that are being written by an ImageEncoder: (row, slot_idx, future)
+    pending_flushes: list[tuple[exprs.DataRow, int, concurrent.futures.Future]]
 
     def __init__(self, tbl: Optional[catalog.TableVersion], row_builder: exprs.RowBuilder, len: int = 0):
         self.tbl = tbl
         self.row_builder = row_builder
-        self.img_slot_idxs = [e.slot_idx for e in row_builder.unique_exprs if e.col_type.is_image_type()]
-        # non-image media slots
-        self.media_slot_idxs = [
-            e.slot_idx for e in row_builder.unique_exprs
-            if e.col_type.is_media_type() and not e.col_type.is_image_type()
-        ]
-        self.array_slot_idxs = [e.slot_idx for e in row_builder.unique_exprs if e.col_type.is_array_type()]
+        self.img_slot_idxs = row_builder.img_slot_idxs
+        self.media_slot_idxs = row_builder.media_slot_idxs
+        self.array_slot_idxs = row_builder.array_slot_idxs
         self.rows = [
             exprs.DataRow(row_builder.num_materialized, self.img_slot_idxs, self.media_slot_idxs, self.array_slot_idxs)
             for _ in range(len)
         ]
+        self.pending_flushes = []
 
     def add_row(self, row: Optional[exprs.DataRow] = None) -> exprs.DataRow:
         if row is None:
@@ -52,11 +57,49 @@ class DataRowBatch:
     def __getitem__(self, index: int) -> exprs.DataRow:
         return self.rows[index]
 
+    def _requires_conversion(self, slot_idx: int) -> bool:
+        """True if values for this slot need to go through DataRow.__setitem__()"""
+        return (
+            slot_idx in self.img_slot_idxs or slot_idx in self.media_slot_idxs or slot_idx in self.array_slot_idxs
+        )
+
+    def get_column(self, slot_idx: int, row_idxs: Optional[Sequence[int]] = None) -> list[Any]:
+        """Returns the in-memory values of the given slot for all rows, or for the rows in row_idxs"""
+        rows = self.rows if row_idxs is None else [self.rows[i] for i in row_idxs]
+        if self._requires_conversion(slot_idx):
+            return [row[slot_idx] for row in rows]
+        return [row.vals[slot_idx] for row in rows]
+
+    def set_column(self, slot_idx: int, vals: Sequence[Any], row_idxs: Optional[Sequence[int]] = None) -> None:
+        """Assigns vals[i] to slot_idx of rows[i], or of rows[row_idxs[i]] if row_idxs is given"""
+        rows = self.rows if row_idxs is None else [self.rows[i] for i in row_idxs]
+        assert len(rows) == len(vals)
+        if self._requires_conversion(slot_idx):
+            for row, val in zip(rows, vals):
+                row[slot_idx] = val
+            return
+        for row, val in zip(rows, vals):
+            assert row.excs[slot_idx] is None
+            row.vals[slot_idx] = val
+            row.has_val[slot_idx] = True
+
+    def has_val_mask(self, slot_idx: int) -> np.ndarray:
+        """Returns a boolean array that is True for the rows that have a value (or an exception) for slot_idx"""
+        return np.fromiter((row.has_val[slot_idx] for row in self.rows), dtype=bool, count=len(self.rows))
+
+    def exc_mask(self, slot_idx: int) -> np.ndarray:
+        """Returns a boolean array that is True for the rows that have an exception for slot_idx"""
+        return np.fromiter((row.excs[slot_idx] is not None for row in self.rows), dtype=bool, count=len(self.rows))
+
     def flush_imgs(
             self, idx_range: Optional[slice] = None, stored_img_info: Optional[list[exprs.ColumnSlotIdx]] = None,
-            flushed_slot_idxs: Optional[list[int]] = None
+            flushed_slot_idxs: Optional[list[int]] = None, encoder: Optional[ImageEncoder] = None
     ) -> None:
-        """Flushes images in the given range of rows."""
+        """Flushes images in the given range of rows.
+
+        With an encoder, images for stored columns are written asynchronously; call wait_for_flushes() before the
+        files are used.
+        """
         assert self.tbl is not None
         if stored_img_info is None:
             stored_img_info = []
@@ -67,11 +110,31 @@ class DataRowBatch:
         if idx_range is None:
             idx_range = slice(0, len(self.rows))
         for row in self.rows[idx_range]:
+            pending_slot_idxs: set[int] = set()
             for info in stored_img_info:
                 filepath = str(MediaStore.prepare_media_path(self.tbl.id, info.col.id, self.tbl.version))
-                row.flush_img(info.slot_idx, filepath)
+                future = row.flush_img(
+                    info.slot_idx, filepath, format=info.col.image_format, quality=info.col.image_quality,
+                    encoder=encoder)
+                if future is not None:
+                    self.pending_flushes.append((row, info.slot_idx, future))
+                    pending_slot_idxs.add(info.slot_idx)
             for slot_idx in flushed_slot_idxs:
-                row.flush_img(slot_idx)
+                # the in-memory value of a pending image is discarded by wait_for_flushes()
+                if slot_idx not in pending_slot_idxs:
+                    row.flush_img(slot_idx)
+
+    def wait_for_flushes(self) -> None:
+        """Waits for the images scheduled by flush_imgs() to be written and discards their in-memory values"""
+        pending, self.pending_flushes = self.pending_flushes, []
+        try:
+            for row, slot_idx, future in pending:
+                future.result()
+                row.vals[slot_idx] = None
+        except Exception:
+            for _, _, future in pending:
+                future.cancel()
+            raise
 
     def __iter__(self) -> Iterator[exprs.DataRow]:
         return iter(self.rows)
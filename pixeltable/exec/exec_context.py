@@ -1,9 +1,13 @@
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import sqlalchemy as sql
 
 import pixeltable.exprs as exprs
 
+if TYPE_CHECKING:
+    from .cache_prefetch_node import CachePrefetchNode
+    from .pipeline_node import PipelineNode
+
 class ExecContext:
     """Class for execution runtime constants"""
     def __init__(
@@ -15,9 +19,19 @@ class ExecContext:
         self.batch_size = batch_size
         self.row_builder = row_builder
         self.profile = exprs.ExecProfile(row_builder)
+        # per-stage timing of pipelined plans, in the order in which the stages were opened (= bottom-up)
+        self.stage_stats: list[PipelineNode.Stats] = []
+        # download metrics of the plan's CachePrefetchNodes
+        self.download_stats: list[CachePrefetchNode.Stats] = []
         # num_rows is used to compute the total number of computed cells used for the progress bar
         self.num_rows: Optional[int] = None
         self.conn: Optional[sql.engine.Connection] = None  # if present, use this to execute SQL queries
+        # if True, SqlNodes fetch their results through a server-side cursor rather than buffering the entire result
+        # set in the client; requires conn to be in a transaction
+        self.stream_results = False
+        # if True, the query reads each media file once: files it downloads shouldn't displace the working set of the
+        # file cache
+        self.one_shot_scan = False
         self.pk_clause = pk_clause
         self.num_computed_exprs = num_computed_exprs
         self.ignore_errors = ignore_errors
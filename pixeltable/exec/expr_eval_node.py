@@ -1,24 +1,47 @@
+import concurrent.futures
 import logging
+import math
+import os
+import queue
 import sys
 import time
 import warnings
 from dataclasses import dataclass
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, Optional
 
 from tqdm import TqdmWarning, tqdm
 
+import pixeltable.exceptions as excs
 from pixeltable import exprs
-from pixeltable.func import CallableFunction
+from pixeltable.func import CallableFunction, QueryTemplateFunction
+from pixeltable.func.batch_size_controller import BatchSizeController
+from pixeltable.utils.image_encoder import ImageEncoder
+from pixeltable.utils.result_cache import ResultCache
 
 from .data_row_batch import DataRowBatch
 from .exec_node import ExecNode
+from .pipeline_node import PipelineNode
+from .process_pool import ProcessPool
 
 _logger = logging.getLogger('pixeltable')
 
 
 class ExprEvalNode(ExecNode):
     """Materializes expressions
+
+    If any of the exprs are calls to batched functions, the input batches are regrouped so that the functions see
+    full batches, regardless of the batch sizes produced by the input. Rows are held back for at most
+    MAX_BUFFER_LATENCY seconds, after which the partial batch is evaluated; to observe that deadline while the input
+    is still working on its next batch, the input runs in a PipelineNode.
     """
+    MAX_BUFFER_LATENCY = 0.5  # in seconds
+    # upper bound for the size of regrouped batches: the lcm of the ext fn batch sizes can get very large
+    MAX_REGROUP_BATCH_SIZE = 1024
+    # wait time before retrying a batch that was rejected with HTTP 429 (Too Many Requests); it doubles with every
+    # consecutive rejection
+    RATE_LIMIT_DELAY = 1.0  # in seconds
+    MAX_RATE_LIMIT_RETRIES = 6
+
     @dataclass
     class Cohort:
         """List of exprs that form an evaluation context and contain calls to at most one external function"""
@@ -39,18 +62,106 @@ class ExprEvalNode(ExecNode):
         self.target_exprs = [e for e in output_exprs if e.slot_idx not in input_slot_idxs]
         self.pbar: Optional[tqdm] = None
         self.cohorts: list[ExprEvalNode.Cohort] = []
+        # thread pools for I/O-bound functions, keyed by slot_idx of the FunctionCall
+        self.executors: dict[int, concurrent.futures.ThreadPoolExecutor] = {}
+        # writes the images of stored columns; set in _open()
+        self.img_encoder: Optional[ImageEncoder] = None
         self._create_cohorts()
+        uses_conn = any(
+            isinstance(e, exprs.FunctionCall) and isinstance(e.fn, QueryTemplateFunction)
+            for e in self.row_builder.unique_exprs
+        )
+        if self._get_min_batch_size() is not None and not isinstance(self.input, PipelineNode) and not uses_conn:
+            # query functions access the connection during evaluation, which rules out a PipelineNode
+            self.input = PipelineNode(self.input)
+
+    def __iter__(self) -> Iterator[DataRowBatch]:
+        for batch in self._regroup_input():
+            # compute target exprs
+            for cohort in self.cohorts:
+                self._exec_cohort(cohort, batch)
+            # images of stored columns are written in the background while we evaluate the next rows; they need to be
+            # complete before anyone downstream sees them
+            batch.wait_for_flushes()
+            _logger.debug(f'ExprEvalNode: returning {len(batch)} rows')
+            yield batch
+
+    def _get_min_batch_size(self) -> Optional[int]:
+        """The output batch sizes need to be a multiple of this in order to always produce full ext fn batches"""
+        # this can change over time with adaptive batch sizing
+        batch_sizes = [cohort.batched_fn.get_batch_size() for cohort in self.cohorts if cohort.batched_fn is not None]
+        if len(batch_sizes) == 0:
+            return None
+        lcm = math.lcm(*batch_sizes)
+        # if the lcm is too large, only the function with the largest batch size sees full batches
+        return lcm if lcm <= self.MAX_REGROUP_BATCH_SIZE else max(batch_sizes)
+
+    def _regroup_input(self) -> Iterator[DataRowBatch]:
+        """Accumulate rows across input batches into batches whose size is a multiple of _get_min_batch_size()
+
+        Smaller batches are only returned at the end of the input or when rows have been held back for longer than
+        MAX_BUFFER_LATENCY.
+        """
+        if self._get_min_batch_size() is None:
+            yield from self.input
+            return
+
+        buffered_rows: list[exprs.DataRow] = []
+        buffer_start_ts = 0.0  # arrival time of the oldest buffered rows
+        tbl = None  # of the input batches
+
+        def make_batch(num_rows: int) -> DataRowBatch:
+            batch = DataRowBatch(tbl, self.row_builder)
+            for row in buffered_rows[:num_rows]:
+                batch.add_row(row)
+            del buffered_rows[:num_rows]
+            return batch
 
-    def __next__(self) -> DataRowBatch:
-        input_batch = next(self.input)
-        # compute target exprs
-        for cohort in self.cohorts:
-            self._exec_cohort(cohort, input_batch)
-        _logger.debug(f'ExprEvalNode: returning {len(input_batch)} rows')
-        return input_batch
+        # without a PipelineNode, we can only check the deadline when the next input batch arrives
+        input_iter = iter(self.input) if not isinstance(self.input, PipelineNode) else None
+        while True:
+            input_batch: Optional[DataRowBatch]
+            if input_iter is not None:
+                input_batch = next(input_iter, None)
+            else:
+                timeout = (
+                    max(0.0, buffer_start_ts + self.MAX_BUFFER_LATENCY - time.monotonic()) if len(buffered_rows) > 0
+                    else None
+                )
+                try:
+                    input_batch = self.input.get(timeout=timeout)
+                except queue.Empty:
+                    # the oldest buffered rows reached the deadline
+                    yield make_batch(len(buffered_rows))
+                    continue
+            if input_batch is None:
+                break
+
+            tbl = input_batch.tbl
+            min_batch_size = self._get_min_batch_size()
+            if len(buffered_rows) == 0:
+                if len(input_batch) % min_batch_size == 0:
+                    # nothing to regroup
+                    yield input_batch
+                    continue
+                buffer_start_ts = time.monotonic()
+            buffered_rows.extend(input_batch)
+            if time.monotonic() - buffer_start_ts > self.MAX_BUFFER_LATENCY:
+                num_rows = len(buffered_rows)
+            else:
+                num_rows = len(buffered_rows) // min_batch_size * min_batch_size
+            if num_rows == 0:
+                continue
+            yield make_batch(num_rows)
+            buffer_start_ts = time.monotonic()
+
+        if len(buffered_rows) > 0:
+            yield make_batch(len(buffered_rows))
 
     def _open(self) -> None:
         warnings.simplefilter("ignore", category=TqdmWarning)
+        if len(self.stored_img_cols) > 0:
+            self.img_encoder = ImageEncoder.get()
         # This is a temporary hack. When B-tree indices on string columns were implemented (via computed columns
         # that invoke the `BtreeIndex.str_filter` udf), it resulted in frivolous progress bars appearing on every
         # insertion. This special-cases the `str_filter` call to suppress the corresponding progress bar.
@@ -60,7 +171,7 @@ class ExprEvalNode(ExecNode):
         )
         if self.ctx.show_pbar and not is_str_filter_node:
             self.pbar = tqdm(
-                total=len(self.target_exprs) * self.ctx.num_rows,
+                total=len(self.target_exprs) * self.ctx.num_rows if self.ctx.num_rows is not None else None,
                 desc='Computing cells',
                 unit=' cells',
                 ncols=100,
@@ -70,6 +181,9 @@ class ExprEvalNode(ExecNode):
     def _close(self) -> None:
         if self.pbar is not None:
             self.pbar.close()
+        for executor in self.executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+        self.executors.clear()
 
     def _get_batched_fn(self, expr: exprs.Expr) -> Optional[CallableFunction]:
         if isinstance(expr, exprs.FunctionCall) and isinstance(expr.fn, CallableFunction) and expr.fn.is_batched:
@@ -79,6 +193,27 @@ class ExprEvalNode(ExecNode):
     def _is_batched_fn_call(self, expr: exprs.Expr) -> bool:
         return self._get_batched_fn(expr) is not None
 
+    def _get_concurrent_fn(self, expr: exprs.Expr) -> Optional[CallableFunction]:
+        if isinstance(expr, exprs.FunctionCall) and isinstance(expr.fn, CallableFunction) and expr.fn.is_concurrent:
+            return expr.fn
+        return None
+
+    def _is_concurrent_fn_call(self, expr: exprs.Expr) -> bool:
+        return self._get_concurrent_fn(expr) is not None
+
+    def _get_process_pool_fn(self, expr: exprs.Expr) -> Optional[CallableFunction]:
+        if isinstance(expr, exprs.FunctionCall) and isinstance(expr.fn, CallableFunction) \
+                and expr.fn.runs_in_process_pool:
+            return expr.fn
+        return None
+
+    def _is_process_pool_fn_call(self, expr: exprs.Expr) -> bool:
+        return self._get_process_pool_fn(expr) is not None
+
+    def _is_singleton_segment_expr(self, expr: exprs.Expr) -> bool:
+        return self._is_batched_fn_call(expr) or self._is_concurrent_fn_call(expr) \
+            or self._is_process_pool_fn_call(expr)
+
     def _create_cohorts(self) -> None:
         all_exprs = self.row_builder.get_dependencies(self.target_exprs)
         # break up all_exprs into cohorts such that each cohort contains calls to at most one external function;
@@ -120,23 +255,24 @@ class ExprEvalNode(ExecNode):
 
         for i in range(len(cohorts)):
             cohort = cohorts[i]
-            # segment the cohort into sublists that contain either a single ext. function call or no ext. function calls
-            # (i.e., only computed cols)
+            # segment the cohort into sublists that contain either a single ext. function call, a single call to an
+            # I/O-bound function, or no such calls (i.e., only computed cols)
             assert len(cohort) > 0
             # create the first segment here, so we can avoid checking for an empty list in the loop
             segments = [[cohort[0]]]
-            is_batched_segment = self._is_batched_fn_call(cohort[0])
+            is_singleton_segment = self._is_singleton_segment_expr(cohort[0])
             batched_fn: Optional[CallableFunction] = self._get_batched_fn(cohort[0])
             for e in cohort[1:]:
-                if self._is_batched_fn_call(e):
+                if self._is_singleton_segment_expr(e):
                     segments.append([e])
-                    is_batched_segment = True
-                    batched_fn = self._get_batched_fn(e)
+                    is_singleton_segment = True
+                    if self._is_batched_fn_call(e):
+                        batched_fn = self._get_batched_fn(e)
                 else:
-                    if is_batched_segment:
+                    if is_singleton_segment:
                         # start a new segment
                         segments.append([])
-                        is_batched_segment = False
+                        is_singleton_segment = False
                     segments[-1].append(e)
 
             # we create the EvalCtxs manually because create_eval_ctx() would repeat the dependencies of each segment
@@ -145,8 +281,25 @@ class ExprEvalNode(ExecNode):
                     slot_idxs=[e.slot_idx for e in s], exprs=s, target_slot_idxs=[], target_exprs=[])
                 for s in segments
             ]
-            cohort_info = self.Cohort(cohort, batched_fn, segment_ctxs, target_slot_idxs[i])
-            self.cohorts.append(cohort_info)
+            self.cohorts.append(self.Cohort(cohort, batched_fn, segment_ctxs, target_slot_idxs[i]))
+
+    def _flushes_imgs(self, cohort: Cohort) -> bool:
+        """Returns True if the cohort computes images that are flushed after each sub-batch"""
+        img_slot_idxs = set(self.flushed_img_slots) | {info.slot_idx for info in self.stored_img_cols}
+        return any(e.slot_idx in img_slot_idxs for e in cohort.exprs_)
+
+    def _get_sub_batch_size(self, cohort: Cohort) -> int:
+        """Sub-batch size for a cohort without a batched fn: large enough to saturate its concurrent calls"""
+        max_concurrency = 1
+        for segment_ctx in cohort.segment_ctxs:
+            fn = self._get_concurrent_fn(segment_ctx.exprs[0])
+            if fn is not None:
+                max_concurrency = max(max_concurrency, fn.max_concurrency)
+            fn = self._get_process_pool_fn(segment_ctx.exprs[0])
+            if fn is not None:
+                max_concurrency = max(
+                    max_concurrency, fn.max_concurrency if fn.max_concurrency is not None else os.cpu_count() or 1)
+        return max(cohort.batch_size, max_concurrency)
 
     def _exec_cohort(self, cohort: Cohort, rows: DataRowBatch) -> None:
         """Compute the cohort for the entire input batch by dividing it up into sub-batches"""
@@ -157,13 +310,26 @@ class ExprEvalNode(ExecNode):
             cohort.batch_size = ext_batch_size
 
         while batch_start_idx < len(rows):
-            num_batch_rows = min(cohort.batch_size, len(rows) - batch_start_idx)
+            if cohort.batched_fn is None and not self._flushes_imgs(cohort):
+                # nothing requires sub-batches: process the entire batch at once, which keeps all concurrent calls
+                # busy and lets vectorized exprs operate on as many rows as possible
+                num_batch_rows = len(rows) - batch_start_idx
+            elif cohort.batched_fn is None:
+                # images need to be flushed regularly to bound memory usage, but the sub-batches should still keep
+                # all concurrent calls busy
+                num_batch_rows = min(self._get_sub_batch_size(cohort), len(rows) - batch_start_idx)
+            else:
+                num_batch_rows = min(cohort.batch_size, len(rows) - batch_start_idx)
             for segment_ctx in cohort.segment_ctxs:
-                if not self._is_batched_fn_call(segment_ctx.exprs[0]):
-                    # compute batch row-wise
-                    for row_idx in range(batch_start_idx, batch_start_idx + num_batch_rows):
-                        self.row_builder.eval(
-                            rows[row_idx], segment_ctx, self.ctx.profile, ignore_errors=self.ctx.ignore_errors)
+                if self._is_concurrent_fn_call(segment_ctx.exprs[0]):
+                    self._exec_concurrent_segment(segment_ctx, rows, batch_start_idx, num_batch_rows)
+                elif self._is_process_pool_fn_call(segment_ctx.exprs[0]):
+                    self._exec_process_pool_segment(segment_ctx, rows, batch_start_idx, num_batch_rows)
+                elif not self._is_batched_fn_call(segment_ctx.exprs[0]):
+                    # compute batch expr-wise, using vectorized evaluation where possible
+                    self.row_builder.eval_batch(
+                        rows.rows[batch_start_idx:batch_start_idx + num_batch_rows], segment_ctx, self.ctx.profile,
+                        ignore_errors=self.ctx.ignore_errors)
                 else:
                     fn_call = segment_ctx.exprs[0]
                     assert isinstance(fn_call, exprs.FunctionCall)
@@ -185,17 +351,42 @@ class ExprEvalNode(ExecNode):
                             kwarg_batches[k].append(kwargs[k])
                     num_valid_batch_rows = len(valid_batch_idxs)
 
-                    if ext_batch_size is None:
+                    assert isinstance(fn_call.fn, CallableFunction)
+                    cache_keys: Optional[list[Optional[str]]] = None
+                    if fn_call.fn.is_deterministic and num_valid_batch_rows > 0:
+                        # use memoized results where we have them and only call the function for the remaining rows
+                        cache = ResultCache.get()
+                        cache_keys = [
+                            cache.make_key(
+                                fn_call.fn, [arg_batch[i] for arg_batch in arg_batches],
+                                {k: kwarg_batch[i] for k, kwarg_batch in kwarg_batches.items()})
+                            for i in range(num_valid_batch_rows)
+                        ]
+                        cached_vals = cache.lookup_batch(cache_keys)
+                        hit_idxs = [i for i, val in enumerate(cached_vals) if val is not ResultCache.MISS]
+                        if len(hit_idxs) > 0:
+                            rows.set_column(
+                                fn_call.slot_idx, [cached_vals[i] for i in hit_idxs],
+                                [valid_batch_idxs[i] for i in hit_idxs])
+                            miss_idxs = [i for i, val in enumerate(cached_vals) if val is ResultCache.MISS]
+                            arg_batches = [[arg_batch[i] for i in miss_idxs] for arg_batch in arg_batches]
+                            kwarg_batches = {
+                                k: [kwarg_batch[i] for i in miss_idxs] for k, kwarg_batch in kwarg_batches.items()
+                            }
+                            valid_batch_idxs = [valid_batch_idxs[i] for i in miss_idxs]
+                            cache_keys = [cache_keys[i] for i in miss_idxs]
+                            num_valid_batch_rows = len(valid_batch_idxs)
+
+                    if ext_batch_size is None and num_valid_batch_rows > 0:
                         # we need to choose a batch size based on the args
-                        assert isinstance(fn_call.fn, CallableFunction)
                         sample_args = [arg_batches[i][0] for i in range(len(arg_batches))]
                         ext_batch_size = fn_call.fn.get_batch_size(*sample_args)
 
+                    assert isinstance(fn_call.fn, CallableFunction)
                     num_remaining_batch_rows = num_valid_batch_rows
+                    num_rate_limit_retries = 0
                     while num_remaining_batch_rows > 0:
                         # we make ext. fn calls in batches of ext_batch_size
-                        if ext_batch_size is None:
-                            pass
                         num_ext_batch_rows = min(ext_batch_size, num_remaining_batch_rows)
                         ext_batch_offset = num_valid_batch_rows - num_remaining_batch_rows  # offset into args, not rows
                         call_args = [
@@ -207,26 +398,134 @@ class ExprEvalNode(ExecNode):
                             for k in kwarg_batches.keys()
                         }
                         start_ts = time.perf_counter()
-                        assert isinstance(fn_call.fn, CallableFunction)
-                        result_batch = fn_call.fn.exec_batch(*call_args, **call_kwargs)
-                        self.ctx.profile.eval_time[fn_call.slot_idx] += time.perf_counter() - start_ts
+                        try:
+                            result_batch = fn_call.fn.exec_batch(*call_args, **call_kwargs)
+                        except Exception as exc:
+                            if not fn_call.fn.record_batch_failure(exc):
+                                raise
+                            if BatchSizeController.is_rate_limit_error(exc):
+                                if num_rate_limit_retries == self.MAX_RATE_LIMIT_RETRIES:
+                                    raise
+                                time.sleep(self.RATE_LIMIT_DELAY * 2 ** num_rate_limit_retries)
+                                num_rate_limit_retries += 1
+                            else:
+                                # the batch was too large: retry with the reduced batch size
+                                ext_batch_size = fn_call.fn.get_batch_size()
+                            continue
+                        num_rate_limit_retries = 0
+                        elapsed = time.perf_counter() - start_ts
+                        fn_call.fn.record_batch(num_ext_batch_rows, elapsed)
+                        if cache_keys is not None:
+                            ResultCache.get().put_batch(
+                                cache_keys[ext_batch_offset:ext_batch_offset + len(result_batch)], result_batch)
+                        self.ctx.profile.eval_time[fn_call.slot_idx] += elapsed
                         self.ctx.profile.eval_count[fn_call.slot_idx] += num_ext_batch_rows
+                        self.ctx.profile.batch_size[fn_call.slot_idx] = ext_batch_size
 
                         # move the result into the row batch
-                        for result_idx in range(len(result_batch)):
-                            row_idx = valid_batch_idxs[ext_batch_offset + result_idx]
-                            row = rows[row_idx]
-                            row[fn_call.slot_idx] = result_batch[result_idx]
+                        rows.set_column(
+                            fn_call.slot_idx, result_batch,
+                            valid_batch_idxs[ext_batch_offset:ext_batch_offset + len(result_batch)])
 
                         num_remaining_batch_rows -= num_ext_batch_rows
+                        # the adaptive batch sizing might have picked a new size
+                        ext_batch_size = fn_call.fn.get_batch_size()
 
                     # switch to the ext fn batch size
-                    cohort.batch_size = ext_batch_size
+                    if ext_batch_size is not None:
+                        cohort.batch_size = ext_batch_size
 
-            # make sure images for stored cols have been saved to files before moving on to the next batch
+            # hand off images for stored cols to the encoder before moving on to the next batch
             rows.flush_imgs(
-                slice(batch_start_idx, batch_start_idx + num_batch_rows), self.stored_img_cols, self.flushed_img_slots)
+                slice(batch_start_idx, batch_start_idx + num_batch_rows), self.stored_img_cols, self.flushed_img_slots,
+                encoder=self.img_encoder)
             if self.pbar is not None:
                 self.pbar.update(num_batch_rows * len(cohort.target_slot_idxs))
             batch_start_idx += num_batch_rows
 
+    def _exec_concurrent_segment(
+            self, segment_ctx: exprs.RowBuilder.EvalCtx, rows: DataRowBatch, start_idx: int, num_rows: int
+    ) -> None:
+        """Evaluate a call to an I/O-bound function for rows[start_idx:start_idx + num_rows] concurrently"""
+        fn_call = segment_ctx.exprs[0]
+        assert isinstance(fn_call, exprs.FunctionCall)
+        fn = self._get_concurrent_fn(fn_call)
+        assert fn is not None
+        if fn_call.slot_idx not in self.executors:
+            self.executors[fn_call.slot_idx] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=fn.max_concurrency, thread_name_prefix=f'pxt-{fn.name}')
+        executor = self.executors[fn_call.slot_idx]
+
+        def eval_row(row: exprs.DataRow) -> float:
+            # each row only writes its own slots, which makes this safe to run concurrently
+            start_ts = time.perf_counter()
+            self.row_builder.eval(row, segment_ctx, ignore_errors=self.ctx.ignore_errors)
+            return time.perf_counter() - start_ts
+
+        futures = [
+            executor.submit(eval_row, rows[row_idx]) for row_idx in range(start_idx, start_idx + num_rows)
+            if not rows[row_idx].has_val[fn_call.slot_idx] and not rows[row_idx].has_exc(fn_call.slot_idx)
+        ]
+        try:
+            # collect results in row order, so that with ignore_errors=False we report the first failing row
+            for future in futures:
+                self.ctx.profile.eval_time[fn_call.slot_idx] += future.result()
+                self.ctx.profile.eval_count[fn_call.slot_idx] += 1
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _exec_process_pool_segment(
+            self, segment_ctx: exprs.RowBuilder.EvalCtx, rows: DataRowBatch, start_idx: int, num_rows: int
+    ) -> None:
+        """Evaluate a call to a CPU-bound function for rows[start_idx:start_idx + num_rows] in a process pool"""
+        fn_call = segment_ctx.exprs[0]
+        assert isinstance(fn_call, exprs.FunctionCall)
+        fn = self._get_process_pool_fn(fn_call)
+        assert fn is not None
+        pool = ProcessPool.get(fn)
+
+        start_ts = time.perf_counter()
+        cache = ResultCache.get() if fn.is_deterministic else None
+        pending: list[tuple[exprs.DataRow, Optional[str], concurrent.futures.Future]] = []
+        for row_idx in range(start_idx, start_idx + num_rows):
+            row = rows[row_idx]
+            if row.has_val[fn_call.slot_idx] or row.has_exc(fn_call.slot_idx):
+                continue
+            args, kwargs = fn_call._make_args(row)
+            if fn_call._has_non_nullable_nulls(args, kwargs):
+                row[fn_call.slot_idx] = None
+                continue
+            cache_key: Optional[str] = None
+            if cache is not None:
+                cache_key = cache.make_key(fn, args, kwargs)
+                val = cache.lookup(cache_key) if cache_key is not None else ResultCache.MISS
+                if val is not ResultCache.MISS:
+                    row[fn_call.slot_idx] = val
+                    continue
+            pending.append((row, cache_key, pool.submit(args, kwargs)))
+
+        num_retrieved = 0  # the results of pending[:num_retrieved] have been retrieved
+        try:
+            # collect results in row order, so that with ignore_errors=False we report the first failing row
+            for row, cache_key, future in pending:
+                num_retrieved += 1
+                try:
+                    row[fn_call.slot_idx] = pool.get_result(future)
+                    if cache_key is not None:
+                        cache.put(cache_key, row[fn_call.slot_idx])
+                except Exception as exc:
+                    _, _, exc_tb = sys.exc_info()
+                    self.row_builder.set_exc(row, fn_call.slot_idx, exc)
+                    if not self.ctx.ignore_errors:
+                        input_vals = [row[d.slot_idx] for d in fn_call.dependencies()]
+                        raise excs.ExprEvalError(
+                            fn_call, f'expression {fn_call}', exc, exc_tb, input_vals, 0)
+        except Exception:
+            for _, _, future in pending[num_retrieved:]:
+                ProcessPool.discard(future)
+            raise
+        finally:
+            self.ctx.profile.eval_time[fn_call.slot_idx] += time.perf_counter() - start_ts
+            self.ctx.profile.eval_count[fn_call.slot_idx] += len(pending)
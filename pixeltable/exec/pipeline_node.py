@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import queue
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+from .data_row_batch import DataRowBatch
+from .exec_node import ExecNode
+
+_logger = logging.getLogger('pixeltable')
+
+
+class PipelineNode(ExecNode):
+    """Runs its input subtree in a separate worker thread and hands off the resulting batches via a bounded queue
+
+    This decouples the stages of a plan: the input can produce the next batches (eg, run the SQL query, download
+    files, evaluate exprs) while the consumer is still working on the current one (eg, writing to the store).
+    The bounded queue provides backpressure: the worker blocks when the consumer falls behind.
+
+    Restrictions:
+    - the input subtree must not use ExecContext.conn after it produced its first batch (which is the case for
+      SqlNodes), otherwise it would race with the consumer's use of the connection
+    """
+    DEFAULT_QUEUE_SIZE = 4
+
+    @dataclasses.dataclass
+    class Stats:
+        """Per-stage timing: the stage consists of the input subtree, up to the next PipelineNode"""
+        stage: str
+        num_batches: int = 0
+        num_rows: int = 0
+        exec_time: float = 0.0  # time spent producing batches, which includes waiting for upstream stages
+        put_wait_time: float = 0.0  # time the worker was blocked on a full queue: downstream is the bottleneck
+        get_wait_time: float = 0.0  # time the consumer was blocked on an empty queue: this stage is the bottleneck
+
+        def __str__(self) -> str:
+            return (
+                f'{self.stage}: {self.num_rows} rows in {self.num_batches} batches, exec={self.exec_time:.3f}s, '
+                f'blocked_on_downstream={self.put_wait_time:.3f}s, downstream_starved={self.get_wait_time:.3f}s'
+            )
+
+    queue_size: int
+    stats: Stats
+
+    # execution state
+    _queue: Optional[queue.Queue]
+    _stop: threading.Event
+    _worker: Optional[threading.Thread]
+
+    _END = object()  # end-of-stream marker
+
+    def __init__(self, input: ExecNode, queue_size: int = DEFAULT_QUEUE_SIZE):
+        # input_/output_exprs=[]: we don't have anything to evaluate
+        super().__init__(input.row_builder, [], [], input)
+        self.output_exprs = input.output_exprs
+        self.queue_size = queue_size
+        self.stats = self.Stats(stage=type(input).__name__)
+        self._queue = None
+        self._stop = threading.Event()
+        self._worker = None
+
+    def _open(self) -> None:
+        self.ctx.stage_stats.append(self.stats)
+
+    def __iter__(self) -> Iterator[DataRowBatch]:
+        self._start()
+        while True:
+            batch = self.get()
+            if batch is None:
+                return
+            yield batch
+
+    def _start(self) -> None:
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, name=f'pxt-pipeline-{self.stats.stage}', daemon=True)
+        self._worker.start()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[DataRowBatch]:
+        """Returns the next batch, or None at the end of the input
+
+        Starts the worker on first use. Raises queue.Empty if no batch arrived within timeout seconds.
+        """
+        if self._worker is None:
+            self._start()
+        start_ts = time.perf_counter()
+        try:
+            item = self._queue.get(timeout=timeout)
+        finally:
+            self.stats.get_wait_time += time.perf_counter() - start_ts
+        if item is self._END:
+            # subsequent calls also see the end of the input
+            self._queue.put(item)
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def _run(self) -> None:
+        """Worker thread: pull batches from the input and hand them off to the consumer"""
+        try:
+            input_iter = iter(self.input)
+            while not self._stop.is_set():
+                start_ts = time.perf_counter()
+                batch = next(input_iter, None)
+                self.stats.exec_time += time.perf_counter() - start_ts
+                if batch is None:
+                    break
+                self.stats.num_batches += 1
+                self.stats.num_rows += len(batch)
+                self._put(batch)
+        except Exception as exc:
+            # the consumer re-raises this
+            self._put(exc)
+            return
+        self._put(self._END)
+
+    def _put(self, item: Any) -> None:
+        start_ts = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.stats.put_wait_time += time.perf_counter() - start_ts
+
+    def _close(self) -> None:
+        if self._worker is None:
+            return
+        # the consumer might have stopped early (eg, because of a limit or an exception): unblock the worker
+        self._stop.set()
+        while self._worker.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._worker.join()
+        self._worker = None
+        _logger.debug(f'pipeline stage {self.stats}')
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import concurrent.futures
+import dataclasses
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Optional
+
+import numpy as np
+import PIL.Image
+
+import pixeltable.exceptions as excs
+from pixeltable.env import Env
+from pixeltable.func import CallableFunction
+from pixeltable.utils import register_fork_reset
+
+_logger = logging.getLogger('pixeltable')
+
+
+@dataclasses.dataclass(frozen=True)
+class _SharedArray:
+    """Reference to an ndarray that was copied into a shared memory block"""
+    shm_name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+@dataclasses.dataclass(frozen=True)
+class _SharedImage:
+    """Reference to the pixel data of a PIL image that was copied into a shared memory block"""
+    shm_name: str
+    mode: str
+    size: tuple[int, int]
+    num_bytes: int
+
+
+class ProcessPool:
+    """A pool of worker processes that evaluate calls to a single CPU-bound CallableFunction
+
+    - workers are forked from the current process: they have access to the function without it being pickled, and
+      they keep their own per-process state (eg, loaded models and clients) for as long as the pool exists
+    - pools are reused across queries (see get()), so that this state stays warm
+    - large ndarrays and PIL images (in arguments as well as results) are passed via shared memory instead of being
+      pickled and sent through a pipe
+    """
+    # values smaller than this are simply pickled
+    SHM_MIN_SIZE = 64 * 1024
+    # max. number of pools that are kept alive
+    MAX_POOLS = 4
+
+    _pools: OrderedDict[int, ProcessPool] = OrderedDict()  # key: id(fn)
+    _pools_lock = threading.Lock()
+
+    fn: CallableFunction
+    max_workers: int
+    executor: concurrent.futures.ProcessPoolExecutor
+
+    def __init__(self, fn: CallableFunction, max_workers: int):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise excs.Error(f"{fn.display_name}(): executor='process' is not supported on this platform")
+        self.fn = fn
+        self.max_workers = max_workers
+        # make sure all workers share our resource tracker: shared memory blocks get created and unlinked in
+        # different processes
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context('fork'), initializer=_init_worker,
+            initargs=(fn,))
+
+    @classmethod
+    def get(cls, fn: CallableFunction) -> ProcessPool:
+        """Returns the pool for fn, creating it if necessary"""
+        with cls._pools_lock:
+            pool = cls._pools.get(id(fn))
+            if pool is not None and pool.fn is fn:
+                cls._pools.move_to_end(id(fn))
+                return pool
+            max_workers = fn.max_concurrency if fn.max_concurrency is not None else os.cpu_count() or 1
+            pool = ProcessPool(fn, max_workers)
+            cls._pools[id(fn)] = pool
+            while len(cls._pools) > cls.MAX_POOLS:
+                _, evicted = cls._pools.popitem(last=False)
+                evicted.shutdown()
+            return pool
+
+    @classmethod
+    def shutdown_all(cls) -> None:
+        with cls._pools_lock:
+            for pool in cls._pools.values():
+                pool.shutdown()
+            cls._pools.clear()
+
+    @classmethod
+    def _reset_after_fork(cls) -> None:
+        """Runs in a forked process: the inherited pools aren't usable there"""
+        cls._pools = OrderedDict()
+        cls._pools_lock = threading.Lock()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, args: list[Any], kwargs: dict[str, Any]) -> concurrent.futures.Future:
+        """Submit a call; the result of the returned future needs to be retrieved with get_result()"""
+        shm_blocks: list[SharedMemory] = []
+        shared_args = [_to_shared(arg, shm_blocks) for arg in args]
+        shared_kwargs = {k: _to_shared(v, shm_blocks) for k, v in kwargs.items()}
+        try:
+            future = self.executor.submit(_call, shared_args, shared_kwargs)
+        except Exception:
+            _release(shm_blocks)
+            raise
+        # the argument blocks are no longer needed once the call is done, regardless of its outcome
+        future.add_done_callback(lambda _: _release(shm_blocks))
+        return future
+
+    @classmethod
+    def get_result(cls, future: concurrent.futures.Future) -> Any:
+        """Waits for the call to complete and returns its result (or raises the exception raised by the call)"""
+        return _from_shared(future.result(), unlink=True)
+
+    @classmethod
+    def discard(cls, future: concurrent.futures.Future) -> None:
+        """Cancels a call whose result won't be retrieved; the shared memory of a result gets released"""
+        if not future.cancel():
+            # the call is already running or done
+            future.add_done_callback(_release_result)
+
+
+def _to_shared(val: Any, shm_blocks: list[SharedMemory]) -> Any:
+    """Copies large ndarrays/images into shared memory and returns a reference, or val itself"""
+    if isinstance(val, np.ndarray) and val.nbytes >= ProcessPool.SHM_MIN_SIZE and val.dtype != np.object_:
+        shm = SharedMemory(create=True, size=val.nbytes)
+        shm_blocks.append(shm)
+        np.copyto(np.ndarray(val.shape, dtype=val.dtype, buffer=shm.buf), val)
+        return _SharedArray(shm.name, val.shape, val.dtype.str)
+    if isinstance(val, PIL.Image.Image) and val.mode != 'P':
+        # palette images would lose their palette
+        data = val.tobytes()
+        if len(data) < ProcessPool.SHM_MIN_SIZE:
+            return val
+        shm = SharedMemory(create=True, size=len(data))
+        shm_blocks.append(shm)
+        shm.buf[:len(data)] = data
+        return _SharedImage(shm.name, val.mode, val.size, len(data))
+    return val
+
+
+def _from_shared(val: Any, unlink: bool) -> Any:
+    """Materializes a value produced by _to_shared(); unlink=True: the shared memory block is no longer needed"""
+    if not isinstance(val, (_SharedArray, _SharedImage)):
+        return val
+    shm = SharedMemory(name=val.shm_name)
+    try:
+        if isinstance(val, _SharedArray):
+            # copy: the block goes away after this
+            result = np.ndarray(val.shape, dtype=np.dtype(val.dtype), buffer=shm.buf).copy()
+        else:
+            result = PIL.Image.frombytes(val.mode, val.size, bytes(shm.buf[:val.num_bytes]))
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return result
+
+
+def _release_result(future: concurrent.futures.Future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if isinstance(result, (_SharedArray, _SharedImage)):
+        shm = SharedMemory(name=result.shm_name)
+        shm.close()
+        shm.unlink()
+
+
+def _release(shm_blocks: list[SharedMemory]) -> None:
+    for shm in shm_blocks:
+        shm.close()
+        shm.unlink()
+
+
+# state of a worker process
+_worker_fn: Optional[CallableFunction] = None
+
+
+def _init_worker(fn: CallableFunction) -> None:
+    global _worker_fn
+    _worker_fn = fn
+
+
+def _call(args: list[Any], kwargs: dict[str, Any]) -> Any:
+    """Runs in a worker process"""
+    assert _worker_fn is not None
+    args = [_from_shared(arg, unlink=False) for arg in args]
+    kwargs = {k: _from_shared(v, unlink=False) for k, v in kwargs.items()}
+    result = _worker_fn.py_fn(*args, **kwargs)
+    shm_blocks: list[SharedMemory] = []
+    shared_result = _to_shared(result, shm_blocks)
+    for shm in shm_blocks:
+        # the caller unlinks the block after reading it
+        shm.close()
+    return shared_result
+
+
+register_fork_reset(ProcessPool._reset_after_fork)
@@ -1,13 +1,15 @@
 import logging
 import warnings
 from decimal import Decimal
-from typing import Iterable, Iterator, NamedTuple, Optional, TYPE_CHECKING, Sequence
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, TYPE_CHECKING, Sequence
 from uuid import UUID
 
+import numpy as np
 import sqlalchemy as sql
 
 import pixeltable.catalog as catalog
 import pixeltable.exprs as exprs
+from pixeltable.utils.sql import in_ranges
 from .data_row_batch import DataRowBatch
 from .exec_node import ExecNode
 
@@ -81,6 +83,9 @@ class SqlNode(ExecNode):
     order_by_clause: OrderByClause
     limit: Optional[int]
 
+    # number of result rows that get converted into DataRows at a time, if the batch size is unlimited
+    FETCH_SIZE = 1024
+
     def __init__(
             self, tbl: Optional[catalog.TableVersionPath], row_builder: exprs.RowBuilder,
             select_list: Iterable[exprs.Expr], sql_elements: exprs.SqlElementCache, set_pk: bool = False
@@ -119,6 +124,7 @@ class SqlNode(ExecNode):
 
         # additional state
         self.result_cursor = None
+        self.applied_settings: list[str] = []  # names of the settings that need to be reset in _close()
         # the filter is provided by the subclass
         self.py_filter = None
         self.py_filter_eval_ctx = None
@@ -138,9 +144,7 @@ class SqlNode(ExecNode):
             sql_select_list += self.tbl.tbl_version.store_tbl.pk_columns()
         stmt = sql.select(*sql_select_list)
 
-        where_clause_element = (
-            self.sql_elements.get(self.where_clause) if self.where_clause is not None else self.where_clause_element
-        )
+        where_clause_element = self._where_clause_element()
         if where_clause_element is not None:
             stmt = stmt.where(where_clause_element)
 
@@ -158,6 +162,18 @@ class SqlNode(ExecNode):
 
         return stmt
 
+    def _where_clause_element(self) -> Optional[sql.ColumnElement]:
+        return self.sql_elements.get(self.where_clause) if self.where_clause is not None else self.where_clause_element
+
+    def _search_settings(self) -> dict[str, str]:
+        """Returns the Postgres settings requested by the similarity() calls that the statement evaluates"""
+        settings: dict[str, str] = {}
+        sim_exprs = exprs.Expr.list_subexprs(
+            list(self.select_list) + [e for e, _ in self.order_by_clause], expr_class=exprs.SimilarityExpr)
+        for sim_expr in sim_exprs:
+            settings.update(sim_expr.search_settings())
+        return settings
+
     def _ordering_tbl_ids(self) -> set[UUID]:
         return exprs.Expr.all_tbl_ids(e for e, _ in self.order_by_clause)
 
@@ -277,49 +293,54 @@ class SqlNode(ExecNode):
                 pass
             self._log_explain(stmt)
 
-            result_cursor = self.ctx.conn.execute(stmt)
+            conn = self.ctx.conn
+            # the store connections run in autocommit mode, which rules out SET LOCAL: we change the settings for the
+            # session and reset them in _close()
+            for name, val in self._search_settings().items():
+                conn.execute(sql.select(sql.func.set_config(name, val, False)))
+                self.applied_settings.append(name)
+            if self.ctx.stream_results:
+                max_row_buffer = self.ctx.batch_size if self.ctx.batch_size > 0 else self.FETCH_SIZE
+                conn = conn.execution_options(stream_results=True, max_row_buffer=max_row_buffer)
+            result_cursor = conn.execute(stmt)
+            self.result_cursor = result_cursor
             for warning in w:
                 pass
 
         tbl_version = self.tbl.tbl_version if self.tbl is not None else None
         output_batch = DataRowBatch(tbl_version, self.row_builder)
-        output_row: Optional[exprs.DataRow] = None
         num_rows_returned = 0
 
-        for sql_row in result_cursor:
-            output_row = output_batch.add_row(output_row)
+        while self.limit is None or num_rows_returned < self.limit:
+            # we populate DataRows column-wise, one chunk of result rows at a time
+            if self.ctx.batch_size > 0:
+                fetch_size = self.ctx.batch_size - len(output_batch)
+            else:
+                fetch_size = self.FETCH_SIZE
+            if self.limit is not None:
+                fetch_size = min(fetch_size, self.limit - num_rows_returned)
+            sql_rows = result_cursor.fetchmany(fetch_size)
+            if len(sql_rows) == 0:
+                break
 
-            # populate output_row
+            self._record_sql_rows(sql_rows)
+            chunk = DataRowBatch(tbl_version, self.row_builder, len(sql_rows))
             if self.num_pk_cols > 0:
-                output_row.set_pk(tuple(sql_row[-self.num_pk_cols:]))
-            # copy the output of the SQL query into the output row
+                for output_row, sql_row in zip(chunk, sql_rows):
+                    output_row.set_pk(tuple(sql_row[-self.num_pk_cols:]))
+            # copy the output of the SQL query into the output rows
             for i, e in enumerate(self.select_list):
-                slot_idx = e.slot_idx
-                # certain numerical operations can produce Decimals (eg, SUM(<int column>)); we need to convert them
-                if isinstance(sql_row[i], Decimal):
-                    if e.col_type.is_int_type():
-                        output_row[slot_idx] = int(sql_row[i])
-                    elif e.col_type.is_float_type():
-                        output_row[slot_idx] = float(sql_row[i])
-                    else:
-                        raise RuntimeError(f'Unexpected Decimal value for {e}')
-                else:
-                    output_row[slot_idx] = sql_row[i]
+                chunk.set_column(e.slot_idx, self._convert_decimals(e, [sql_row[i] for sql_row in sql_rows]))
 
             if self.py_filter is not None:
                 # evaluate filter
-                self.row_builder.eval(output_row, self.py_filter_eval_ctx, profile=self.ctx.profile)
-            if self.py_filter is not None and not output_row[self.py_filter.slot_idx]:
-                # we re-use this row for the next sql row since it didn't pass the filter
-                output_row = output_batch.pop_row()
-                output_row.clear()
+                self.row_builder.eval_batch(chunk.rows, self.py_filter_eval_ctx, profile=self.ctx.profile)
+                passed_rows = [output_row for output_row in chunk if output_row[self.py_filter.slot_idx]]
             else:
-                # reset output_row in order to add new one
-                output_row = None
-                num_rows_returned += 1
-
-            if self.limit is not None and num_rows_returned == self.limit:
-                break
+                passed_rows = chunk.rows
+            for output_row in passed_rows:
+                output_batch.add_row(output_row)
+            num_rows_returned += len(passed_rows)
 
             if self.ctx.batch_size > 0 and len(output_batch) == self.ctx.batch_size:
                 _logger.debug(f'SqlScanNode: returning {len(output_batch)} rows')
@@ -330,9 +351,30 @@ class SqlNode(ExecNode):
             _logger.debug(f'SqlScanNode: returning {len(output_batch)} rows')
             yield output_batch
 
+    def _record_sql_rows(self, sql_rows: Sequence[sql.Row]) -> None:
+        """Called with every chunk of result rows, before they're converted into DataRows"""
+        pass
+
+    @classmethod
+    def _convert_decimals(cls, e: exprs.Expr, vals: list[Any]) -> list[Any]:
+        """Certain numerical operations can produce Decimals (eg, SUM(<int column>)); we need to convert them"""
+        if e.col_type.is_int_type():
+            return [int(val) if isinstance(val, Decimal) else val for val in vals]
+        if e.col_type.is_float_type():
+            return [float(val) if isinstance(val, Decimal) else val for val in vals]
+        if e.col_type.is_string_type() or e.col_type.is_bool_type() or e.col_type.is_timestamp_type():
+            # these can't be Decimals
+            return vals
+        if any(isinstance(val, Decimal) for val in vals):
+            raise RuntimeError(f'Unexpected Decimal value for {e}')
+        return vals
+
     def _close(self) -> None:
         if self.result_cursor is not None:
             self.result_cursor.close()
+        for name in self.applied_settings:
+            self.ctx.conn.execute(sql.text(f'RESET {name}'))
+        self.applied_settings = []
 
 
 class SqlScanNode(SqlNode):
@@ -342,6 +384,15 @@ class SqlScanNode(SqlNode):
     Supports filtering and ordering.
     """
     exact_version_only: list[catalog.TableVersion]
+    rowid_ranges: Optional[list[tuple[Optional[int], Optional[int]]]]
+
+    # similarity search state
+    knn_queries: Optional[sql.Values]  # (query_idx, embedding)
+    knn_distance: Optional[sql.ColumnElement]  # distance to the query embedding; ascending: nearest first
+    knn_k: Optional[int]
+    knn_candidates_order: Optional[sql.ColumnElement]  # for indices that need re-ranking
+    knn_num_candidates: Optional[int]
+    query_idxs: list[int]  # query idx of each returned row
 
     def __init__(
         self, tbl: catalog.TableVersionPath, row_builder: exprs.RowBuilder,
@@ -361,15 +412,112 @@ class SqlScanNode(SqlNode):
             exact_version_only = []
 
         self.exact_version_only = exact_version_only
+        self.rowid_ranges = None
+        self.knn_queries = None
+        self.knn_distance = None
+        self.knn_k = None
+        self.knn_candidates_order = None
+        self.knn_num_candidates = None
+        self.query_idxs = []
+
+    def set_rowid_ranges(self, rowid_ranges: list[tuple[Optional[int], Optional[int]]]) -> None:
+        """
+        Restrict the scan to rows whose first rowid column is in one of the [lower, upper) ranges (None: unbounded),
+        and return them ordered by that column
+        """
+        assert len(self.order_by_clause) == 0
+        self.rowid_ranges = rowid_ranges
+
+    def set_similarity_search(self, sim_expr: exprs.SimilarityExpr, embeddings: list[np.ndarray], k: int) -> None:
+        """
+        Turn the scan into a k-nearest-neighbor search for each of the query embeddings, which runs as a single
+        statement: the scan becomes the subquery of a LATERAL join with the list of query embeddings. Rows are returned
+        ordered by query and then by distance, and the query of each row is recorded in query_idxs.
+        sim_expr needs to be part of the select list; it returns the similarity to the query of the row.
+        """
+        assert len(self.order_by_clause) == 0 and self.limit is None and self.py_filter is None
+        assert self.rowid_ranges is None
+        idx = sim_expr.idx_info.idx
+        val_col = sim_expr.idx_info.val_col
+        self.knn_queries = sql.values(
+            sql.column('query_idx', sql.Integer), sql.column('embedding', idx.index_sa_type()), name='knn_queries'
+        ).data(list(enumerate(embeddings)))
+        # the values of a VALUES list are untyped
+        query_embedding = sql.cast(self.knn_queries.c.embedding, idx.index_sa_type())
+        self.sql_elements.extend(
+            exprs.ExprDict([(sim_expr, idx.embedding_similarity_clause(val_col, query_embedding))]))
+        self.knn_distance = idx.distance_clause(val_col, query_embedding)
+        self.knn_k = k
+        if idx.precision == idx.Precision.BINARY:
+            self.knn_candidates_order = idx.candidates_clause(val_col, query_embedding)
+            self.knn_num_candidates = k * idx.rerank_factor
 
     def _create_stmt(self) -> sql.Select:
         stmt = super()._create_stmt()
+        if self.rowid_ranges is not None:
+            rowid_col = self.tbl.tbl_version.store_tbl.rowid_columns()[0]
+            stmt = stmt.where(in_ranges(rowid_col, self.rowid_ranges)).order_by(rowid_col)
         where_clause_tbl_ids = self.where_clause.tbl_ids() if self.where_clause is not None else set()
         refd_tbl_ids = exprs.Expr.all_tbl_ids(self.select_list) | where_clause_tbl_ids | self._ordering_tbl_ids()
         stmt = self.create_from_clause(
             self.tbl, stmt, refd_tbl_ids, exact_version_only={t.id for t in self.exact_version_only})
+        if self.knn_queries is not None:
+            stmt = self._create_knn_stmt(stmt)
+        elif len(self.order_by_clause) == 1 and self.limit is not None and self.py_filter is None:
+            # re-ranking: the ordering is only applied to the candidates returned by the index
+            e, asc = self.order_by_clause[0]
+            candidates_order = e.candidates_clause(asc) if isinstance(e, exprs.SimilarityExpr) else None
+            if candidates_order is not None:
+                num_candidates = self.limit * e.idx_info.idx.rerank_factor
+                stmt = stmt.where(self._in_candidates(candidates_order, num_candidates, e.tbl_ids()))
         return stmt
 
+    def _in_candidates(
+            self, candidates_order: sql.ColumnElement, num_candidates: int, candidates_tbl_ids: set[UUID]
+    ) -> sql.ColumnElement:
+        """
+        Returns
+            (<rowid>) IN (SELECT <rowid> ... WHERE <where clause> ORDER BY candidates_order LIMIT num_candidates)
+        """
+        rowid_cols = self.tbl.tbl_version.store_tbl.rowid_columns()
+        stmt = sql.select(*rowid_cols)
+        where_clause_element = self._where_clause_element()
+        if where_clause_element is not None:
+            stmt = stmt.where(where_clause_element)
+        stmt = stmt.order_by(candidates_order).limit(num_candidates)
+        where_clause_tbl_ids = self.where_clause.tbl_ids() if self.where_clause is not None else set()
+        stmt = self.create_from_clause(
+            self.tbl, stmt, where_clause_tbl_ids | candidates_tbl_ids,
+            exact_version_only={t.id for t in self.exact_version_only})
+        # the subquery scans the same store tables as the enclosing query, but it isn't correlated with it
+        stmt = stmt.correlate_except(*[t.store_tbl.sa_tbl for t in self.tbl.get_tbl_versions()])
+        return sql.tuple_(*rowid_cols).in_(stmt)
+
+    def _create_knn_stmt(self, stmt: sql.Select) -> sql.Select:
+        """
+        Returns
+            SELECT <select list>, knn_queries.query_idx, <pk>
+            FROM knn_queries CROSS JOIN LATERAL (<stmt> ORDER BY <distance> LIMIT k) AS knn
+            ORDER BY knn_queries.query_idx, knn.distance
+        The query idx precedes the pk columns, which __iter__() expects at the end.
+        """
+        if self.knn_candidates_order is not None:
+            sim_expr_tbl_ids = exprs.Expr.all_tbl_ids(self.select_list)
+            stmt = stmt.where(
+                self._in_candidates(self.knn_candidates_order, self.knn_num_candidates, sim_expr_tbl_ids))
+        knn = stmt.add_columns(self.knn_distance.label('knn_distance')) \
+            .order_by(self.knn_distance).limit(self.knn_k).lateral('knn')
+        num_select_cols = len(self.select_list)
+        knn_cols = list(knn.c)
+        return sql.select(*knn_cols[:num_select_cols], self.knn_queries.c.query_idx, *knn_cols[num_select_cols:-1]) \
+            .select_from(self.knn_queries.join(knn, sql.true())) \
+            .order_by(self.knn_queries.c.query_idx, knn.c.knn_distance)
+
+    def _record_sql_rows(self, sql_rows: Sequence[sql.Row]) -> None:
+        if self.knn_queries is not None:
+            query_idx_pos = len(self.select_list)
+            self.query_idxs.extend(sql_row[query_idx_pos] for sql_row in sql_rows)
+
 
 class SqlLookupNode(SqlNode):
     """
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-from typing import Any, Optional
+from typing import Any, Optional, Sequence
 
+import numpy as np
 import sqlalchemy as sql
 
 import pixeltable.exceptions as excs
@@ -124,6 +125,40 @@ class ArithmeticExpr(Expr):
         elif self.operator == ArithmeticOperator.FLOORDIV:
             data_row[self.slot_idx] = op1_val // op2_val
 
+    def eval_batch(self, data_rows: Sequence[DataRow], row_builder: RowBuilder) -> Optional[list[Any]]:
+        op1 = self._as_numeric_array([row[self._op1.slot_idx] for row in data_rows])
+        op2 = self._as_numeric_array([row[self._op2.slot_idx] for row in data_rows])
+        if op1 is None or op2 is None:
+            return None
+        (op1_vals, op1_nulls), (op2_vals, op2_nulls) = op1, op2
+        if (self._op1.col_type.is_json_type() and op1_nulls.any()) or (
+                self._op2.col_type.is_json_type() and op2_nulls.any()):
+            # eval() raises for non-numeric Json values
+            return None
+        is_null = op1_nulls | op2_nulls
+        if self.operator in (ArithmeticOperator.DIV, ArithmeticOperator.MOD, ArithmeticOperator.FLOORDIV) \
+                and ((op2_vals == 0) & ~is_null).any():
+            # eval() raises ZeroDivisionError for those rows
+            return None
+
+        if self.operator == ArithmeticOperator.ADD:
+            result = op1_vals + op2_vals
+        elif self.operator == ArithmeticOperator.SUB:
+            result = op1_vals - op2_vals
+        elif self.operator == ArithmeticOperator.MUL:
+            result = op1_vals * op2_vals
+        elif self.operator == ArithmeticOperator.DIV:
+            result = op1_vals / op2_vals
+        elif self.operator == ArithmeticOperator.MOD:
+            result = op1_vals % op2_vals
+        elif self.operator == ArithmeticOperator.FLOORDIV:
+            result = op1_vals // op2_vals
+        result_vals = result.tolist()
+        if is_null.any():
+            for i in np.flatnonzero(is_null):
+                result_vals[i] = None
+        return result_vals
+
     def _as_dict(self) -> dict:
         return {'operator': self.operator.value, **super()._as_dict()}
 
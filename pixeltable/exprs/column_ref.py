@@ -118,9 +118,24 @@ class ColumnRef(Expr):
 
         return super().__getattr__(name)
 
-    def similarity(self, item: Any, *, idx: Optional[str] = None) -> Expr:
+    def similarity(
+            self, item: Any, *, idx: Optional[str] = None, ef_search: Optional[int] = None,
+            probes: Optional[int] = None
+    ) -> Expr:
+        """
+        Returns the similarity of this column's values to item, according to an embedding index on this column.
+
+        Args:
+            item: The query item (a string or an image).
+            idx: The name of the index to use; required if the column has more than one embedding index.
+            ef_search: For `'hnsw'` indices: the size of the candidate list that the index search maintains (the
+                default is 40). Larger values increase recall and latency; a query returns at most `ef_search` rows
+                from the index.
+            probes: For `'ivfflat'` indices: the number of lists that are searched (the default is 1). Larger values
+                increase recall and latency.
+        """
         from .similarity_expr import SimilarityExpr
-        return SimilarityExpr(self, item, idx_name=idx)
+        return SimilarityExpr(self, item, idx_name=idx, ef_search=ef_search, probes=probes)
 
     def default_column_name(self) -> Optional[str]:
         return str(self)
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-from typing import Any, Optional
+from typing import Any, Optional, Sequence
 
+import numpy as np
 import sqlalchemy as sql
 
 import pixeltable.exceptions as excs
@@ -126,3 +127,33 @@ class Comparison(Expr):
     def _from_dict(cls, d: dict, components: list[Expr]) -> Comparison:
         assert 'operator' in d
         return cls(ComparisonOperator(d['operator']), components[0], components[1])
+
+    def eval_batch(self, data_rows: Sequence[DataRow], row_builder: RowBuilder) -> Optional[list[Any]]:
+        if not self._op1.col_type.is_scalar_type() or not self._op2.col_type.is_scalar_type():
+            return None
+        left_vals = [row[self._op1.slot_idx] for row in data_rows]
+        right_vals = [row[self._op2.slot_idx] for row in data_rows]
+        left, right = self._as_numeric_array(left_vals), self._as_numeric_array(right_vals)
+        if left is not None and right is not None and not left[1].any() and not right[1].any():
+            left, right = left[0], right[0]
+        else:
+            # elementwise Python comparisons, which also take care of None; anything that raises (eg, None < 1)
+            # makes the caller fall back to eval()
+            left, right = np.empty(len(data_rows), dtype=object), np.empty(len(data_rows), dtype=object)
+            left[:], right[:] = left_vals, right_vals
+
+        if self.operator == ComparisonOperator.LT:
+            result = left < right
+        elif self.operator == ComparisonOperator.LE:
+            result = left <= right
+        elif self.operator == ComparisonOperator.EQ:
+            result = left == right
+        elif self.operator == ComparisonOperator.NE:
+            result = left != right
+        elif self.operator == ComparisonOperator.GT:
+            result = left > right
+        elif self.operator == ComparisonOperator.GE:
+            result = left >= right
+        if result.dtype != np.bool_:
+            return None
+        return result.tolist()
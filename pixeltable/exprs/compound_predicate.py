@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import operator
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Optional, Sequence
 
+import numpy as np
 import sqlalchemy as sql
 
 import pixeltable.type_system as ts
@@ -90,6 +91,20 @@ class CompoundPredicate(Expr):
                 val = op_function(val, data_row[op.slot_idx])
             data_row[self.slot_idx] = val
 
+    def eval_batch(self, data_rows: Sequence[DataRow], row_builder: RowBuilder) -> Optional[list[Any]]:
+        operand_vals = [[row[op.slot_idx] for row in data_rows] for op in self.components]
+        # eval() applies the Python operators to whatever the operands return; we only handle proper bools here
+        if any(type(v) is not bool for vals in operand_vals for v in vals):
+            return None
+        operands = np.array(operand_vals, dtype=bool)
+        if self.operator == LogicalOperator.NOT:
+            result = ~operands[0]
+        elif self.operator == LogicalOperator.AND:
+            result = np.logical_and.reduce(operands, axis=0)
+        else:
+            result = np.logical_or.reduce(operands, axis=0)
+        return result.tolist()
+
     def _as_dict(self) -> dict:
         return {'operator': self.operator.value, **super()._as_dict()}
 
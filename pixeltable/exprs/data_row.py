@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import concurrent.futures
 import datetime
 import io
 import urllib.parse
@@ -12,7 +13,9 @@ import PIL
 import PIL.Image
 import sqlalchemy as sql
 
+import pixeltable.type_system as ts
 from pixeltable import env
+from pixeltable.utils.image_encoder import ImageEncoder
 
 
 class DataRow:
@@ -34,14 +37,19 @@ class DataRow:
     - VideoType: local path if available, otherwise url
     """
 
+    __slots__ = (
+        'vals', 'has_val', 'excs', 'img_slot_idxs', 'media_slot_idxs', 'array_slot_idxs', 'pk', 'file_urls',
+        'file_paths'
+    )
+
     vals: list[Any]
     has_val: list[bool]
     excs: list[Optional[Exception]]
 
     # control structures that are shared across all DataRows in a batch
-    img_slot_idxs: list[int]
-    media_slot_idxs: list[int]
-    array_slot_idxs: list[int]
+    img_slot_idxs: frozenset[int]
+    media_slot_idxs: frozenset[int]
+    array_slot_idxs: frozenset[int]
 
     # the primary key of a store row is a sequence of ints (the number is different for table vs view)
     pk: Optional[tuple[int, ...]]
@@ -57,7 +65,10 @@ class DataRow:
     # - None if vals[i] is not a media type or if there is no local file yet for file_urls[i]
     file_paths: list[Optional[str]]
 
-    def __init__(self, size: int, img_slot_idxs: list[int], media_slot_idxs: list[int], array_slot_idxs: list[int]):
+    def __init__(
+            self, size: int, img_slot_idxs: frozenset[int], media_slot_idxs: frozenset[int],
+            array_slot_idxs: frozenset[int]
+    ):
         self.vals = [None] * size
         self.has_val = [False] * size
         self.excs = [None] * size
@@ -155,7 +166,8 @@ class DataRow:
         if self.vals[index] is not None and index in self.array_slot_idxs:
             assert isinstance(self.vals[index], np.ndarray)
             np_array = self.vals[index]
-            if sa_col_type is not None and isinstance(sa_col_type, pgvector.sqlalchemy.Vector):
+            if sa_col_type is not None and isinstance(sa_col_type, (pgvector.sqlalchemy.Vector, ts.RawArrayBinary)):
+                # the column type takes care of the conversion
                 return np_array
             buffer = io.BytesIO()
             np.save(buffer, np_array)
@@ -215,10 +227,17 @@ class DataRow:
         if idx in self.media_slot_idxs:
             self.vals[idx] = path
 
-    def flush_img(self, index: int, filepath: Optional[str] = None) -> None:
-        """Discard the in-memory value and save it to a local file, if filepath is not None"""
+    def flush_img(
+            self, index: int, filepath: Optional[str] = None, format: Optional[str] = None,
+            quality: Optional[int] = None, encoder: Optional[ImageEncoder] = None
+    ) -> Optional[concurrent.futures.Future]:
+        """Discard the in-memory value and save it to a local file, if filepath is not None
+
+        If an encoder is given, the file is written asynchronously and the in-memory value is retained: the caller
+        needs to wait for the returned future before discarding the value (or using the file).
+        """
         if self.vals[index] is None:
-            return
+            return None
         assert self.excs[index] is None
         if self.file_paths[index] is None:
             if filepath is not None:
@@ -227,10 +246,9 @@ class DataRow:
                 self.file_urls[index] = urllib.parse.urljoin('file:', urllib.request.pathname2url(filepath))
                 image = self.vals[index]
                 assert isinstance(image, PIL.Image.Image)
-                # Default to JPEG unless the image has a transparency layer (which isn't supported by JPEG).
-                # In that case, use WebP instead.
-                format = 'webp' if image.has_transparency_data else 'jpeg'
-                image.save(filepath, format=format)
+                if encoder is not None:
+                    return encoder.submit(image, filepath, format, quality)
+                ImageEncoder.save(image, filepath, format, quality)
             else:
                 # we discard the content of this cell
                 self.has_val[index] = False
@@ -238,6 +256,7 @@ class DataRow:
             # we already have a file for this image, nothing left to do
             pass
         self.vals[index] = None
+        return None
 
     @property
     def rowid(self) -> tuple[int, ...]:
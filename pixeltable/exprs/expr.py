@@ -7,9 +7,10 @@ import inspect
 import json
 import sys
 import typing
-from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, TypeVar, Union, overload, Iterable
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, Sequence, TypeVar, Union, overload, Iterable
 from uuid import UUID
 
+import numpy as np
 import sqlalchemy as sql
 from typing_extensions import _AnnotatedAlias, Self
 
@@ -383,6 +384,38 @@ class Expr(abc.ABC):
         """
         pass
 
+    def eval_batch(self, data_rows: Sequence[DataRow], row_builder: 'exprs.RowBuilder') -> Optional[list[Any]]:
+        """
+        Compute the expr values for all data_rows at once (eg, with NumPy) and return them, in the order of data_rows.
+        The dependencies of this expr are populated (and free of exceptions) for all data_rows.
+        Returns None if the batch can't be evaluated as a whole (eg, because it would raise for some rows), in which
+        case the caller falls back to eval() for each row; the same applies if eval_batch() raises an exception.
+        """
+        return None
+
+    # integers beyond this magnitude could overflow int64 multiplication; these batches are evaluated row by row
+    _MAX_VECTORIZED_INT = 2 ** 31
+
+    @classmethod
+    def _as_numeric_array(cls, vals: list[Any]) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """
+        Converts a list of int/float/None values into an int64 or float64 array (with None replaced by 1) and a
+        null mask. Returns None if vals contains anything else, or ints that might not be safe to operate on in int64.
+        """
+        is_null = np.fromiter((v is None for v in vals), dtype=bool, count=len(vals))
+        has_float = False
+        for v in vals:
+            t = type(v)
+            if t is float:
+                has_float = True
+            elif t is int:
+                if not -cls._MAX_VECTORIZED_INT < v < cls._MAX_VECTORIZED_INT:
+                    return None
+            elif v is not None:
+                return None
+        arr = np.array([1 if v is None else v for v in vals], dtype=np.float64 if has_float else np.int64)
+        return arr, is_null
+
     def release(self) -> None:
         """
         Allow Expr class to tear down execution state. This is called after the last eval() call.
@@ -11,6 +11,7 @@ import pixeltable.catalog as catalog
 import pixeltable.exceptions as excs
 import pixeltable.func as func
 import pixeltable.type_system as ts
+from pixeltable.utils.result_cache import ResultCache
 
 from .data_row import DataRow
 from .expr import Expr
@@ -399,6 +400,18 @@ class FunctionCall(Expr):
                 args.append(val)
         return args, kwargs
 
+    def _has_non_nullable_nulls(self, args: list[Any], kwargs: dict[str, Any]) -> bool:
+        """Returns True if a non-nullable parameter receives a null argument, in which case the result is null"""
+        if self.fn.signature.parameters is None:
+            return False
+        for i in range(len(self.arg_types)):
+            if args[i] is None and not self.arg_types[i].nullable:
+                return True
+        for param_name, param_type in self.kwarg_types.items():
+            if kwargs[param_name] is None and not param_type.nullable:
+                return True
+        return False
+
     def eval(self, data_row: DataRow, row_builder: RowBuilder) -> None:
         if isinstance(self.fn, func.ExprTemplateFunction):
             # we need to evaluate the template
@@ -413,21 +426,21 @@ class FunctionCall(Expr):
             return
 
         args, kwargs = self._make_args(data_row)
-        signature = self.fn.signature
-        if signature.parameters is not None:
-            # check for nulls
-            for i in range(len(self.arg_types)):
-                if args[i] is None and not self.arg_types[i].nullable:
-                    # we can't evaluate this function
-                    data_row[self.slot_idx] = None
-                    return
-            for param_name, param_type in self.kwarg_types.items():
-                if kwargs[param_name] is None and not param_type.nullable:
-                    # we can't evaluate this function
-                    data_row[self.slot_idx] = None
-                    return
-
-        if isinstance(self.fn, func.CallableFunction) and not self.fn.is_batched:
+        if self._has_non_nullable_nulls(args, kwargs):
+            # we can't evaluate this function
+            data_row[self.slot_idx] = None
+            return
+
+        if isinstance(self.fn, func.CallableFunction) and self.fn.is_deterministic:
+            cache = ResultCache.get()
+            key = cache.make_key(self.fn, args, kwargs)
+            result = cache.lookup(key) if key is not None else ResultCache.MISS
+            if result is ResultCache.MISS:
+                result = self.fn.py_fn(*args, **kwargs) if not self.fn.is_batched else self.fn.exec(*args, **kwargs)
+                if key is not None:
+                    cache.put(key, result)
+            data_row[self.slot_idx] = result
+        elif isinstance(self.fn, func.CallableFunction) and not self.fn.is_batched:
             # optimization: avoid additional level of indirection we'd get from calling Function.exec()
             data_row[self.slot_idx] = self.fn.py_fn(*args, **kwargs)
         elif self.is_window_fn_call:
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Iterable, Optional
+from typing import Any, Iterable, Optional, Sequence
 
 import sqlalchemy as sql
 
@@ -87,6 +87,18 @@ class InPredicate(Expr):
             value_list = self._normalize_value_set(value_set, filter_type_mismatches=False)
             data_row[self.slot_idx] = lhs_val in value_list
 
+    def eval_batch(self, data_rows: Sequence[DataRow], row_builder: RowBuilder) -> Optional[list[Any]]:
+        if self.value_list is None:
+            # the value set is computed per row
+            return None
+        try:
+            # set membership has the same semantics as list membership for hashable values
+            value_set = set(self.value_list)
+            return [row[self._lhs.slot_idx] in value_set for row in data_rows]
+        except TypeError:
+            # unhashable values
+            return None
+
     def _as_dict(self) -> dict:
         return {'value_list': self.value_list, **super()._as_dict()}
 
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Any, Optional, Sequence
 
 import sqlalchemy as sql
 
@@ -33,6 +33,10 @@ class IsNull(Expr):
     def eval(self, data_row: DataRow, row_builder: RowBuilder) -> None:
         data_row[self.slot_idx] = data_row[self.components[0].slot_idx] is None
 
+    def eval_batch(self, data_rows: Sequence[DataRow], row_builder: RowBuilder) -> Optional[list[Any]]:
+        slot_idx = self.components[0].slot_idx
+        return [row[slot_idx] is None for row in data_rows]
+
     @classmethod
     def _from_dict(cls, d: dict, components: list[Expr]) -> IsNull:
         assert len(components) == 1
@@ -21,6 +21,8 @@ class ExecProfile:
     def __init__(self, row_builder: RowBuilder):
         self.eval_time = [0.0] * row_builder.num_materialized
         self.eval_count = [0] * row_builder.num_materialized
+        # the most recent batch size of batched function calls (which can change with adaptive batch sizing)
+        self.batch_size: list[Optional[int]] = [None] * row_builder.num_materialized
         self.row_builder = row_builder
 
     def print(self, num_rows: int) -> None:
@@ -30,7 +32,11 @@ class ExecProfile:
             per_call_time = self.eval_time[i] / self.eval_count[i]
             calls_per_row = self.eval_count[i] / num_rows
             multiple_str = f'({calls_per_row}x)' if calls_per_row > 1 else ''
-            print(f'{self.row_builder.unique_exprs[i]}: {utils.print_perf_counter_delta(per_call_time)} {multiple_str}')
+            batch_size_str = f' [batch_size={self.batch_size[i]}]' if self.batch_size[i] is not None else ''
+            print(
+                f'{self.row_builder.unique_exprs[i]}: {utils.print_perf_counter_delta(per_call_time)} {multiple_str}'
+                f'{batch_size_str}'
+            )
 
 
 @dataclass
@@ -72,6 +78,11 @@ class RowBuilder:
     # (a subexpr can be shared across multiple output exprs)
     output_expr_ids: list[set[int]]
 
+    # slot idxs that require special handling in DataRow; shared by all DataRows created for this RowBuilder
+    img_slot_idxs: frozenset[int]
+    media_slot_idxs: frozenset[int]  # non-image media slots
+    array_slot_idxs: frozenset[int]
+
     @dataclass
     class EvalCtx:
         """Context for evaluating a set of target exprs"""
@@ -199,6 +210,11 @@ class RowBuilder:
         for e in self.output_exprs:
             self._record_output_expr_id(e, e.slot_idx)
 
+        self.img_slot_idxs = frozenset(e.slot_idx for e in self.unique_exprs if e.col_type.is_image_type())
+        self.media_slot_idxs = frozenset(
+            e.slot_idx for e in self.unique_exprs if e.col_type.is_media_type() and not e.col_type.is_image_type())
+        self.array_slot_idxs = frozenset(e.slot_idx for e in self.unique_exprs if e.col_type.is_array_type())
+
     def add_table_column(self, col: catalog.Column, slot_idx: int) -> None:
         """Record a column that is part of the table row"""
         self.table_columns.append(ColumnSlotIdx(col, slot_idx))
@@ -356,28 +372,75 @@ class RowBuilder:
             assert expr.slot_idx >= 0
             if data_row.has_val[expr.slot_idx] or data_row.has_exc(expr.slot_idx):
                 continue
+            self._eval_expr(expr, data_row, profile, ignore_errors)
+
+    def eval_batch(
+            self, data_rows: Sequence[DataRow], ctx: EvalCtx, profile: Optional[ExecProfile] = None,
+            ignore_errors: bool = False
+    ) -> None:
+        """
+        Populates the slots given in ctx for all data_rows, one expr at a time.
+        Exprs that support Expr.eval_batch() are evaluated for all rows with a single call (eg, with NumPy);
+        all others (and those that decline a particular batch) are evaluated row by row, as in eval().
+        Has the same exception semantics as calling eval() for each row.
+        """
+        for expr in ctx.exprs:
+            assert expr.slot_idx >= 0
+            slot_idx = expr.slot_idx
+            target_rows = [row for row in data_rows if not row.has_val[slot_idx] and not row.has_exc(slot_idx)]
+            if len(target_rows) == 0:
+                continue
+            start_time = time.perf_counter()
             try:
-                start_time = time.perf_counter()
-                expr.eval(data_row, self)
+                result_vals = expr.eval_batch(target_rows, self) if len(target_rows) > 1 else None
+            except Exception:
+                # exceptions are recorded per row by the fallback below
+                result_vals = None
+            if result_vals is not None:
+                assert len(result_vals) == len(target_rows)
+                for row, val in zip(target_rows, result_vals):
+                    row[slot_idx] = val
                 if profile is not None:
-                    profile.eval_time[expr.slot_idx] += time.perf_counter() - start_time
-                    profile.eval_count[expr.slot_idx] += 1
-            except Exception as exc:
-                _, _, exc_tb = sys.exc_info()
-                self.set_exc(data_row, expr.slot_idx, exc)
-                if not ignore_errors:
-                    input_vals = [data_row[d.slot_idx] for d in expr.dependencies()]
-                    raise excs.ExprEvalError(
-                        expr, f'expression {expr}', data_row.get_exc(expr.slot_idx), exc_tb, input_vals, 0)
-
-    def create_table_row(self, data_row: DataRow, exc_col_ids: set[int]) -> tuple[dict[str, Any], int]:
+                    profile.eval_time[slot_idx] += time.perf_counter() - start_time
+                    profile.eval_count[slot_idx] += len(target_rows)
+                continue
+            for row in target_rows:
+                self._eval_expr(expr, row, profile, ignore_errors)
+
+    def _eval_expr(
+            self, expr: Expr, data_row: DataRow, profile: Optional[ExecProfile], ignore_errors: bool
+    ) -> None:
+        try:
+            start_time = time.perf_counter()
+            expr.eval(data_row, self)
+            if profile is not None:
+                profile.eval_time[expr.slot_idx] += time.perf_counter() - start_time
+                profile.eval_count[expr.slot_idx] += 1
+        except Exception as exc:
+            _, _, exc_tb = sys.exc_info()
+            self.set_exc(data_row, expr.slot_idx, exc)
+            if not ignore_errors:
+                input_vals = [data_row[d.slot_idx] for d in expr.dependencies()]
+                raise excs.ExprEvalError(
+                    expr, f'expression {expr}', data_row.get_exc(expr.slot_idx), exc_tb, input_vals, 0)
+
+    def table_store_columns(self) -> list[sql.Column]:
+        """Returns the store columns populated by create_table_row(), in the order of its values"""
+        result: list[sql.Column] = []
+        for info in self.table_columns:
+            result.append(info.col.sa_col)
+            if info.col.records_errors:
+                result.extend([info.col.sa_errortype_col, info.col.sa_errormsg_col])
+        return result
+
+    def create_table_row(self, data_row: DataRow, exc_col_ids: set[int]) -> tuple[list[Any], int]:
         """Create a table row from the slots that have an output column assigned
 
-        Return tuple[dict that represents a stored row (can be passed to sql.insert()), # of exceptions]
+        Return tuple[values of the columns returned by table_store_columns(), # of exceptions]
             This excludes system columns.
         """
         num_excs = 0
-        table_row: dict[str, Any] = {}
+        table_row: list[Any] = []
         for info in self.table_columns:
             col, slot_idx = info.col, info.slot_idx
             if data_row.has_exc(slot_idx):
@@ -385,14 +448,12 @@ class RowBuilder:
                 exc = data_row.get_exc(slot_idx)
                 num_excs += 1
                 exc_col_ids.add(col.id)
-                table_row[col.store_name()] = None
-                table_row[col.errortype_store_name()] = type(exc).__name__
-                table_row[col.errormsg_store_name()] = str(exc)
+                table_row.append(None)
+                if col.records_errors:
+                    table_row.extend([type(exc).__name__, str(exc)])
             else:
-                val = data_row.get_stored_val(slot_idx, col.sa_col.type)
-                table_row[col.store_name()] = val
-                # we unfortunately need to set these, even if there are no errors
-                table_row[col.errortype_store_name()] = None
-                table_row[col.errormsg_store_name()] = None
+                table_row.append(data_row.get_stored_val(slot_idx, col.sa_col.type))
+                if col.records_errors:
+                    table_row.extend([None, None])
 
         return table_row, num_excs
@@ -15,7 +15,9 @@ from .sql_element_cache import SqlElementCache
 
 class SimilarityExpr(Expr):
 
-    def __init__(self, col_ref: ColumnRef, item: Any, idx_name: Optional[str] = None):
+    def __init__(
+            self, col_ref: ColumnRef, item: Any, idx_name: Optional[str] = None, ef_search: Optional[int] = None,
+            probes: Optional[int] = None):
         super().__init__(ts.FloatType())
         item_expr = Expr.from_object(item)
         if item_expr is None or not(item_expr.col_type.is_string_type() or item_expr.col_type.is_image_type()):
@@ -23,7 +25,6 @@ class SimilarityExpr(Expr):
         assert item_expr.col_type.is_string_type() or item_expr.col_type.is_image_type()
 
         self.components = [col_ref, item_expr]
-        self.id = self._create_id()
 
         # determine index to use
         idx_info = col_ref.col.get_idx_info()
@@ -55,9 +56,52 @@ class SimilarityExpr(Expr):
                 f'Embedding index {self.idx_info.name!r} on column {self.idx_info.col.name!r} was created without the '
                 f"'image_embed' parameter and does not support image queries")
 
+        # query-time parameter of the index
+        self.search_param_val: Optional[int] = None
+        for param_name, val in [('ef_search', ef_search), ('probes', probes)]:
+            if val is None:
+                continue
+            if param_name != idx.search_param:
+                raise excs.Error(
+                    f'similarity(): {param_name!r} is not supported by index {self.idx_info.name!r}, which is a '
+                    f'{idx.index_type.name.lower()} index (use {idx.search_param!r})')
+            if not isinstance(val, int) or isinstance(val, bool) or val < 1:
+                raise excs.Error(f'similarity(): {param_name!r} must be a positive integer, got {val!r}')
+            self.search_param_val = val
+        self.id = self._create_id()
+
     def __repr__(self) -> str:
         return f'{self.components[0]}.similarity({self.components[1]})'
 
+    def _id_attrs(self) -> list[tuple[str, Any]]:
+        return super()._id_attrs() + [('idx_name', self.idx_info.name), ('search_param_val', self.search_param_val)]
+
+    def _equals(self, other: 'SimilarityExpr') -> bool:
+        return self.idx_info.name == other.idx_info.name and self.search_param_val == other.search_param_val
+
+    def search_settings(self) -> dict[str, str]:
+        """Returns the Postgres settings that need to be in effect when the query runs"""
+        if self.search_param_val is None:
+            return {}
+        from pixeltable import index
+        assert isinstance(self.idx_info.idx, index.EmbeddingIndex)
+        return self.idx_info.idx.search_settings(self.search_param_val)
+
+    def candidates_clause(self, is_asc: bool) -> Optional[sql.ColumnElement]:
+        """
+        Returns the ColumnElement that orders the candidate rows for a limited ORDER BY on this expression,
+        or None if the index doesn't need re-ranking or the ordering doesn't return the nearest neighbors first
+        """
+        from pixeltable import index
+        idx = self.idx_info.idx
+        assert isinstance(idx, index.EmbeddingIndex)
+        if idx.precision != index.EmbeddingIndex.Precision.BINARY:
+            return None
+        if is_asc and idx.metric != index.EmbeddingIndex.Metric.L2:
+            return None
+        item = self.components[1].val
+        return idx.candidates_clause(self.idx_info.val_col, idx.embed_query(item))
+
     def default_column_name(self) -> str:
         return 'similarity'
 
@@ -81,8 +125,19 @@ class SimilarityExpr(Expr):
         # this should never get called
         assert False
 
+    def _as_dict(self) -> dict:
+        from pixeltable import index
+        assert isinstance(self.idx_info.idx, index.EmbeddingIndex)
+        return {
+            'idx_name': self.idx_info.name,
+            self.idx_info.idx.search_param: self.search_param_val,
+            **super()._as_dict()
+        }
+
     @classmethod
     def _from_dict(cls, d: dict, components: list[Expr]) -> 'SimilarityExpr':
         assert len(components) == 2
         assert isinstance(components[0], ColumnRef)
-        return cls(components[0], components[1])
+        return cls(
+            components[0], components[1], idx_name=d.get('idx_name'), ef_search=d.get('ef_search'),
+            probes=d.get('probes'))
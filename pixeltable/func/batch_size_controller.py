@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import sys
+import threading
+from typing import Optional
+
+import psutil
+
+_logger = logging.getLogger('pixeltable')
+
+
+class BatchSizeController:
+    """Tunes the batch size of a batched function at runtime, within [min_batch_size, max_batch_size]
+
+    The candidate sizes are initial_size * 2^k, which makes any two of them divide each other (and keeps the
+    regrouping in ExprEvalNode cheap). The controller:
+    - grows the batch size as long as that improves throughput (rows/s), while the batch latency stays below
+      MAX_LATENCY and the peak RSS stays below MAX_RSS_FRACTION of physical memory
+    - shrinks it when a limit is exceeded, or when a call fails because the batch was too large (out-of-memory
+      errors, HTTP 413 responses); the size at which that happened is never tried again
+    - leaves it alone when a call gets rate-limited (HTTP 429): the caller retries after a delay
+    - converges on the best size: once growing stops paying off, it stays put
+    """
+    MAX_LATENCY = 30.0  # in seconds
+    MAX_RSS_FRACTION = 0.8
+    # a larger size needs to improve throughput by at least this much to be adopted
+    MIN_THROUGHPUT_GAIN = 0.05
+    # number of full batches at a size before we make a decision
+    NUM_SAMPLES = 2
+
+    @dataclasses.dataclass
+    class SizeStats:
+        num_batches: int = 0
+        throughput: float = 0.0  # rows/s, moving average
+        latency: float = 0.0  # s, moving average
+
+    sizes: list[int]  # candidate sizes, in ascending order
+    idx: int  # index of the current size
+    ceiling: int  # max. index we're allowed to try
+    stats: dict[int, SizeStats]  # key: idx
+    converged: bool
+    _last_max_rss: int
+    _lock: threading.Lock
+
+    def __init__(self, initial_size: int, min_size: int, max_size: int):
+        assert 1 <= min_size <= initial_size <= max_size
+        sizes = [initial_size]
+        while sizes[0] % 2 == 0 and sizes[0] // 2 >= min_size:
+            sizes.insert(0, sizes[0] // 2)
+        while sizes[-1] * 2 <= max_size:
+            sizes.append(sizes[-1] * 2)
+        self.sizes = sizes
+        self.idx = sizes.index(initial_size)
+        self.ceiling = len(sizes) - 1
+        self.stats = {}
+        self.converged = False
+        self._last_max_rss = self._get_max_rss()
+        self._lock = threading.Lock()
+
+    @property
+    def batch_size(self) -> int:
+        return self.sizes[self.idx]
+
+    def record_batch(self, num_rows: int, latency: float) -> None:
+        """Record the outcome of a successful call with num_rows rows"""
+        with self._lock:
+            if num_rows != self.batch_size:
+                # partial batches don't tell us much about the current size
+                return
+            stats = self.stats.setdefault(self.idx, self.SizeStats())
+            throughput = num_rows / max(latency, 1e-9)
+            if stats.num_batches == 0:
+                stats.throughput, stats.latency = throughput, latency
+            else:
+                stats.throughput = 0.5 * stats.throughput + 0.5 * throughput
+                stats.latency = 0.5 * stats.latency + 0.5 * latency
+            stats.num_batches += 1
+
+            if self._memory_exceeded() or stats.latency > self.MAX_LATENCY:
+                self._shrink(reason='memory/latency limit')
+                return
+            if stats.num_batches < self.NUM_SAMPLES or self.converged:
+                return
+            prev_stats = self.stats.get(self.idx - 1)
+            if prev_stats is not None and prev_stats.num_batches > 0 \
+                    and stats.throughput < prev_stats.throughput * (1 + self.MIN_THROUGHPUT_GAIN):
+                # the last increase didn't pay off: go back and stay there
+                self.ceiling = self.idx - 1
+                self.idx -= 1
+                self.converged = True
+                _logger.debug(f'batch size converged to {self.batch_size}')
+                return
+            if self.idx < self.ceiling:
+                self.idx += 1
+                _logger.debug(f'increasing batch size to {self.batch_size}')
+
+    def record_failure(self, exc: Exception) -> bool:
+        """
+        Record a failed call. Returns True if the call should be retried: the failure was caused by the batch size and
+        the batch size was reduced, or the call was rate-limited (the caller needs to back off before retrying).
+        """
+        if self.is_rate_limit_error(exc):
+            # a throttling burst doesn't tell us anything about the batch size
+            return True
+        if not self.is_batch_size_error(exc):
+            return False
+        with self._lock:
+            if self.idx == 0:
+                return False
+            self._shrink(reason=str(exc))
+            return True
+
+    def _shrink(self, reason: str) -> None:
+        if self.idx == 0:
+            return
+        self.ceiling = self.idx - 1
+        self.idx -= 1
+        self.stats.pop(self.idx, None)  # re-measure
+        _logger.debug(f'reducing batch size to {self.batch_size} ({reason})')
+
+    @classmethod
+    def is_batch_size_error(cls, exc: Exception) -> bool:
+        """Returns True if exc indicates that the batch was too large"""
+        if isinstance(exc, MemoryError):
+            return True
+        # eg, torch.cuda.OutOfMemoryError
+        if 'out of memory' in str(exc).lower():
+            return True
+        return cls.get_status_code(exc) == 413
+
+    @classmethod
+    def is_rate_limit_error(cls, exc: Exception) -> bool:
+        return cls.get_status_code(exc) == 429
+
+    @classmethod
+    def get_status_code(cls, exc: Exception) -> Optional[int]:
+        """Returns the HTTP status code of API client exceptions (openai, anthropic, httpx, requests, ...)"""
+        status_code = getattr(exc, 'status_code', None)
+        if status_code is None:
+            status_code = getattr(getattr(exc, 'response', None), 'status_code', None)
+        return status_code if isinstance(status_code, int) else None
+
+    def _memory_exceeded(self) -> bool:
+        rss = psutil.Process().memory_info().rss
+        max_rss = self._get_max_rss()
+        if max_rss > self._last_max_rss:
+            # the process reached a new peak during the last call, which catches allocations that were released again
+            # by the end of the call
+            rss = max(rss, max_rss)
+            self._last_max_rss = max_rss
+        return rss > self.MAX_RSS_FRACTION * psutil.virtual_memory().total
+
+    @classmethod
+    def _get_max_rss(cls) -> int:
+        """Returns the peak RSS of this process in bytes, or 0 if that's not available"""
+        try:
+            import resource
+        except ImportError:
+            return 0
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    def __repr__(self) -> str:
+        return f'BatchSizeController(batch_size={self.batch_size}, sizes={self.sizes}, converged={self.converged})'
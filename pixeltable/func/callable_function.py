@@ -6,6 +6,7 @@ from uuid import UUID
 
 import cloudpickle  # type: ignore[import-untyped]
 
+from .batch_size_controller import BatchSizeController
 from .function import Function
 from .signature import Signature
 
@@ -17,6 +18,7 @@ class CallableFunction(Function):
     - references to lambdas and functions defined in notebooks, which are pickled and serialized to the store
     - functions that are defined in modules are serialized via the default mechanism
     """
+    EXECUTORS = ('process',)
 
     def __init__(
         self,
@@ -25,6 +27,11 @@ class CallableFunction(Function):
         self_path: Optional[str] = None,
         self_name: Optional[str] = None,
         batch_size: Optional[int] = None,
+        min_batch_size: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        executor: Optional[str] = None,
+        is_deterministic: bool = False,
         is_method: bool = False,
         is_property: bool = False
     ):
@@ -32,6 +39,22 @@ class CallableFunction(Function):
         self.py_fn = py_fn
         self.self_name = self_name
         self.batch_size = batch_size
+        # bounds for adaptive batch sizing; batch_size is the initial size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_size_controller: Optional[BatchSizeController] = None
+        if batch_size is not None and (min_batch_size is not None or max_batch_size is not None):
+            self.batch_size_controller = BatchSizeController(
+                batch_size, min_batch_size if min_batch_size is not None else 1,
+                max_batch_size if max_batch_size is not None else batch_size)
+        # max. number of in-flight calls for I/O-bound (non-batched) functions; None: calls are made sequentially
+        self.max_concurrency = max_concurrency
+        # 'process': calls are made in a pool of max_concurrency (default: # of CPUs) worker processes
+        self.executor = executor
+        # if True, results are memoized in the persistent ResultCache
+        self.is_deterministic = is_deterministic
+        # hash of the function identity, computed by the ResultCache on first use
+        self.result_cache_version: Optional[str] = None
         self.__doc__ = py_fn.__doc__
         super().__init__(signature, self_path=self_path, is_method=is_method, is_property=is_property)
 
@@ -39,6 +62,17 @@ class CallableFunction(Function):
     def is_batched(self) -> bool:
         return self.batch_size is not None
 
+    @property
+    def is_concurrent(self) -> bool:
+        return (
+            self.max_concurrency is not None and self.max_concurrency > 1 and not self.is_batched
+            and self.executor is None
+        )
+
+    @property
+    def runs_in_process_pool(self) -> bool:
+        return self.executor == 'process'
+
     def exec(self, *args: Any, **kwargs: Any) -> Any:
         if self.is_batched:
             # Pack the batched parameters into singleton lists
@@ -65,10 +99,25 @@ class CallableFunction(Function):
         batched_kwargs = {k: v for k, v in kwargs.items() if k not in constant_param_names}
         return self.py_fn(*args, **constant_kwargs, **batched_kwargs)
 
-    # TODO(aaron-siegel): Implement conditional batch sizing
     def get_batch_size(self, *args: Any, **kwargs: Any) -> Optional[int]:
+        if self.batch_size_controller is not None:
+            return self.batch_size_controller.batch_size
         return self.batch_size
 
+    def record_batch(self, num_rows: int, latency: float) -> None:
+        """Report a successful exec_batch() call to the adaptive batch sizing"""
+        if self.batch_size_controller is not None:
+            self.batch_size_controller.record_batch(num_rows, latency)
+
+    def record_batch_failure(self, exc: Exception) -> bool:
+        """
+        Report a failed exec_batch() call to the adaptive batch sizing.
+        Returns True if the batch size was reduced in response and the call should be retried.
+        """
+        if self.batch_size_controller is not None:
+            return self.batch_size_controller.record_failure(exc)
+        return False
+
     @property
     def display_name(self) -> str:
         return self.self_name
@@ -102,6 +151,11 @@ class CallableFunction(Function):
         md = {
             'signature': self.signature.as_dict(),
             'batch_size': self.batch_size,
+            'min_batch_size': self.min_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'max_concurrency': self.max_concurrency,
+            'executor': self.executor,
+            'is_deterministic': self.is_deterministic,
         }
         return md, cloudpickle.dumps(self.py_fn)
 
@@ -111,7 +165,12 @@ class CallableFunction(Function):
         assert callable(py_fn)
         sig = Signature.from_dict(md['signature'])
         batch_size = md['batch_size']
-        return CallableFunction(sig, py_fn, self_name=name, batch_size=batch_size)
+        max_concurrency = md.get('max_concurrency')
+        executor = md.get('executor')
+        return CallableFunction(
+            sig, py_fn, self_name=name, batch_size=batch_size, min_batch_size=md.get('min_batch_size'),
+            max_batch_size=md.get('max_batch_size'), max_concurrency=max_concurrency, executor=executor,
+            is_deterministic=md.get('is_deterministic', False))
 
     def validate_call(self, bound_args: dict[str, Any]) -> None:
         import pixeltable.exprs as exprs
@@ -23,6 +23,11 @@ def udf(decorated_fn: Callable) -> Function: ...
 def udf(
         *,
         batch_size: Optional[int] = None,
+        min_batch_size: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        executor: Optional[str] = None,
+        is_deterministic: bool = False,
         substitute_fn: Optional[Callable] = None,
         is_method: bool = False,
         is_property: bool = False,
@@ -37,6 +42,35 @@ def udf(*args, **kwargs):
         >>> @pxt.udf
         ... def my_function(x: int) -> int:
         ...    return x + 1
+
+        An I/O-bound function (such as one that calls a remote API) can be marked with `max_concurrency`, in which
+        case up to that many calls are in flight at the same time:
+
+        >>> @pxt.udf(max_concurrency=16)
+        ... def fetch_title(url: str) -> str:
+        ...    return requests.get(url).json()['title']
+
+        The batch size of a batched function can be tuned at runtime, based on observed latency, throughput and memory
+        use, by giving bounds; `batch_size` is then the initial size:
+
+        >>> @pxt.udf(batch_size=16, min_batch_size=4, max_batch_size=256)
+        ... def embed(texts: Batch[str]) -> Batch[pxt.Array[(512,), pxt.Float]]:
+        ...    return model.encode(texts)
+
+        A CPU-bound function can be run in a pool of worker processes with `executor='process'`; `max_concurrency`
+        then sets the number of workers (the default is the number of CPUs):
+
+        >>> @pxt.udf(executor='process')
+        ... def blur(img: PIL.Image.Image) -> PIL.Image.Image:
+        ...    return img.filter(PIL.ImageFilter.GaussianBlur(5))
+
+        A function whose result only depends on its arguments can be declared with `is_deterministic=True`; its
+        results are then memoized in a persistent cache (bounded by the `udf_cache_size_g` config parameter), and
+        repeated calls with the same arguments, in this or later sessions, don't invoke the function again:
+
+        >>> @pxt.udf(batch_size=32, is_deterministic=True)
+        ... def embed(texts: Batch[str]) -> Batch[pxt.Array[(512,), pxt.Float]]:
+        ...    return model.encode(texts)
     """
     if len(args) == 1 and len(kwargs) == 0 and callable(args[0]):
 
@@ -49,6 +83,11 @@ def udf(*args, **kwargs):
         # Decorator schema invoked with parentheses: @pxt.udf(**kwargs)
         # Create a decorator for the specified schema.
         batch_size = kwargs.pop('batch_size', None)
+        min_batch_size = kwargs.pop('min_batch_size', None)
+        max_batch_size = kwargs.pop('max_batch_size', None)
+        max_concurrency = kwargs.pop('max_concurrency', None)
+        executor = kwargs.pop('executor', None)
+        is_deterministic = kwargs.pop('is_deterministic', False)
         substitute_fn = kwargs.pop('substitute_fn', None)
         is_method = kwargs.pop('is_method', None)
         is_property = kwargs.pop('is_property', None)
@@ -62,6 +101,11 @@ def udf(*args, **kwargs):
             return make_function(
                 decorated_fn,
                 batch_size=batch_size,
+                min_batch_size=min_batch_size,
+                max_batch_size=max_batch_size,
+                max_concurrency=max_concurrency,
+                executor=executor,
+                is_deterministic=is_deterministic,
                 substitute_fn=substitute_fn,
                 is_method=is_method,
                 is_property=is_property,
@@ -76,6 +120,11 @@ def make_function(
     return_type: Optional[ts.ColumnType] = None,
     param_types: Optional[list[ts.ColumnType]] = None,
     batch_size: Optional[int] = None,
+    min_batch_size: Optional[int] = None,
+    max_batch_size: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    executor: Optional[str] = None,
+    is_deterministic: bool = False,
     substitute_fn: Optional[Callable] = None,
     is_method: bool = False,
     is_property: bool = False,
@@ -114,6 +163,23 @@ def make_function(
         raise excs.Error(f'{errmsg_name}(): batch_size is specified; at least one Python parameter must be `Batch`')
     if batch_size is None and len(sig.batched_parameters) > 0:
         raise excs.Error(f'{errmsg_name}(): batched parameters in udf, but no `batch_size` given')
+    if (min_batch_size is not None or max_batch_size is not None) and batch_size is None:
+        raise excs.Error(f'{errmsg_name}(): `min_batch_size`/`max_batch_size` require `batch_size`')
+    if batch_size is not None:
+        min_size = 1 if min_batch_size is None else min_batch_size
+        max_size = batch_size if max_batch_size is None else max_batch_size
+        if not 1 <= min_size <= batch_size <= max_size:
+            raise excs.Error(
+                f'{errmsg_name}(): batch sizes must satisfy 1 <= min_batch_size <= batch_size <= max_batch_size')
+    if max_concurrency is not None and batch_size is not None:
+        raise excs.Error(f'{errmsg_name}(): `max_concurrency` cannot be combined with `batch_size`')
+    if max_concurrency is not None and max_concurrency < 1:
+        raise excs.Error(f'{errmsg_name}(): `max_concurrency` must be a positive integer')
+    if executor is not None and executor not in CallableFunction.EXECUTORS:
+        raise excs.Error(
+            f'{errmsg_name}(): `executor` must be one of {", ".join(repr(e) for e in CallableFunction.EXECUTORS)}')
+    if executor is not None and batch_size is not None:
+        raise excs.Error(f'{errmsg_name}(): `executor` cannot be combined with `batch_size`')
 
     if is_method and is_property:
         raise excs.Error(f'Cannot specify both `is_method` and `is_property` (in function `{function_name}`)')
@@ -137,6 +203,11 @@ def make_function(
         self_path=function_path,
         self_name=function_name,
         batch_size=batch_size,
+        min_batch_size=min_batch_size,
+        max_batch_size=max_batch_size,
+        max_concurrency=max_concurrency,
+        executor=executor,
+        is_deterministic=is_deterministic,
         is_method=is_method,
         is_property=is_property
     )
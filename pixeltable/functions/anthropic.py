@@ -36,7 +36,7 @@ def _retry(fn: Callable) -> Callable:
     )(fn)
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def messages(
     messages: list[dict[str, str]],
     *,
@@ -26,7 +26,7 @@ def _fireworks_client() -> 'fireworks.client.Fireworks':
     return env.Env.get().get_client('fireworks')
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def chat_completions(
     messages: list[dict[str, str]],
     *,
@@ -21,7 +21,7 @@ def _ensure_loaded() -> None:
     env.Env.get().get_client('gemini')
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def generate_content(
     contents: str,
     *,
@@ -28,7 +28,7 @@ def _mistralai_client() -> 'mistralai.Mistral':
     return Env.get().get_client('mistral')
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def chat_completions(
     messages: list[dict[str, str]],
     *,
@@ -81,7 +81,7 @@ def chat_completions(
     ).dict()
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def fim_completions(
     prompt: str,
     *,
@@ -50,7 +50,7 @@ def _retry(fn: Callable) -> Callable:
 # Audio Endpoints
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def speech(
     input: str, *, model: str, voice: str, response_format: Optional[str] = None, speed: Optional[float] = None
 ) -> pxt.Audio:
@@ -90,7 +90,7 @@ def speech(
     return output_filename
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def transcriptions(
     audio: pxt.Audio,
     *,
@@ -131,7 +131,7 @@ def transcriptions(
     return transcription.dict()
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def translations(
     audio: pxt.Audio,
     *,
@@ -175,7 +175,7 @@ def translations(
 # Chat Endpoints
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def chat_completions(
     messages: list,
     *,
@@ -247,7 +247,7 @@ def chat_completions(
     return result.dict()
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def vision(prompt: str, image: PIL.Image.Image, *, model: str) -> str:
     """
     Analyzes an image with the OpenAI vision capability. This is a convenience function that takes an image and
@@ -352,7 +352,7 @@ def _(model: str, dimensions: Optional[int] = None) -> pxt.ArrayType:
 # Images Endpoints
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def image_generations(
     prompt: str,
     *,
@@ -422,7 +422,7 @@ def _(size: Optional[str] = None) -> pxt.ImageType:
 # Moderations Endpoints
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def moderations(input: str, *, model: Optional[str] = None) -> dict:
     """
     Classifies if text is potentially harmful.
@@ -25,7 +25,7 @@ def _replicate_client() -> 'replicate.Client':
     return Env.get().get_client('replicate')
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def run(
     input: dict[str, Any],
     *,
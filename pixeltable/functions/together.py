@@ -46,7 +46,7 @@ def _retry(fn: Callable[..., T]) -> Callable[..., T]:
     )(fn)
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def completions(
     prompt: str,
     *,
@@ -106,7 +106,7 @@ def completions(
     )
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def chat_completions(
     messages: list[dict[str, str]],
     *,
@@ -223,7 +223,7 @@ def _(model: str) -> pxt.ArrayType:
     return pxt.ArrayType((dimensions,), dtype=pxt.FloatType())
 
 
-@pxt.udf
+@pxt.udf(max_concurrency=8)
 def image_generations(
     prompt: str,
     *,
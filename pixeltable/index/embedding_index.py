@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 import enum
-from typing import Any, Optional
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Sequence, Union
 
 import numpy as np
 import pgvector.sqlalchemy  # type: ignore[import-untyped]
 import PIL.Image
 import sqlalchemy as sql
+from sqlalchemy.dialects import postgresql
 
 import pixeltable.exceptions as excs
 import pixeltable.type_system as ts
@@ -24,25 +28,91 @@ class EmbeddingIndex(IndexBase):
       the Order By clause
     - order_by_clause() is used exclusively in the ORDER BY clause
     - embedding function parameters are named '<type-name>_embed', where type-name is ColumnType.Type.name
+    - query items are embedded once: the embeddings are kept in an LRU cache, so that a query that references the
+      same similarity() in its select list and its ORDER BY clause, or a query that gets repeated, doesn't call the
+      embedding function again
+    - embed_queries() and the embedding_*/distance_clause() methods support searches for many query items at once
+      (DataFrame.similarity_search())
+    - the index value column always stores full-precision vectors; with a 'halfvec' or 'binary' precision, the index is
+      created on an expression that converts them to half-precision vectors or binary-quantized bit strings
+    - a 'binary' index returns approximate neighbors: queries retrieve rerank_factor * limit candidates with the
+      index (candidates_clause()) and order them by their exact distance (order_by_clause())
     """
+    # max. number of cached query embeddings per index
+    QUERY_CACHE_SIZE = 256
 
     class Metric(enum.Enum):
         COSINE = 1
         IP = 2
         L2 = 3
 
+    class Type(enum.Enum):
+        HNSW = 1
+        IVFFLAT = 2
+
+    class Precision(enum.Enum):
+        VECTOR = 1
+        HALFVEC = 2
+        BINARY = 3
+
     PGVECTOR_OPS = {
         Metric.COSINE: 'vector_cosine_ops',
         Metric.IP: 'vector_ip_ops',
         Metric.L2: 'vector_l2_ops'
     }
 
+    HALFVEC_OPS = {
+        Metric.COSINE: 'halfvec_cosine_ops',
+        Metric.IP: 'halfvec_ip_ops',
+        Metric.L2: 'halfvec_l2_ops'
+    }
+
+    # distance operators, by metric
+    PGVECTOR_OPERATORS = {
+        Metric.COSINE: '<=>',
+        Metric.IP: '<#>',
+        Metric.L2: '<->'
+    }
+
+    # build parameters and their defaults, by index type
+    BUILD_PARAMS = {
+        Type.HNSW: {'m': 16, 'ef_construction': 64},
+        Type.IVFFLAT: {'lists': 100},
+    }
+
+    # query-time parameter, by index type
+    SEARCH_PARAMS = {
+        Type.HNSW: 'ef_search',
+        Type.IVFFLAT: 'probes',
+    }
+
+    DEFAULT_RERANK_FACTOR = 4
+
+    class HalfVector(sql.types.UserDefinedType):
+        """The pgvector halfvec type, for use in casts"""
+        cache_ok = True
+
+        def __init__(self, dim: int):
+            super().__init__()
+            self.dim = dim
+
+        def get_col_spec(self, **kw: Any) -> str:
+            return f'HALFVEC({self.dim})'
+
     def __init__(
             self, c: catalog.Column, metric: str, string_embed: Optional[func.Function] = None,
-            image_embed: Optional[func.Function] = None):
+            image_embed: Optional[func.Function] = None, index_type: str = 'hnsw',
+            build_params: Optional[dict[str, int]] = None, precision: str = 'vector',
+            rerank_factor: Optional[int] = None):
         metric_names = [m.name.lower() for m in self.Metric]
         if metric.lower() not in metric_names:
             raise excs.Error(f'Invalid metric {metric}, must be one of {metric_names}')
+        type_names = [t.name.lower() for t in self.Type]
+        if index_type.lower() not in type_names:
+            raise excs.Error(f'Invalid index type {index_type}, must be one of {type_names}')
+        precision_names = [p.name.lower() for p in self.Precision]
+        if precision.lower() not in precision_names:
+            raise excs.Error(f'Invalid precision {precision}, must be one of {precision_names}')
         if not c.col_type.is_string_type() and not c.col_type.is_image_type():
             raise excs.Error(f'Embedding index requires string or image column')
         if c.col_type.is_string_type() and string_embed is None:
@@ -57,13 +127,44 @@ class EmbeddingIndex(IndexBase):
             self._validate_embedding_fn(image_embed, 'image_embed', ts.ColumnType.Type.IMAGE)
 
         self.metric = self.Metric[metric.upper()]
+        self.index_type = self.Type[index_type.upper()]
+        self.precision = self.Precision[precision.upper()]
+        self.build_params = self._validate_build_params(self.index_type, build_params)
+        if rerank_factor is not None:
+            if self.precision != self.Precision.BINARY:
+                raise excs.Error(f"'rerank_factor' is only supported with precision='binary'")
+            if not isinstance(rerank_factor, int) or isinstance(rerank_factor, bool) or rerank_factor < 1:
+                raise excs.Error(f"'rerank_factor' must be a positive integer, got {rerank_factor!r}")
+        elif self.precision == self.Precision.BINARY:
+            rerank_factor = self.DEFAULT_RERANK_FACTOR
+        self.rerank_factor = rerank_factor
+
         self.value_expr = string_embed(exprs.ColumnRef(c)) if c.col_type.is_string_type() else image_embed(exprs.ColumnRef(c))
         assert isinstance(self.value_expr.col_type, ts.ArrayType)
         self.string_embed = string_embed
         self.image_embed = image_embed
         vector_size = self.value_expr.col_type.shape[0]
         assert vector_size is not None
+        self.vector_size = vector_size
         self.index_col_type = pgvector.sqlalchemy.Vector(vector_size)
+        self.query_cache: OrderedDict[str, np.ndarray] = OrderedDict()  # item key -> embedding, in LRU order
+        self.query_cache_lock = threading.Lock()
+
+    @classmethod
+    def _validate_build_params(cls, index_type: Type, build_params: Optional[dict[str, int]]) -> dict[str, int]:
+        """Returns build_params with defaults filled in"""
+        result = dict(cls.BUILD_PARAMS[index_type])
+        if build_params is None:
+            return result
+        for name, val in build_params.items():
+            if name not in result:
+                raise excs.Error(
+                    f'Invalid build parameter {name!r} for a {index_type.name.lower()} index, must be one of '
+                    f'{list(result.keys())}')
+            if not isinstance(val, int) or isinstance(val, bool) or val < 1:
+                raise excs.Error(f'Build parameter {name!r} must be a positive integer, got {val!r}')
+            result[name] = val
+        return result
 
     def index_value_expr(self) -> exprs.Expr:
         """Return expression that computes the value that goes into the index"""
@@ -78,54 +179,170 @@ class EmbeddingIndex(IndexBase):
 
     def create_index(self, index_name: str, index_value_col: catalog.Column, conn: sql.engine.Connection) -> None:
         """Create the index on the index value column"""
+        if self.precision == self.Precision.VECTOR:
+            idx_expr = index_value_col.sa_col
+            ops = self.PGVECTOR_OPS[self.metric]
+        else:
+            # expression index: the label names the expression in postgresql_ops
+            idx_expr = self._indexed_value(index_value_col.sa_col).label(f'{index_value_col.sa_col.name}_idx')
+            ops = self.HALFVEC_OPS[self.metric] if self.precision == self.Precision.HALFVEC else 'bit_hamming_ops'
         idx = sql.Index(
-            index_name, index_value_col.sa_col,
-            postgresql_using='hnsw',
-            postgresql_with={'m': 16, 'ef_construction': 64},
-            postgresql_ops={index_value_col.sa_col.name: self.PGVECTOR_OPS[self.metric]}
+            index_name, idx_expr,
+            postgresql_using=self.index_type.name.lower(),
+            postgresql_with=self.build_params,
+            postgresql_ops={idx_expr.name: ops}
         )
         idx.create(bind=conn)
 
+    def _indexed_value(self, vector: sql.ColumnElement) -> sql.ColumnElement:
+        """Returns the representation of vector that is stored in the index"""
+        if self.precision == self.Precision.VECTOR:
+            return vector
+        if self.precision == self.Precision.HALFVEC:
+            return sql.cast(vector, self.HalfVector(self.vector_size))
+        assert self.precision == self.Precision.BINARY
+        return sql.cast(sql.func.binary_quantize(vector), postgresql.BIT(self.vector_size))
+
+    def _query_vector(self, embedding: Union[np.ndarray, sql.ColumnElement]) -> sql.ColumnElement:
+        if isinstance(embedding, np.ndarray):
+            # the explicit cast is needed for function arguments (eg, binary_quantize())
+            return sql.cast(sql.literal(embedding, self.index_col_type), self.index_col_type)
+        return embedding
+
+    def _distance(self, lhs: sql.ColumnElement, rhs: sql.ColumnElement) -> sql.ColumnElement:
+        return lhs.op(self.PGVECTOR_OPERATORS[self.metric], return_type=sql.Float)(rhs)
+
+    @property
+    def search_param(self) -> str:
+        """The name of the query-time parameter of the index"""
+        return self.SEARCH_PARAMS[self.index_type]
+
+    def search_settings(self, search_param_val: int) -> dict[str, str]:
+        """Returns the Postgres settings that apply the query-time parameter"""
+        return {f'{self.index_type.name.lower()}.{self.search_param}': str(search_param_val)}
+
     def similarity_clause(self, val_column: catalog.Column, item: Any) -> sql.ColumnElement:
         """Create a ColumnElement that represents '<val_column> <op> <item>'"""
-        assert isinstance(item, (str, PIL.Image.Image))
-        if isinstance(item, str):
-            assert self.string_embed is not None
-            embedding = self.string_embed.exec(item)
-        if isinstance(item, PIL.Image.Image):
-            assert self.image_embed is not None
-            embedding = self.image_embed.exec(item)
+        return self.embedding_similarity_clause(val_column, self.embed_query(item))
 
+    def embedding_similarity_clause(
+            self, val_column: catalog.Column, embedding: Union[np.ndarray, sql.ColumnElement]) -> sql.ColumnElement:
+        """Same as similarity_clause(), for a query embedding (or a SQL expression that returns one)"""
+        distance = self._distance(val_column.sa_col, self._query_vector(embedding))
         if self.metric == self.Metric.COSINE:
-            return val_column.sa_col.cosine_distance(embedding) * -1 + 1
+            return distance * -1 + 1
         elif self.metric == self.Metric.IP:
-            return val_column.sa_col.max_inner_product(embedding) * -1
+            return distance * -1
         else:
             assert self.metric == self.Metric.L2
-            return val_column.sa_col.l2_distance(embedding)
+            return distance
 
     def order_by_clause(self, val_column: catalog.Column, item: Any, is_asc: bool) -> sql.ColumnElement:
         """Create a ColumnElement that is used in an ORDER BY clause"""
+        result = self.distance_clause(val_column, self.embed_query(item))
+        if self.metric != self.Metric.L2 and is_asc:
+            result = result.desc()
+        return result
+
+    def distance_clause(
+            self, val_column: catalog.Column, embedding: Union[np.ndarray, sql.ColumnElement]) -> sql.ColumnElement:
+        """
+        Create a ColumnElement for the distance between val_column and a query embedding: ordering by it in ascending
+        order returns the nearest neighbors first. This uses the index, unless the index is binary-quantized (which
+        requires candidates_clause()).
+        """
+        if self.precision == self.Precision.BINARY:
+            return self._distance(val_column.sa_col, self._query_vector(embedding))
+        return self._distance(
+            self._indexed_value(val_column.sa_col), self._indexed_value(self._query_vector(embedding)))
+
+    def candidates_clause(
+            self, val_column: catalog.Column, embedding: Union[np.ndarray, sql.ColumnElement]) -> sql.ColumnElement:
+        """
+        For a binary-quantized index: create a ColumnElement for the Hamming distance of the quantized vectors, which
+        uses the index; ordering by it in ascending order returns the candidates for the nearest neighbors first.
+        """
+        assert self.precision == self.Precision.BINARY
+        return self._indexed_value(val_column.sa_col) \
+            .op('<~>', return_type=sql.Float)(self._indexed_value(self._query_vector(embedding)))
+
+    def embed_query(self, item: Any) -> np.ndarray:
+        """Returns the embedding of a query item, computing it only if it's not cached"""
         assert isinstance(item, (str, PIL.Image.Image))
-        embedding: Optional[np.ndarray] = None
+        key = self._query_key(item)
+        with self.query_cache_lock:
+            embedding = self.query_cache.get(key)
+            if embedding is not None:
+                self.query_cache.move_to_end(key)
+                return embedding
+
         if isinstance(item, str):
             assert self.string_embed is not None
             embedding = self.string_embed.exec(item)
-        if isinstance(item, PIL.Image.Image):
+        else:
             assert self.image_embed is not None
             embedding = self.image_embed.exec(item)
         assert embedding is not None
+        with self.query_cache_lock:
+            self.query_cache[key] = embedding
+            if len(self.query_cache) > self.QUERY_CACHE_SIZE:
+                self.query_cache.popitem(last=False)
+        return embedding
 
-        if self.metric == self.Metric.COSINE:
-            result = val_column.sa_col.cosine_distance(embedding)
-            result = result.desc() if is_asc else result
-        elif self.metric == self.Metric.IP:
-            result = val_column.sa_col.max_inner_product(embedding)
-            result = result.desc() if is_asc else result
+    def embed_queries(self, items: Sequence[Any]) -> list[np.ndarray]:
+        """
+        Returns the embeddings of a list of query items. Items that aren't cached are embedded together: with a
+        single call per batch if the embedding function is batched.
+        """
+        assert all(isinstance(item, (str, PIL.Image.Image)) for item in items)
+        keys = [self._query_key(item) for item in items]
+        embeddings: dict[str, np.ndarray] = {}
+        with self.query_cache_lock:
+            for key in keys:
+                embedding = self.query_cache.get(key)
+                if embedding is not None:
+                    self.query_cache.move_to_end(key)
+                    embeddings[key] = embedding
+
+        # embed each missing item once, with the function for its type
+        missing: dict[str, Any] = {key: item for key, item in zip(keys, items) if key not in embeddings}
+        for embed_fn, item_type in [(self.string_embed, str), (self.image_embed, PIL.Image.Image)]:
+            fn_keys = [key for key, item in missing.items() if isinstance(item, item_type)]
+            if len(fn_keys) == 0:
+                continue
+            assert embed_fn is not None
+            fn_embeddings = self._embed_batch(embed_fn, [missing[key] for key in fn_keys])
+            assert all(embedding is not None for embedding in fn_embeddings)
+            embeddings.update(zip(fn_keys, fn_embeddings))
+            with self.query_cache_lock:
+                for key in fn_keys:
+                    self.query_cache[key] = embeddings[key]
+                    if len(self.query_cache) > self.QUERY_CACHE_SIZE:
+                        self.query_cache.popitem(last=False)
+        return [embeddings[key] for key in keys]
+
+    @classmethod
+    def _embed_batch(cls, embed_fn: func.Function, items: list[Any]) -> list[np.ndarray]:
+        if isinstance(embed_fn, func.CallableFunction) and embed_fn.is_batched:
+            batch_size = embed_fn.get_batch_size() or len(items)
+            result: list[np.ndarray] = []
+            for i in range(0, len(items), batch_size):
+                result.extend(embed_fn.exec_batch(items[i:i + batch_size]))
+            return result
+        return [embed_fn.exec(item) for item in items]
+
+    @classmethod
+    def _query_key(cls, item: Any) -> str:
+        h = hashlib.sha256()
+        if isinstance(item, str):
+            h.update(b'S' + item.encode())
         else:
-            assert self.metric == self.Metric.L2
-            result = val_column.sa_col.l2_distance(embedding)
-        return result
+            assert isinstance(item, PIL.Image.Image)
+            h.update(f'I{item.mode}{item.size}'.encode())
+            h.update(item.tobytes())
+            if item.mode == 'P':
+                h.update(bytes(item.getpalette() or []))
+        return h.hexdigest()
 
     @classmethod
     def display_name(cls) -> str:
@@ -165,11 +382,19 @@ class EmbeddingIndex(IndexBase):
         return {
             'metric': self.metric.name.lower(),
             'string_embed': None if self.string_embed is None else self.string_embed.as_dict(),
-            'image_embed': None if self.image_embed is None else self.image_embed.as_dict()
+            'image_embed': None if self.image_embed is None else self.image_embed.as_dict(),
+            'index_type': self.index_type.name.lower(),
+            'build_params': self.build_params,
+            'precision': self.precision.name.lower(),
+            'rerank_factor': self.rerank_factor,
         }
 
     @classmethod
     def from_dict(cls, c: catalog.Column, d: dict) -> EmbeddingIndex:
         string_embed = func.Function.from_dict(d['string_embed']) if d['string_embed'] is not None else None
         image_embed = func.Function.from_dict(d['image_embed']) if d['image_embed'] is not None else None
-        return cls(c, metric=d['metric'], string_embed=string_embed, image_embed=image_embed)
+        # indices created before the index type was configurable are hnsw indices with the default build parameters
+        return cls(
+            c, metric=d['metric'], string_embed=string_embed, image_embed=image_embed,
+            index_type=d.get('index_type', 'hnsw'), build_params=d.get('build_params'),
+            precision=d.get('precision', 'vector'), rerank_factor=d.get('rerank_factor'))
@@ -1,15 +1,18 @@
+import bisect
 import logging
 import math
 from fractions import Fraction
 from pathlib import Path
-from typing import Any, Optional, Sequence
+from typing import Any, Optional, Sequence, Union
 
 import av  # type: ignore[import-untyped]
+import numpy as np
 import pandas as pd
 import PIL.Image
 
 import pixeltable.exceptions as excs
 import pixeltable.type_system as ts
+from pixeltable.utils.keyframe_index import KeyframeIndex
 
 from .base import ComponentIterator
 
@@ -30,12 +33,33 @@ class FrameIterator(ComponentIterator):
             extracted). If `fps` is greater than the frame rate of the video, an error will be raised.
         num_frames: Exact number of frames to extract. The frames will be spaced as evenly as possible. If
             `num_frames` is greater than the number of frames in the video, all frames will be extracted.
+        thread_type: How the decoder uses multiple threads: `'slice'` (decode parts of a frame in parallel),
+            `'frame'` (decode multiple frames in parallel), or `'auto'` (let the decoder choose). If omitted, frames
+            are decoded on a single thread.
+        width: Width of the extracted frames. The frames are scaled during the conversion to RGB, which is much
+            cheaper than resizing full-resolution frames afterwards. If only one of `width` or `height` is specified,
+            the other one is chosen to preserve the aspect ratio of the video.
+        height: Height of the extracted frames; see `width`.
+        as_array: If `True`, frames are returned as numpy arrays of shape `(height, width, 3)` with RGB values,
+            rather than as images. The `frame` column has type `Array[(height, width, 3), Int]`; its values keep
+            their uint8 dtype.
+
+    To get to the next frame it needs to extract, the iterator either steps through the intervening frames or seeks
+    to the keyframe preceding it, whichever requires decoding fewer frames. The keyframes of a video are looked up
+    in the KeyframeIndex, the first time they're needed.
     """
+    # the approximate cost of a seek, expressed as a number of decoded frames
+    SEEK_COST_FRAMES = 8
+    THREAD_TYPES = ('slice', 'frame', 'auto')
 
     # Input parameters
     video_path: Path
     fps: Optional[float]
     num_frames: Optional[int]
+    as_array: bool
+
+    # Size of the extracted frames, or None to extract frames at their native resolution
+    frame_size: Optional[tuple[int, int]]
 
     # Video info
     container: av.container.input.InputContainer
@@ -51,9 +75,27 @@ class FrameIterator(ComponentIterator):
     # frame index in the video. Otherwise, the corresponding video index is `frames_to_extract[next_pos]`.
     next_pos: int
 
-    def __init__(self, video: str, *, fps: Optional[float] = None, num_frames: Optional[int] = None):
+    # Video index of the last frame returned by the decoder (-1 if we haven't decoded anything yet)
+    decoded_idx: int
+
+    # Presentation timestamps and video indices of the keyframes, in ascending order; loaded on demand
+    keyframe_pts: Optional[list[int]]
+    keyframe_idxs: Optional[list[int]]
+
+    def __init__(
+        self,
+        video: str,
+        *,
+        fps: Optional[float] = None,
+        num_frames: Optional[int] = None,
+        thread_type: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        as_array: Optional[bool] = None,
+    ):
         if fps is not None and num_frames is not None:
             raise excs.Error('At most one of `fps` or `num_frames` may be specified')
+        self._validate_decode_args(thread_type, width, height)
 
         video_path = Path(video)
         assert video_path.exists() and video_path.is_file()
@@ -61,6 +103,18 @@ class FrameIterator(ComponentIterator):
         self.container = av.open(str(video_path))
         self.fps = fps
         self.num_frames = num_frames
+        self.as_array = bool(as_array)
+        if thread_type is not None:
+            self.container.streams.video[0].codec_context.thread_type = thread_type.upper()
+
+        self.frame_size = None
+        if width is not None or height is not None:
+            codec_context = self.container.streams.video[0].codec_context
+            if width is None:
+                width = max(1, round(height * codec_context.width / codec_context.height))
+            elif height is None:
+                height = max(1, round(width * codec_context.height / codec_context.width))
+            self.frame_size = (width, height)
 
         self.video_framerate = self.container.streams.video[0].average_rate
         self.video_time_base = self.container.streams.video[0].time_base
@@ -110,6 +164,9 @@ class FrameIterator(ComponentIterator):
 
         _logger.debug(f'FrameIterator: path={self.video_path} fps={self.fps} num_frames={self.num_frames}')
         self.next_pos = 0
+        self.decoded_idx = -1
+        self.keyframe_pts = None
+        self.keyframe_idxs = None
 
     @classmethod
     def input_schema(cls) -> dict[str, ts.ColumnType]:
@@ -117,17 +174,37 @@ class FrameIterator(ComponentIterator):
             'video': ts.VideoType(nullable=False),
             'fps': ts.FloatType(nullable=True),
             'num_frames': ts.IntType(nullable=True),
+            'thread_type': ts.StringType(nullable=True),
+            'width': ts.IntType(nullable=True),
+            'height': ts.IntType(nullable=True),
+            'as_array': ts.BoolType(nullable=True),
         }
 
     @classmethod
     def output_schema(cls, *args: Any, **kwargs: Any) -> tuple[dict[str, ts.ColumnType], list[str]]:
+        width, height = kwargs.get('width'), kwargs.get('height')
+        cls._validate_decode_args(kwargs.get('thread_type'), width, height)
+        frame_type: ts.ColumnType
+        if kwargs.get('as_array'):
+            frame_type = ts.ArrayType((height, width, 3), dtype=ts.IntType())
+        else:
+            frame_type = ts.ImageType()
         return {
             'frame_idx': ts.IntType(),
             'pos_msec': ts.FloatType(),
             'pos_frame': ts.IntType(),
-            'frame': ts.ImageType(),
+            'frame': frame_type,
         }, ['frame']
 
+    @classmethod
+    def _validate_decode_args(cls, thread_type: Optional[str], width: Optional[int], height: Optional[int]) -> None:
+        if thread_type is not None and thread_type.lower() not in cls.THREAD_TYPES:
+            raise excs.Error(
+                f'Invalid thread_type: {thread_type!r} (must be one of {", ".join(map(repr, cls.THREAD_TYPES))})')
+        for name, val in (('width', width), ('height', height)):
+            if val is not None and val <= 0:
+                raise excs.Error(f'`{name}` must be a positive integer, got {val}')
+
     def __next__(self) -> dict[str, Any]:
         # Determine the frame index in the video corresponding to the iterator index `next_pos`;
         # the frame at this index is the one we want to extract next
@@ -140,12 +217,10 @@ class FrameIterator(ComponentIterator):
 
         # We are searching for the frame at the index implied by `next_pos`. Step through the video until we
         # find it. There are two reasons why it might not be the immediate next frame in the video:
-        # (1) `fps` or `num_frames` was specified as an iterator argument; or
+        # (1) `fps` or `num_frames` was specified as an iterator argument, or set_pos() was called; or
         # (2) we just did a seek, and the desired frame is not a keyframe.
-        # TODO: In case (1) it will usually be fastest to step through the frames until we find the one we're
-        #     looking for. But in some cases it may be faster to do a seek; for example, when `fps` is very
-        #     low and there are multiple keyframes in between each frame we want to extract (imagine extracting
-        #     10 frames from an hourlong video).
+        # In case (1), we seek if that gets us closer to the desired frame.
+        self._seek_if_cheaper(next_video_idx)
         while True:
             try:
                 frame = next(self.container.decode(video=0))
@@ -157,6 +232,7 @@ class FrameIterator(ComponentIterator):
             pts = frame.pts - self.video_start_time
             video_idx = round(pts * self.video_time_base * self.video_framerate)
             assert isinstance(video_idx, int)
+            self.decoded_idx = video_idx
             if video_idx < next_video_idx:
                 # We haven't reached the desired frame yet
                 continue
@@ -164,8 +240,7 @@ class FrameIterator(ComponentIterator):
             # Sanity check that we're at the right frame.
             if video_idx != next_video_idx:
                 raise excs.Error(f'Frame {next_video_idx} is missing from the video (video file is corrupt)')
-            img = frame.to_image()
-            assert isinstance(img, PIL.Image.Image)
+            img = self._convert_frame(frame)
             pos_msec = float(pts * self.video_time_base * 1000)
             result = {
                 'frame_idx': self.next_pos,
@@ -176,18 +251,58 @@ class FrameIterator(ComponentIterator):
             self.next_pos += 1
             return result
 
+    def _convert_frame(self, frame: av.VideoFrame) -> Union[PIL.Image.Image, np.ndarray]:
+        # scaling is done by the same swscale call that converts the frame to RGB
+        kwargs = {} if self.frame_size is None else {'width': self.frame_size[0], 'height': self.frame_size[1]}
+        if self.as_array:
+            return frame.to_ndarray(format='rgb24', **kwargs)
+        img = frame.to_image(**kwargs)
+        assert isinstance(img, PIL.Image.Image)
+        return img
+
     def close(self) -> None:
         self.container.close()
 
     def set_pos(self, pos: int) -> None:
-        if pos == self.next_pos:
-            return  # already there
-
-        video_idx = pos if self.frames_to_extract is None else self.frames_to_extract[pos]
-        _logger.debug(f'seeking to frame number {video_idx} (at iterator index {pos})')
-        # compute the frame position in time_base units
-        seek_pos = int(video_idx / self.video_framerate / self.video_time_base + self.video_start_time)
-        # This will seek to the nearest keyframe before the desired frame. If the frame being sought is not a keyframe,
-        # then the iterator will step forward to the desired frame on the subsequent call to next().
-        self.container.seek(seek_pos, backward=True, stream=self.container.streams.video[0])
+        # the next call to __next__() decides whether to seek or to step forward
         self.next_pos = pos
+
+    def _seek_if_cheaper(self, video_idx: int) -> None:
+        """Seeks to the keyframe preceding video_idx, unless stepping forward to video_idx is cheaper"""
+        if self.decoded_idx < video_idx <= self.decoded_idx + 1 + self.SEEK_COST_FRAMES:
+            # we're close enough: no need to look at the keyframes
+            return
+        self._load_keyframes()
+        assert self.keyframe_idxs is not None and self.keyframe_pts is not None
+        i = bisect.bisect_right(self.keyframe_idxs, video_idx) - 1
+        if i < 0:
+            # no keyframe at or before video_idx (or we don't know the keyframes): seek by timestamp
+            if video_idx > self.decoded_idx:
+                return
+            _logger.debug(f'seeking to frame number {video_idx}')
+            seek_pts = int(video_idx / self.video_framerate / self.video_time_base + self.video_start_time)
+            # this will seek to the nearest keyframe before the desired frame
+            self.container.seek(seek_pts, backward=True, stream=self.container.streams.video[0])
+            self.decoded_idx = -1
+            return
+        keyframe_idx = self.keyframe_idxs[i]
+        if self.decoded_idx < video_idx and keyframe_idx <= self.decoded_idx + 1 + self.SEEK_COST_FRAMES:
+            # seeking wouldn't save us enough decoding
+            return
+        _logger.debug(f'seeking to keyframe {keyframe_idx} for frame number {video_idx}')
+        self.container.seek(self.keyframe_pts[i], backward=True, stream=self.container.streams.video[0])
+        self.decoded_idx = keyframe_idx - 1
+
+    def _load_keyframes(self) -> None:
+        if self.keyframe_idxs is not None:
+            return
+        try:
+            self.keyframe_pts = KeyframeIndex.get().get_keyframes(self.video_path).tolist()
+        except Exception as e:
+            # we can still seek by timestamp
+            _logger.debug(f'failed to get keyframes of {self.video_path}: {e}')
+            self.keyframe_pts = []
+        self.keyframe_idxs = [
+            round((pts - self.video_start_time) * self.video_time_base * self.video_framerate)
+            for pts in self.keyframe_pts
+        ]
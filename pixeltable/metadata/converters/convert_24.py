@@ -0,0 +1,15 @@
+import sqlalchemy as sql
+
+from pixeltable.metadata import register_converter
+from pixeltable.metadata.converters.util import convert_table_md
+
+
+@register_converter(version=24)
+def _(engine: sql.engine.Engine) -> None:
+    convert_table_md(engine, column_md_updater=__update_column_md)
+
+
+def __update_column_md(column_md: dict) -> None:
+    # columns created before version 25 choose the format per image
+    column_md.setdefault('image_format', None)
+    column_md.setdefault('image_quality', None)
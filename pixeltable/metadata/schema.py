@@ -104,6 +104,11 @@ class ColumnMd:
     # if True, the column is present in the stored table
     stored: Optional[bool]
 
+    # file format and encoder quality of the images of a stored computed image column; if not set, the format is
+    # chosen per image (see ImageEncoder.save())
+    image_format: Optional[str] = None
+    image_quality: Optional[int] = None
+
 
 @dataclasses.dataclass
 class IndexMd:
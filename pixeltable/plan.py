@@ -12,6 +12,7 @@ import pixeltable.exec as exec
 from pixeltable import catalog
 from pixeltable import exceptions as excs
 from pixeltable import exprs
+from pixeltable.env import Env
 from pixeltable.exec.sql_node import OrderByItem, OrderByClause, combine_order_by_clauses, print_order_by_clause
 
 
@@ -259,7 +260,7 @@ class Planner:
 
     @classmethod
     def create_insert_plan(
-        cls, tbl: catalog.TableVersion, rows: list[dict[str, Any]], ignore_errors: bool
+        cls, tbl: catalog.TableVersion, rows: Iterable[dict[str, Any]], ignore_errors: bool
     ) -> exec.ExecNode:
         """Creates a plan for TableVersion.insert()"""
         assert not tbl.is_view()
@@ -288,6 +289,7 @@ class Planner:
         stored_col_info = row_builder.output_slot_idxs()
         stored_img_col_info = [info for info in stored_col_info if info.col.col_type.is_image_type()]
         plan.set_stored_img_cols(stored_img_col_info)
+        plan = cls._add_pipeline_stages(plan)
         plan.set_ctx(
             exec.ExecContext(
                 row_builder, batch_size=0, show_pbar=True, num_computed_exprs=len(computed_exprs),
@@ -552,6 +554,7 @@ class Planner:
 
         stored_img_col_info = [info for info in row_builder.output_slot_idxs() if info.col.col_type.is_image_type()]
         plan.set_stored_img_cols(stored_img_col_info)
+        plan = cls._add_pipeline_stages(plan)
         exec_ctx.ignore_errors = True
         plan.set_ctx(exec_ctx)
         return plan, len(row_builder.default_eval_ctx.target_exprs)
@@ -616,6 +619,32 @@ class Planner:
         prefetch_node = exec.CachePrefetchNode(tbl_id, file_col_info, input)
         return prefetch_node
 
+    @classmethod
+    def _add_pipeline_stages(cls, plan: exec.ExecNode) -> exec.ExecNode:
+        """Returns plan with a PipelineNode above each of its nodes, if pipelined execution is enabled.
+
+        Idempotent: nodes that are already separated by a PipelineNode are left alone.
+        """
+        if not Env.get().config.get_bool_value('pipelined_execution'):
+            return plan
+        uses_conn = any(
+            isinstance(e, exprs.FunctionCall) and isinstance(e.fn, pxt.func.QueryTemplateFunction)
+            for e in plan.row_builder.unique_exprs
+        )
+        if uses_conn:
+            # query functions access the connection during evaluation
+            return plan
+        queue_size = Env.get().config.get_int_value('pipeline_queue_size') or exec.PipelineNode.DEFAULT_QUEUE_SIZE
+        node = plan
+        while node.input is not None:
+            if not isinstance(node, exec.PipelineNode) and not isinstance(node.input, exec.PipelineNode):
+                node.input = exec.PipelineNode(node.input, queue_size=queue_size)
+            node = node.input
+        if not isinstance(plan, exec.PipelineNode):
+            # the root gets its own stage, so that it overlaps with the consumer (eg, StoreBase.insert_rows())
+            plan = exec.PipelineNode(plan, queue_size=queue_size)
+        return plan
+
     @classmethod
     def create_query_plan(
             cls, from_clause: FromClause, select_list: Optional[list[exprs.Expr]] = None,
@@ -781,6 +810,7 @@ class Planner:
         if limit is not None:
             plan.set_limit(limit)
 
+        plan = cls._add_pipeline_stages(plan)
         plan.set_ctx(ctx)
         return plan
 
@@ -790,9 +820,13 @@ class Planner:
 
     @classmethod
     def create_add_column_plan(
-            cls, tbl: catalog.TableVersionPath, col: catalog.Column
+            cls, tbl: catalog.TableVersionPath, col: catalog.Column,
+            rowid_ranges: Optional[list[tuple[Optional[int], Optional[int]]]] = None
     ) -> tuple[exec.ExecNode, Optional[int]]:
         """Creates a plan for InsertableTable.add_column()
+        Args:
+            rowid_ranges: if not None, only compute the column for rows whose first rowid column is in one of the
+                [lower, upper) ranges; the rows are produced in rowid order
         Returns:
             plan: the plan to execute
             value_expr slot idx for the plan output (for computed cols)
@@ -805,6 +839,11 @@ class Planner:
         plan.ctx.batch_size = 16
         plan.ctx.show_pbar = True
         plan.ctx.ignore_errors = True
+        if rowid_ranges is not None:
+            scan_node = plan
+            while not isinstance(scan_node, exec.SqlScanNode):
+                scan_node = scan_node.input
+            scan_node.set_rowid_ranges(rowid_ranges)
 
         # we want to flush images
         if col.is_computed and col.is_stored and col.col_type.is_image_type():
@@ -1,15 +1,20 @@
 from __future__ import annotations
 
 import abc
+import concurrent.futures
+import json
 import logging
+import math
+import multiprocessing
 import os
 import sys
 import urllib.parse
 import urllib.request
 import warnings
-from typing import Any, Iterator, Literal, Optional, Union
+from typing import Any, Callable, Iterable, Iterator, Literal, Optional, Sequence, Union
 
 import sqlalchemy as sql
+from sqlalchemy.dialects import postgresql
 from tqdm import TqdmWarning, tqdm
 
 import pixeltable.catalog as catalog
@@ -19,10 +24,13 @@ from pixeltable import exprs
 from pixeltable.exec import ExecNode
 from pixeltable.metadata import schema
 from pixeltable.utils.media_store import MediaStore
-from pixeltable.utils.sql import log_explain, log_stmt
+from pixeltable.utils.sql import in_ranges, log_explain, log_stmt
 
 _logger = logging.getLogger('pixeltable')
 
+# [lower, upper) range of values of the first rowid column; None: unbounded
+RowidRange = tuple[Optional[int], Optional[int]]
+
 
 class StoreBase:
     """Base class for stored tables
@@ -40,7 +48,10 @@ class StoreBase:
     v_max_col: sql.Column
     base: Optional[StoreBase]
 
-    __INSERT_BATCH_SIZE = 1000
+    # number of rowid ranges per worker for backfill_column(): smaller ranges even out differences in cost
+    PARTITIONS_PER_WORKER = 4
+    # backfill_column() records its progress (at least) every this many rows
+    BACKFILL_CHECKPOINT_ROWS = 10_000
 
     def __init__(self, tbl_version: catalog.TableVersion):
         self.tbl_version = tbl_version
@@ -133,29 +144,47 @@ class StoreBase:
         new_file_url = urllib.parse.urljoin('file:', urllib.request.pathname2url(new_path))
         return new_file_url
 
-    def _move_tmp_media_files(
-            self, table_rows: list[dict[str, Any]], media_cols: list[catalog.Column], v_min: int
-    ) -> None:
-        """Move tmp media files that we generated to a permanent location"""
-        for c in media_cols:
-            for table_row in table_rows:
-                file_url = table_row[c.store_name()]
-                table_row[c.store_name()] = self._move_tmp_media_file(file_url, c, v_min)
-
     def _create_table_row(
             self, input_row: exprs.DataRow, row_builder: exprs.RowBuilder, exc_col_ids: set[int], pk: tuple[int, ...]
-    ) -> tuple[dict[str, Any], int]:
+    ) -> tuple[list[Any], int]:
         """Return Tuple[complete table row, # of exceptions] for insert()
         Creates a row that includes the PK columns, with the values from input_row.pk.
+        The values are in the order of row_builder.table_store_columns(), followed by the PK columns.
         Returns:
             Tuple[complete table row, # of exceptions]
         """
         table_row, num_excs = row_builder.create_table_row(input_row, exc_col_ids)
         assert len(pk) == len(self._pk_cols)
-        for pk_col, pk_val in zip(self._pk_cols, pk):
-            table_row[pk_col.name] = pk_val
+        table_row.extend(pk)
         return table_row, num_excs
 
+    @classmethod
+    def _copy_rows(
+            cls, tbl: sql.Table, cols: list[sql.Column], rows: Iterable[Sequence[Any]], conn: sql.engine.Connection
+    ) -> None:
+        """Write rows into cols of tbl with COPY ... FROM STDIN, which is much faster than (multi-row) INSERTs
+
+        The values are converted with the bind processors of the column types (the same conversion sql.insert()
+        applies), and the resulting DBAPI values are then streamed to the server by psycopg.
+        """
+        dialect = conn.dialect
+        preparer = dialect.identifier_preparer
+        processors = [col.type.dialect_impl(dialect).bind_processor(dialect) for col in cols]
+        stmt = (
+            f'COPY {preparer.format_table(tbl)} ({", ".join(preparer.quote(col.name) for col in cols)}) FROM STDIN'
+        )
+        cursor = conn.connection.driver_connection.cursor()
+        try:
+            with cursor.copy(stmt) as copy:
+                for row in rows:
+                    copy.write_row([
+                        None if val is None or isinstance(val, sql.sql.elements.Null)
+                        else val if processor is None else processor(val)
+                        for val, processor in zip(row, processors)
+                    ])
+        finally:
+            cursor.close()
+
     def count(self, conn: Optional[sql.engine.Connection] = None) -> int:
         """Return the number of rows visible in self.tbl_version"""
         stmt = (
@@ -172,11 +201,25 @@ class StoreBase:
         assert isinstance(result, int)
         return result
 
+    def data_version(self, conn: sql.engine.Connection) -> tuple[int, Optional[int]]:
+        """
+        Returns a value that changes whenever rows get inserted, updated or deleted: each of those operations stamps
+        the new table version on the v_min or v_max of the affected rows
+        """
+        stmt = sql.select(
+            sql.func.count(),
+            sql.func.max(sql.func.greatest(
+                self.v_min_col, sql.case((self.v_max_col == schema.Table.MAX_VERSION, 0), else_=self.v_max_col)))
+        ).select_from(self.sa_tbl)
+        num_rows, max_version = conn.execute(stmt).one()
+        return num_rows, max_version
+
     def create(self, conn: sql.engine.Connection) -> None:
         self.sa_md.create_all(bind=conn)
 
     def drop(self, conn: sql.engine.Connection) -> None:
         """Drop store table"""
+        self._drop_backfill_tbls(conn)
         self.sa_md.drop_all(bind=conn)
 
     def add_column(self, col: catalog.Column, conn: sql.engine.Connection) -> None:
@@ -186,6 +229,15 @@ class StoreBase:
         message).
         """
         assert col.is_stored
+        # DDL commits right away, but the column id is only recorded with the table metadata: a crash in between
+        # (eg, while populating a computed column) leaves behind store columns that a later attempt reuses; we drop
+        # those, together with their stale values
+        store_names = [col.store_name()]
+        if col.records_errors:
+            store_names.extend([col.errormsg_store_name(), col.errortype_store_name()])
+        for store_name in store_names:
+            conn.execute(sql.text(f'ALTER TABLE {self._storage_name()} DROP COLUMN IF EXISTS {store_name}'))
+
         col_type_str = col.get_sa_col_type().compile(dialect=conn.dialect)
         stmt = sql.text(f'ALTER TABLE {self._storage_name()} ADD COLUMN {col.store_name()} {col_type_str} NULL')
         log_stmt(_logger, stmt)
@@ -229,78 +281,338 @@ class StoreBase:
             sql.exc.DBAPIError if there was a SQL error during execution
             excs.Error if on_error='abort' and there was an exception during row evaluation
         """
-        num_excs = 0
-        num_rows = 0
-
         # create temp table to store output of exec_plan, with the same primary key as the store table
-        tmp_name = f'temp_{self._storage_name()}'
-        tmp_pk_cols = [sql.Column(col.name, col.type, primary_key=True) for col in self.pk_columns()]
-        tmp_cols = tmp_pk_cols.copy()
-        tmp_val_col = sql.Column(col.sa_col.name, col.sa_col.type)
-        tmp_cols.append(tmp_val_col)
-        # add error columns if the store column records errors
-        if col.records_errors:
-            tmp_errortype_col = sql.Column(col.sa_errortype_col.name, col.sa_errortype_col.type)
-            tmp_cols.append(tmp_errortype_col)
-            tmp_errormsg_col = sql.Column(col.sa_errormsg_col.name, col.sa_errormsg_col.type)
-            tmp_cols.append(tmp_errormsg_col)
-        tmp_tbl = sql.Table(tmp_name, self.sa_md, *tmp_cols, prefixes=['TEMPORARY'])
-        tmp_tbl.create(bind=conn)
-
+        tmp_tbl = self._create_load_tbl(col, f'temp_{self._storage_name()}', conn, prefixes=['TEMPORARY'])
         try:
-            # insert rows from exec_plan into temp table
-            for row_batch in exec_plan:
-                num_rows += len(row_batch)
-                tbl_rows: list[dict[str, Any]] = []
-                for result_row in row_batch:
-                    tbl_row: dict[str, Any] = {}
-                    for pk_col, pk_val in zip(self.pk_columns(), result_row.pk):
-                        tbl_row[pk_col.name] = pk_val
-
-                    if col.is_computed:
-                        if result_row.has_exc(value_expr_slot_idx):
-                            num_excs += 1
-                            value_exc = result_row.get_exc(value_expr_slot_idx)
-                            if on_error == 'abort':
-                                raise excs.Error(
-                                    f'Error while evaluating computed column `{col.name}`:\n{value_exc}'
-                                ) from value_exc
-                            # we store a NULL value and record the exception/exc type
-                            error_type = type(value_exc).__name__
-                            error_msg = str(value_exc)
-                            tbl_row[col.sa_col.name] = None
-                            tbl_row[col.sa_errortype_col.name] = error_type
-                            tbl_row[col.sa_errormsg_col.name] = error_msg
-                        else:
-                            val = result_row.get_stored_val(value_expr_slot_idx, col.sa_col.type)
-                            if col.col_type.is_media_type():
-                                val = self._move_tmp_media_file(val, col, result_row.pk[-1])
-                            tbl_row[col.sa_col.name] = val
-                            if col.records_errors:
-                                tbl_row[col.sa_errortype_col.name] = None
-                                tbl_row[col.sa_errormsg_col.name] = None
-
-                    tbl_rows.append(tbl_row)
-                conn.execute(sql.insert(tmp_tbl), tbl_rows)
-
-            # update store table with values from temp table
-            update_stmt = sql.update(self.sa_tbl)
-            for pk_col, tmp_pk_col in zip(self.pk_columns(), tmp_pk_cols):
-                update_stmt = update_stmt.where(pk_col == tmp_pk_col)
-            update_stmt = update_stmt.values({col.sa_col: tmp_val_col})
-            if col.records_errors:
-                update_stmt = update_stmt.values({
-                    col.sa_errortype_col: tmp_errortype_col,
-                    col.sa_errormsg_col: tmp_errormsg_col
-                })
-            log_explain(_logger, update_stmt, conn)
-            conn.execute(update_stmt)
-
+            _, num_excs = self._load_rows(col, exec_plan, value_expr_slot_idx, tmp_tbl, conn, on_error)
+            self._update_from_load_tbl(col, tmp_tbl, conn)
         finally:
             tmp_tbl.drop(bind=conn)
             self.sa_md.remove(tmp_tbl)
         return num_excs
 
+    def backfill_column(
+        self,
+        col: catalog.Column,
+        create_plan: Callable[[list[RowidRange]], tuple[ExecNode, Optional[int]]],
+        backfill_key: str,
+        backfill_md: dict[str, Any],
+        num_rows: int,
+        num_workers: int,
+        conn: sql.engine.Connection,
+        on_error: Literal['abort', 'ignore']
+    ) -> tuple[int, int]:
+        """Update store column of a computed column in checkpointed chunks, which makes the work resumable
+
+        The computed values are collected in a backfill table, and every BACKFILL_CHECKPOINT_ROWS rows the completed
+        range of rowids gets recorded. If an earlier call with the same backfill_key was interrupted, only the rows
+        outside of the recorded ranges are computed. The backfill tables are identified by backfill_key, and only
+        those of the most recent backfill of a table are retained; backfill_md is attached to them (see
+        get_backfill_md()).
+
+        create_plan(rowid_ranges) returns a plan (and the value expr slot idx) that computes the column for the rows
+        in the given ranges of the first rowid column. With num_workers > 1, the remaining rows are split into ranges
+        of similar size, and each range is evaluated by a forked worker with its own database connection.
+
+        Returns:
+            number of rows with exceptions, number of rows that had already been computed by an earlier call
+        Raises:
+            sql.exc.DBAPIError if there was a SQL error during execution
+            excs.Error if on_error='abort' and there was an exception during row evaluation, or if there was a SQL
+            error in one of the workers
+        """
+        vals_tbl, chunks_tbl = self._open_backfill(col, backfill_key, backfill_md, conn)
+        try:
+            done_chunks = conn.execute(sql.select(
+                chunks_tbl.c.lower, chunks_tbl.c.upper, chunks_tbl.c.num_rows, chunks_tbl.c.num_excs)).all()
+            num_done_rows = sum(chunk.num_rows for chunk in done_chunks)
+            num_excs = sum(chunk.num_excs for chunk in done_chunks)
+            if num_excs > 0 and on_error == 'abort':
+                raise excs.Error(
+                    f'Error while evaluating computed column `{col.name}`:\n'
+                    f'{num_excs} row(s) computed by an earlier, interrupted attempt had errors '
+                    "(use on_error='ignore' to keep them)")
+            if num_done_rows > 0:
+                _logger.info(f'Resuming backfill of column {col.name}: {num_done_rows} rows were already computed')
+            done_ranges = [(chunk.lower, chunk.upper) for chunk in done_chunks]
+            # discard values that were written after the last checkpoint
+            vals_rowid_col = vals_tbl.c[self.rowid_columns()[0].name]
+            conn.execute(sql.delete(vals_tbl).where(sql.not_(in_ranges(vals_rowid_col, done_ranges))))
+            todo_ranges = self._rowid_ranges_complement(done_ranges)
+
+            if len(todo_ranges) > 0 and num_workers > 1:
+                num_excs += self._backfill_parallel(
+                    col, create_plan, vals_tbl, chunks_tbl, todo_ranges, num_workers, conn, on_error)
+            elif len(todo_ranges) > 0:
+                plan, value_expr_slot_idx = create_plan(todo_ranges)
+                plan.ctx.num_rows = num_rows - num_done_rows
+                try:
+                    plan.ctx.set_conn(conn)
+                    plan.open()
+                    _, num_plan_excs = self._load_rows(
+                        col, plan, value_expr_slot_idx, vals_tbl, conn, on_error, chunks_tbl=chunks_tbl)
+                    num_excs += num_plan_excs
+                finally:
+                    plan.close()
+
+            self._update_from_load_tbl(col, vals_tbl, conn)
+            # the backfill tables are retained if we didn't get here
+            vals_tbl.drop(bind=conn)
+            chunks_tbl.drop(bind=conn)
+        finally:
+            self.sa_md.remove(vals_tbl)
+            self.sa_md.remove(chunks_tbl)
+        return num_excs, num_done_rows
+
+    def _backfill_parallel(
+        self,
+        col: catalog.Column,
+        create_plan: Callable[[list[RowidRange]], tuple[ExecNode, Optional[int]]],
+        vals_tbl: sql.Table,
+        chunks_tbl: sql.Table,
+        todo_ranges: list[RowidRange],
+        num_workers: int,
+        conn: sql.engine.Connection,
+        on_error: Literal['abort', 'ignore']
+    ) -> int:
+        """Compute the rows in todo_ranges with num_workers worker processes; returns the number of exceptions"""
+        partitions = self._partition_rowids(num_workers * self.PARTITIONS_PER_WORKER, todo_ranges, conn)
+        # each worker computes the parts of a partition that haven't been done yet
+        tasks: list[tuple[RowidRange, list[RowidRange]]] = []
+        for partition in partitions:
+            subranges = [r for r in (self._intersect_rowid_ranges(partition, r) for r in todo_ranges) if r is not None]
+            if len(subranges) > 0:
+                tasks.append((partition, subranges))
+        num_excs = 0
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(num_workers, len(tasks)), mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_load_worker, initargs=(self, col, create_plan, vals_tbl, chunks_tbl, on_error))
+        try:
+            futures = [executor.submit(_load_partition, partition, subranges) for partition, subranges in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                num_partition_rows, num_partition_excs = future.result()
+                num_excs += num_partition_excs
+                _logger.debug(f'backfill of column {col.name}: loaded partition with {num_partition_rows} rows')
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return num_excs
+
+    def _partition_rowids(
+        self, num_partitions: int, rowid_ranges: list[RowidRange], conn: sql.engine.Connection
+    ) -> list[RowidRange]:
+        """
+        Split the visible rows in rowid_ranges into (at most) num_partitions ranges of the first rowid column with
+        similar numbers of rows; the returned ranges cover all rowids
+        """
+        rowid_col = self.rowid_columns()[0]
+        fractions = [i / num_partitions for i in range(1, num_partitions)]
+        if len(fractions) == 0:
+            return [(None, None)]
+        stmt = (
+            sql.select(sql.func.percentile_disc(postgresql.array(fractions)).within_group(rowid_col))
+            .select_from(self.sa_tbl)
+            .where(self.v_min_col <= self.tbl_version.version)
+            .where(self.v_max_col > self.tbl_version.version)
+            .where(in_ranges(rowid_col, rowid_ranges))
+        )
+        bounds = conn.execute(stmt).scalar_one()
+        # several fractions can map to the same rowid; a range boundary needs to be unique
+        bounds = sorted({b for b in bounds if b is not None}) if bounds is not None else []
+        lower_bounds: list[Optional[int]] = [None, *bounds]
+        upper_bounds: list[Optional[int]] = [*bounds, None]
+        return list(zip(lower_bounds, upper_bounds))
+
+    @classmethod
+    def _intersect_rowid_ranges(cls, r1: RowidRange, r2: RowidRange) -> Optional[RowidRange]:
+        """Returns the intersection of r1 and r2, or None if it's empty"""
+        lower = r1[0] if r2[0] is None else r2[0] if r1[0] is None else max(r1[0], r2[0])
+        upper = r1[1] if r2[1] is None else r2[1] if r1[1] is None else min(r1[1], r2[1])
+        if lower is not None and upper is not None and lower >= upper:
+            return None
+        return lower, upper
+
+    @classmethod
+    def _rowid_ranges_complement(cls, rowid_ranges: list[RowidRange]) -> list[RowidRange]:
+        """Returns the ranges of rowids that aren't covered by rowid_ranges"""
+        result: list[tuple[float, float]] = []
+        # unbounded ends are represented as +/-inf here
+        pos = -math.inf  # everything below pos is covered
+        for lower, upper in sorted(
+            (-math.inf if lower is None else lower, math.inf if upper is None else upper)
+            for lower, upper in rowid_ranges
+        ):
+            if lower > pos:
+                result.append((pos, lower))
+            pos = max(pos, upper)
+        if pos < math.inf:
+            result.append((pos, math.inf))
+        return [
+            (None if lower == -math.inf else int(lower), None if upper == math.inf else int(upper))
+            for lower, upper in result
+        ]
+
+    def _backfill_tbl_prefix(self) -> str:
+        return f'backfill_{self.tbl_version.id.hex}_'
+
+    def _open_backfill(
+        self, col: catalog.Column, backfill_key: str, backfill_md: dict[str, Any], conn: sql.engine.Connection
+    ) -> tuple[sql.Table, sql.Table]:
+        """Create the backfill tables for backfill_key, or return the existing ones
+
+        Returns:
+            the table for the computed values and the table that records the completed rowid ranges
+        """
+        vals_name = f'{self._backfill_tbl_prefix()}{backfill_key[:8]}'
+        chunks_name = f'{vals_name}_chunks'
+        # only the most recent backfill of a table can be resumed
+        self._drop_backfill_tbls(conn, keep={vals_name, chunks_name})
+        # these need to be visible to the connections of the workers, so they can't be TEMPORARY tables
+        vals_tbl = self._create_load_tbl(col, vals_name, conn, comment=json.dumps(backfill_md))
+        # the metadata of the backfill can change (eg, on_error), even if we're resuming it
+        conn.execute(sql.schema.SetTableComment(vals_tbl))
+        rowid_type = self.rowid_columns()[0].type
+        chunks_tbl = sql.Table(
+            chunks_name, self.sa_md,
+            sql.Column('lower', rowid_type, nullable=True),
+            sql.Column('upper', rowid_type, nullable=True),
+            sql.Column('num_rows', sql.BigInteger, nullable=False),
+            sql.Column('num_excs', sql.BigInteger, nullable=False),
+        )
+        chunks_tbl.create(bind=conn, checkfirst=True)
+        return vals_tbl, chunks_tbl
+
+    def _drop_backfill_tbls(self, conn: sql.engine.Connection, keep: Iterable[str] = ()) -> None:
+        prefix = self._backfill_tbl_prefix()
+        for name in sql.inspect(conn).get_table_names():
+            if name.startswith(prefix) and name not in keep:
+                conn.execute(sql.text(f'DROP TABLE IF EXISTS {name}'))
+
+    def get_backfill_md(self, conn: sql.engine.Connection) -> Optional[dict[str, Any]]:
+        """Returns the backfill_md of an interrupted backfill_column(), or None if there is none"""
+        prefix = self._backfill_tbl_prefix()
+        inspector = sql.inspect(conn)
+        for name in inspector.get_table_names():
+            if name.startswith(prefix) and not name.endswith('_chunks'):
+                comment = inspector.get_table_comment(name)['text']
+                if comment is not None:
+                    return json.loads(comment)
+        return None
+
+    def _create_load_tbl(
+        self, col: catalog.Column, name: str, conn: sql.engine.Connection, prefixes: Optional[list[str]] = None,
+        comment: Optional[str] = None
+    ) -> sql.Table:
+        """Create a table for the values of col, with the same primary key as the store table, if it doesn't exist"""
+        tmp_cols = [sql.Column(c.name, c.type, primary_key=True) for c in self.pk_columns()]
+        tmp_cols.append(sql.Column('val', col.sa_col.type))
+        # add error columns if the store column records errors
+        if col.records_errors:
+            tmp_cols.append(sql.Column('errortype', col.sa_errortype_col.type))
+            tmp_cols.append(sql.Column('errormsg', col.sa_errormsg_col.type))
+        tmp_tbl = sql.Table(name, self.sa_md, *tmp_cols, prefixes=prefixes or [], comment=comment)
+        tmp_tbl.create(bind=conn, checkfirst=True)
+        return tmp_tbl
+
+    def _load_rows(
+        self,
+        col: catalog.Column,
+        exec_plan: ExecNode,
+        value_expr_slot_idx: int,
+        tmp_tbl: sql.Table,
+        conn: sql.engine.Connection,
+        on_error: Literal['abort', 'ignore'],
+        chunks_tbl: Optional[sql.Table] = None,
+        rowid_range: RowidRange = (None, None)
+    ) -> tuple[int, int]:
+        """Insert the output of exec_plan into tmp_tbl (created by _create_load_tbl())
+
+        If chunks_tbl is given, exec_plan needs to produce the rows in rowid_range ordered by the first rowid column,
+        and the completed parts of rowid_range get recorded in chunks_tbl every BACKFILL_CHECKPOINT_ROWS rows.
+
+        Returns:
+            number of rows, number of rows with exceptions
+        """
+        num_excs = 0
+        num_rows = 0
+        tmp_cols = list(tmp_tbl.columns)
+        # start of the range that hasn't been recorded yet
+        chunk_lower = rowid_range[0]
+        # rows/exceptions that haven't been recorded yet, and the ones among them with the most recent rowid:
+        # there can be more rows with that rowid in the next batch (eg, in component views)
+        chunk_rows, chunk_excs = 0, 0
+        last_rowid: Optional[int] = None
+        last_rowid_rows, last_rowid_excs = 0, 0
+        for row_batch in exec_plan:
+            num_rows += len(row_batch)
+            tbl_rows: list[list[Any]] = []
+            for result_row in row_batch:
+                tbl_row: list[Any] = list(result_row.pk)
+                is_exc = False
+
+                if col.is_computed:
+                    if result_row.has_exc(value_expr_slot_idx):
+                        is_exc = True
+                        num_excs += 1
+                        value_exc = result_row.get_exc(value_expr_slot_idx)
+                        if on_error == 'abort':
+                            raise excs.Error(
+                                f'Error while evaluating computed column `{col.name}`:\n{value_exc}'
+                            ) from value_exc
+                        # we store a NULL value and record the exception/exc type
+                        error_type = type(value_exc).__name__
+                        error_msg = str(value_exc)
+                        tbl_row.extend([None, error_type, error_msg])
+                    else:
+                        val = result_row.get_stored_val(value_expr_slot_idx, col.sa_col.type)
+                        if col.col_type.is_media_type():
+                            val = self._move_tmp_media_file(val, col, result_row.pk[-1])
+                        tbl_row.append(val)
+                        if col.records_errors:
+                            tbl_row.extend([None, None])
+
+                tbl_rows.append(tbl_row)
+                if result_row.pk[0] != last_rowid:
+                    last_rowid, last_rowid_rows, last_rowid_excs = result_row.pk[0], 0, 0
+                last_rowid_rows += 1
+                last_rowid_excs += is_exc
+                chunk_rows += 1
+                chunk_excs += is_exc
+            self._copy_rows(tmp_tbl, tmp_cols, tbl_rows, conn)
+
+            if chunks_tbl is not None and chunk_rows - last_rowid_rows >= self.BACKFILL_CHECKPOINT_ROWS:
+                # all rows below last_rowid are done
+                self._record_chunk(
+                    chunks_tbl, (chunk_lower, last_rowid), chunk_rows - last_rowid_rows,
+                    chunk_excs - last_rowid_excs, conn)
+                chunk_lower = last_rowid
+                chunk_rows, chunk_excs = last_rowid_rows, last_rowid_excs
+
+        if chunks_tbl is not None:
+            self._record_chunk(chunks_tbl, (chunk_lower, rowid_range[1]), chunk_rows, chunk_excs, conn)
+        return num_rows, num_excs
+
+    @classmethod
+    def _record_chunk(
+        cls, chunks_tbl: sql.Table, rowid_range: RowidRange, num_rows: int, num_excs: int,
+        conn: sql.engine.Connection
+    ) -> None:
+        lower, upper = rowid_range
+        conn.execute(sql.insert(chunks_tbl).values(lower=lower, upper=upper, num_rows=num_rows, num_excs=num_excs))
+
+    def _update_from_load_tbl(self, col: catalog.Column, tmp_tbl: sql.Table, conn: sql.engine.Connection) -> None:
+        """Update the store column(s) of col with the values in tmp_tbl"""
+        update_stmt = sql.update(self.sa_tbl)
+        for pk_col in self.pk_columns():
+            update_stmt = update_stmt.where(pk_col == tmp_tbl.c[pk_col.name])
+        update_stmt = update_stmt.values({col.sa_col: tmp_tbl.c.val})
+        if col.records_errors:
+            update_stmt = update_stmt.values({
+                col.sa_errortype_col: tmp_tbl.c.errortype,
+                col.sa_errormsg_col: tmp_tbl.c.errormsg
+            })
+        log_explain(_logger, update_stmt, conn)
+        conn.execute(update_stmt)
+
     def insert_rows(
             self, exec_plan: ExecNode, conn: sql.engine.Connection, v_min: Optional[int] = None,
             show_progress: bool = True, rowids: Optional[Iterator[int]] = None, abort_on_exc: bool = False
@@ -317,42 +629,46 @@ class StoreBase:
         cols_with_excs: set[int] = set()
         progress_bar: Optional[tqdm] = None  # create this only after we started executing
         row_builder = exec_plan.row_builder
-        media_cols = [info.col for info in row_builder.table_columns if info.col.col_type.is_media_type()]
+        store_cols = row_builder.table_store_columns() + self._pk_cols
+        # positions of media columns in the table rows
+        media_col_idxs: list[tuple[int, catalog.Column]] = []
+        for info in row_builder.table_columns:
+            idx = next(i for i, store_col in enumerate(store_cols) if store_col is info.col.sa_col)
+            if info.col.col_type.is_media_type():
+                media_col_idxs.append((idx, info.col))
         try:
             exec_plan.open()
             for row_batch in exec_plan:
                 num_rows += len(row_batch)
-                for batch_start_idx in range(0, len(row_batch), self.__INSERT_BATCH_SIZE):
-                    # compute batch of rows and convert them into table rows
-                    table_rows: list[dict[str, Any]] = []
-                    batch_stop_idx = min(batch_start_idx + self.__INSERT_BATCH_SIZE, len(row_batch))
-                    for row_idx in range(batch_start_idx, batch_stop_idx):
-                        row = row_batch[row_idx]
-                        # if abort_on_exc == True, we need to check for media validation exceptions
-                        if abort_on_exc and row.has_exc():
-                            exc = row.get_first_exc()
-                            raise exc
-
-                        rowid = (next(rowids),) if rowids is not None else row.pk[:-1]
-                        pk = rowid + (v_min,)
-                        table_row, num_row_exc = self._create_table_row(row, row_builder, cols_with_excs, pk=pk)
-                        num_excs += num_row_exc
-                        table_rows.append(table_row)
-
-                        if show_progress:
-                            if progress_bar is None:
-                                warnings.simplefilter("ignore", category=TqdmWarning)
-                                progress_bar = tqdm(
-                                    desc=f'Inserting rows into `{self.tbl_version.name}`',
-                                    unit=' rows',
-                                    ncols=100,
-                                    file=sys.stdout
-                                )
-                            progress_bar.update(1)
-
-                    # insert batch of rows
-                    self._move_tmp_media_files(table_rows, media_cols, v_min)
-                    conn.execute(sql.insert(self.sa_tbl), table_rows)
+                table_rows: list[list[Any]] = []
+                for row in row_batch:
+                    # if abort_on_exc == True, we need to check for media validation exceptions
+                    if abort_on_exc and row.has_exc():
+                        exc = row.get_first_exc()
+                        raise exc
+
+                    rowid = (next(rowids),) if rowids is not None else row.pk[:-1]
+                    pk = rowid + (v_min,)
+                    table_row, num_row_exc = self._create_table_row(row, row_builder, cols_with_excs, pk=pk)
+                    num_excs += num_row_exc
+                    # move tmp media files that we generated to a permanent location
+                    for idx, col in media_col_idxs:
+                        table_row[idx] = self._move_tmp_media_file(table_row[idx], col, v_min)
+                    table_rows.append(table_row)
+
+                    if show_progress:
+                        if progress_bar is None:
+                            warnings.simplefilter("ignore", category=TqdmWarning)
+                            progress_bar = tqdm(
+                                desc=f'Inserting rows into `{self.tbl_version.name}`',
+                                unit=' rows',
+                                ncols=100,
+                                file=sys.stdout
+                            )
+                        progress_bar.update(1)
+
+                # insert batch of rows
+                self._copy_rows(self.sa_tbl, store_cols, table_rows, conn)
             if progress_bar is not None:
                 progress_bar.close()
             return num_rows, num_excs, cols_with_excs
@@ -477,3 +793,36 @@ class StoreComponentView(StoreView):
         return sql.and_(
             self.base._rowid_join_predicate(),
             *[c1 == c2 for c1, c2 in zip(self.rowid_columns()[:-1], self.base.rowid_columns())])
+
+
+# state of a backfill_column() worker process
+_load_worker_state: Optional[tuple] = None
+
+
+def _init_load_worker(
+    store: StoreBase, col: catalog.Column, create_plan: Callable[[list[RowidRange]], tuple[ExecNode, Optional[int]]],
+    vals_tbl: sql.Table, chunks_tbl: sql.Table, on_error: Literal['abort', 'ignore']
+) -> None:
+    global _load_worker_state
+    _load_worker_state = (store, col, create_plan, vals_tbl, chunks_tbl, on_error)
+
+
+def _load_partition(partition: RowidRange, subranges: list[RowidRange]) -> tuple[int, int]:
+    """Runs in a worker process: computes the rows in subranges of partition and writes them to the backfill table"""
+    assert _load_worker_state is not None
+    store, col, create_plan, vals_tbl, chunks_tbl, on_error = _load_worker_state
+    plan, value_expr_slot_idx = create_plan(subranges)
+    plan.ctx.show_pbar = False
+    try:
+        with env.Env.get().engine.begin() as conn:
+            plan.ctx.set_conn(conn)
+            plan.open()
+            try:
+                return store._load_rows(
+                    col, plan, value_expr_slot_idx, vals_tbl, conn, on_error, chunks_tbl=chunks_tbl,
+                    rowid_range=partition)
+            finally:
+                plan.close()
+    except sql.exc.DBAPIError as exc:
+        # DBAPIErrors don't necessarily survive the trip back to the parent process
+        raise excs.Error(f'SQL error during execution of computed column `{col.name}`:\n{exc}') from None
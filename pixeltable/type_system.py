@@ -743,6 +743,9 @@ class ArrayType(ColumnType):
                 continue
             if n1 != n2:
                 return False
+        if self.dtype == self.Type.INT:
+            # like from_literal(), we accept all integer dtypes (eg, uint8 pixel values)
+            return np.issubdtype(val.dtype, np.integer)
         return val.dtype == self.numpy_dtype()
 
     def _validate_literal(self, val: Any) -> None:
@@ -760,7 +763,13 @@ class ArrayType(ColumnType):
             return np.array(val, dtype=self.numpy_dtype())
         return val
 
+    def is_fixed_shape(self) -> bool:
+        return all(n is not None for n in self.shape)
+
     def to_sa_type(self) -> sql.types.TypeEngine:
+        if self.is_fixed_shape() and self.dtype != self.Type.STRING:
+            # the dtype and shape are known: we only need to store the array data
+            return RawArrayBinary(self.shape, self.numpy_dtype())
         return sql.LargeBinary()
 
     def numpy_dtype(self) -> np.dtype:
@@ -775,6 +784,47 @@ class ArrayType(ColumnType):
         assert False
 
 
+class RawArrayBinary(sql.types.TypeDecorator):
+    """
+    Storage type of fixed-shape numeric arrays: the raw array data, without np.save()'s header, preceded by a
+    RAW_HEADER that keeps the data aligned for any dtype. Reads don't need to parse a header or copy the data: the
+    returned arrays are read-only views of the fetched value; callers that modify them need to copy them first.
+
+    Arrays that don't match the shape of the column, integer arrays that don't match its dtype (eg, uint8 pixel
+    values in an Int column, which keep their dtype), and arrays written by earlier versions of Pixeltable are in
+    np.save() format, which always starts with the magic byte 0x93 (and never with RAW_HEADER). Matching values in
+    that format get converted to the raw format when they get rewritten.
+    """
+    impl = sql.LargeBinary
+    cache_ok = True
+
+    # a format marker, padded to 16 bytes
+    RAW_HEADER = b'\x01' + bytes(15)
+
+    def __init__(self, shape: tuple[int, ...], dtype: np.dtype):
+        super().__init__()
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def process_bind_param(self, value: Optional[Any], dialect: sql.Dialect) -> Optional[bytes]:
+        if value is None or isinstance(value, bytes):
+            return value
+        assert isinstance(value, np.ndarray)
+        if value.shape == self.shape and (value.dtype == self.dtype or not np.issubdtype(self.dtype, np.integer)):
+            # other dtypes are stored as the column's dtype, except that Int columns keep other integer dtypes
+            return self.RAW_HEADER + value.astype(self.dtype, copy=False).tobytes()
+        buffer = io.BytesIO()
+        np.save(buffer, value)
+        return buffer.getvalue()
+
+    def process_result_value(self, value: Optional[bytes], dialect: sql.Dialect) -> Optional[np.ndarray]:
+        if value is None:
+            return None
+        if value[:len(self.RAW_HEADER)] == self.RAW_HEADER:
+            return np.frombuffer(value, dtype=self.dtype, offset=len(self.RAW_HEADER)).reshape(self.shape)
+        return np.load(io.BytesIO(value))
+
+
 class ImageType(ColumnType):
     def __init__(
             self, width: Optional[int] = None, height: Optional[int] = None, size: Optional[tuple[int, int]] = None,
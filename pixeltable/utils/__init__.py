@@ -1,3 +1,7 @@
+import os
+from typing import Any, Callable, Optional
+
+
 def print_perf_counter_delta(delta: float) -> str:
     """Prints a performance counter delta in a human-readable format.
 
@@ -15,3 +19,25 @@ def print_perf_counter_delta(delta: float) -> str:
         return f'{delta * 1e3:.2f} ms'
     else:
         return f'{delta:.2f} s'
+
+
+# objects inherited from the parent process that were replaced after a fork
+_inherited_objs: list[Any] = []
+
+
+def register_fork_reset(reset_fn: Callable[[], Optional[Any]]) -> None:
+    """Registers a function that resets process-wide state in the child process of a fork.
+
+    reset_fn() returns the inherited object it replaced (or None). That object is kept alive in the child: finalizing
+    it (eg, closing its sqlite connection) could interfere with the parent's use of the shared resources.
+    """
+    if not hasattr(os, 'register_at_fork'):
+        # no fork() on Windows
+        return
+
+    def after_in_child() -> None:
+        inherited = reset_fn()
+        if inherited is not None:
+            _inherited_objs.append(inherited)
+
+    os.register_at_fork(after_in_child=after_in_child)
@@ -1,19 +1,28 @@
 from __future__ import annotations
 
-import glob
+import contextlib
 import hashlib
 import logging
 import os
+import sqlite3
+import threading
+import time
 import warnings
-from collections import OrderedDict, defaultdict, namedtuple
+from collections import namedtuple
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, Optional
 from uuid import UUID
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
 import pixeltable.exceptions as excs
 from pixeltable.env import Env
+from pixeltable.utils import register_fork_reset
 
 _logger = logging.getLogger('pixeltable')
 
@@ -39,9 +48,9 @@ class CacheEntry:
         col_id = int(components[1])
         key = components[2]
         file_info = os.stat(str(path))
-        # We use the last modified time (file_info.st_mtime) as the timestamp; `FileCache` will touch the file
-        # each time it is retrieved, so that the mtime of the file will always represent the last used time of
-        # the cache entry.
+        # This is only used for files that aren't recorded in the index. We use the last modified time
+        # (file_info.st_mtime) as the timestamp; `FileCache` also touches the file each time it is retrieved, so that
+        # the mtime of the file reflects the last used time of the cache entry even if the index gets lost.
         last_used = datetime.fromtimestamp(file_info.st_mtime, tz=timezone.utc)
         return cls(key, tbl_id, col_id, file_info.st_size, last_used, path.suffix)
 
@@ -50,17 +59,54 @@ class FileCache:
     """
     A local cache of external (eg, S3) file references in cells of a stored table (ie, table or view).
 
-    Cache entries are identified by a hash of the file url and stored in Env.filecache_dir. The time of last
-    access of a cache entries is its file's mtime.
+    Cache entries are identified by a hash of the file url and stored in Env.filecache_dir. The entries (and their
+    time of last access) are recorded in a SQLite index in the same directory, so that a new session doesn't need to
+    scan the directory: the index is opened on first use, and a background thread then reconciles it with the
+    directory contents (eg, files that were added or removed while the index wasn't being maintained).
+
+    Eviction is governed by the `file_cache_policy` config parameter:
+    - 'lru': evict the least recently used entries
+    - '2q': scan-resistant; new entries are on probation and only move to the hot queue when they are accessed again
+      (or when they get re-added shortly after having been evicted from probation). Probation entries are evicted
+      first, as long as they take up more than PROBATION_FRACTION of the capacity, so that a large scan can't
+      displace the working set.
+    Regardless of the policy, a query can declare itself a one-shot scan (see lookup() and add()): the files it
+    downloads are evicted before anything else, and its cache hits don't count as accesses.
 
-    TODO:
-    - implement MRU eviction for queries that exceed the capacity
+    The cache can be shared by all processes that use the same Pixeltable home directory:
+    - changes to the index (and the accompanying file operations) happen in SQLite write transactions, which
+      serialize them across processes; the total size of the cache is maintained in the index itself
+    - fetch() coordinates downloads: only one process (or thread) downloads a given url, and the others wait for it
+      and then find the file in the cache. This relies on file locks and isn't available on Windows, where
+      processes may end up downloading the same file.
     """
     __instance: Optional[FileCache] = None
 
-    cache: OrderedDict[str, CacheEntry]
-    total_size: int
+    # the leading '.' keeps the index and the download locks out of the cache entries
+    INDEX_FILENAME = '.index.db'
+    LOCK_DIRNAME = '.locks'
+    # max. time we wait for another process to release the index, in seconds
+    BUSY_TIMEOUT = 60
+    # number of entries we look at at a time when evicting
+    EVICTION_BATCH_SIZE = 64
+
+    POLICIES = ('lru', '2q')
+    # values of entries.queue
+    SCAN = 0  # downloaded by a one-shot scan and not accessed since
+    PROBATION = 1  # with 'lru', all other entries are in this queue
+    HOT = 2
+    # 2Q: the share of the capacity that probation entries can occupy before they are preferred for eviction
+    PROBATION_FRACTION = 0.25
+    # 2Q: total size of the entries evicted from probation that we remember, as a fraction of the capacity
+    GHOST_FRACTION = 0.5
+
+    conn: Optional[sqlite3.Connection]  # opened lazily, see _db()
+    lock: threading.RLock
+    txn_depth: int  # nesting level of _transaction()
+    download_locks: list[threading.Lock]  # used in place of file locks if those aren't available
+    reconciler: Optional[threading.Thread]
     capacity_bytes: int
+    policy: str
     num_requests: int
     num_hits: int
     num_evictions: int
@@ -91,12 +137,28 @@ class FileCache:
 
     @classmethod
     def init(cls) -> None:
+        if cls.__instance is not None:
+            cls.__instance.close()
         cls.__instance = cls()
 
+    @classmethod
+    def _reset_after_fork(cls) -> Optional[FileCache]:
+        """Runs in a forked process that accesses the cache: it needs its own connection to the index"""
+        inherited, cls.__instance = cls.__instance, None
+        return inherited
+
     def __init__(self):
-        self.cache = OrderedDict()
-        self.total_size = 0
+        self.conn = None
+        self.lock = threading.RLock()
+        self.txn_depth = 0
+        self.download_locks = [threading.Lock() for _ in range(64)]
+        self.reconciler = None
         self.capacity_bytes = int(Env.get()._file_cache_size_g * (1 << 30))
+        policy = Env.get().config.get_string_value('file_cache_policy')
+        if policy is not None and policy.lower() not in self.POLICIES:
+            _logger.error(f'Invalid file cache policy specified in configuration: {policy}')
+            policy = None
+        self.policy = policy.lower() if policy is not None else 'lru'
         self.num_requests = 0
         self.num_hits = 0
         self.num_evictions = 0
@@ -104,48 +166,202 @@ class FileCache:
         self.keys_evicted_after_retrieval = set()
         self.evicted_working_set_keys = set()
         self.new_redownload_witnessed = False
-        paths = glob.glob(str(Env.get().file_cache_dir / '*'))
-        entries = [CacheEntry.from_file(Path(path_str)) for path_str in paths]
-        # we need to insert entries in access order
-        entries.sort(key=lambda e: e.last_used)
-        for entry in entries:
-            self.cache[entry.key] = entry
-            self.total_size += entry.size
+
+    def _db(self) -> sqlite3.Connection:
+        """Returns the connection to the index, opening it (and starting the reconciliation) on first use"""
+        with self.lock:
+            if self.conn is None:
+                path = Env.get().file_cache_dir / self.INDEX_FILENAME
+                is_new = not path.exists()
+                # we serialize access ourselves: the reconciler runs in a separate thread
+                conn = sqlite3.connect(
+                    str(path), check_same_thread=False, isolation_level=None, timeout=self.BUSY_TIMEOUT)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                # make REPLACE fire the delete trigger that maintains the total size
+                conn.execute('PRAGMA recursive_triggers=ON')
+                # other processes might be initializing the index at the same time
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, tbl_id TEXT NOT NULL, '
+                    'col_id INTEGER NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL, ext TEXT NOT NULL, '
+                    f'queue INTEGER NOT NULL DEFAULT {self.PROBATION})')
+                conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+                conn.execute('CREATE INDEX IF NOT EXISTS entries_queue ON entries (queue, last_used)')
+                conn.execute('CREATE INDEX IF NOT EXISTS entries_tbl_id ON entries (tbl_id)')
+                # 2Q: keys recently evicted from probation
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS ghosts (key TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                    'evicted_at REAL NOT NULL)')
+                conn.execute('CREATE INDEX IF NOT EXISTS ghosts_evicted_at ON ghosts (evicted_at)')
+                # the total size of all entries, shared by all processes
+                conn.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY, size INTEGER NOT NULL)')
+                conn.execute('INSERT OR IGNORE INTO totals SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+                conn.execute(
+                    'CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries '
+                    'BEGIN UPDATE totals SET size = size + NEW.size; END')
+                conn.execute(
+                    'CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries '
+                    'BEGIN UPDATE totals SET size = size - OLD.size; END')
+                conn.execute('COMMIT')
+                (Env.get().file_cache_dir / self.LOCK_DIRNAME).mkdir(exist_ok=True)
+                self.conn = conn
+                if is_new:
+                    # the cache directory might predate the index: populate it before we hand out any entries,
+                    # otherwise we'd re-download everything that's already there
+                    self.reconcile()
+                else:
+                    self.reconciler = threading.Thread(
+                        target=self._run_reconciler, name='pxt-file-cache-reconciler', daemon=True)
+                    self.reconciler.start()
+            return self.conn
+
+    def close(self) -> None:
+        """Waits for a running reconciliation to finish and closes the connection to the index"""
+        if self.reconciler is not None:
+            self.reconciler.join()
+            self.reconciler = None
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Runs the enclosed index changes (and file operations) atomically, with respect to other threads (via
+        self.lock) as well as other processes (via SQLite's write lock). Transactions can be nested.
+        """
+        with self.lock:
+            conn = self._db()
+            if self.txn_depth > 0:
+                self.txn_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self.txn_depth -= 1
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            self.txn_depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+            finally:
+                self.txn_depth = 0
+
+    @property
+    def total_size(self) -> int:
+        with self.lock:
+            return self._db().execute('SELECT size FROM totals').fetchone()[0]
+
+    def _run_reconciler(self) -> None:
+        try:
+            self.reconcile()
+        except Exception as exc:
+            # the index is still usable; entries it is missing simply get downloaded again
+            _logger.warning(f'Failed to reconcile file cache index with {Env.get().file_cache_dir}: {exc}')
+
+    def reconcile(self) -> None:
+        """
+        Bring the index in line with the contents of the cache directory: add entries for files that aren't
+        recorded, and remove entries whose files are gone.
+        """
+        conn = self._db()
+        # scan without holding the lock; the resulting changes are re-validated below
+        file_names = {
+            dir_entry.name for dir_entry in os.scandir(Env.get().file_cache_dir)
+            if dir_entry.is_file() and not dir_entry.name.startswith('.')
+        }
+        with self.lock:
+            indexed = {
+                f'{UUID(tbl_id).hex}_{col_id}_{key}{ext}': key
+                for key, tbl_id, col_id, ext in conn.execute('SELECT key, tbl_id, col_id, ext FROM entries')
+            }
+        new_entries: list[CacheEntry] = []
+        for name in file_names - indexed.keys():
+            try:
+                new_entries.append(CacheEntry.from_file(Env.get().file_cache_dir / name))
+            except (AssertionError, ValueError, FileNotFoundError):
+                # not one of ours, or it disappeared in the meantime
+                continue
+        missing_keys = [indexed[name] for name in indexed.keys() - file_names]
+
+        with self._transaction():
+            num_added, num_removed = 0, 0
+            for entry in new_entries:
+                if not entry.path.exists():
+                    continue
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (entry.key, str(entry.tbl_id), entry.col_id, entry.size, entry.last_used.timestamp(), entry.ext,
+                     self.PROBATION))
+                num_added += cursor.rowcount
+            for key in missing_keys:
+                entry = self._get_entry(key)
+                # the entry might have been re-added after the scan
+                if entry is None or entry.path.exists():
+                    continue
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                num_removed += 1
+            if num_added > 0:
+                # the directory might have grown past the capacity
+                self.ensure_capacity(0)
+        _logger.debug(f'reconciled file cache index: added {num_added} entries, removed {num_removed} entries')
+
+    @classmethod
+    def _entry_from_row(cls, row: tuple) -> CacheEntry:
+        key, tbl_id, col_id, size, last_used, ext = row
+        return CacheEntry(key, UUID(tbl_id), col_id, size, datetime.fromtimestamp(last_used, tz=timezone.utc), ext)
+
+    def _get_entry(self, key: str) -> Optional[CacheEntry]:
+        row = self._db().execute(
+            'SELECT key, tbl_id, col_id, size, last_used, ext FROM entries WHERE key = ?', (key,)).fetchone()
+        return self._entry_from_row(row) if row is not None else None
 
     def avg_file_size(self) -> int:
-        if len(self.cache) == 0:
+        num_files = self.num_files()
+        if num_files == 0:
             return 0
-        return int(self.total_size / len(self.cache))
+        return int(self.total_size / num_files)
 
     def num_files(self, tbl_id: Optional[UUID] = None) -> int:
-        if tbl_id is None:
-            return len(self.cache)
-        return sum(e.tbl_id == tbl_id for e in self.cache.values())
+        with self.lock:
+            if tbl_id is None:
+                return self._db().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            return self._db().execute('SELECT COUNT(*) FROM entries WHERE tbl_id = ?', (str(tbl_id),)).fetchone()[0]
 
     def clear(self, tbl_id: Optional[UUID] = None) -> None:
         """
         For testing purposes: allow resetting capacity and stats.
         """
-        if tbl_id is None:
-            # We need to store the entries to remove in a list, because we can't remove items from a dict while iterating
-            entries_to_remove = list(self.cache.values())
-            _logger.debug(f'clearing {self.num_files()} entries from file cache')
-            self.num_requests, self.num_hits, self.num_evictions = 0, 0, 0
-            self.keys_retrieved.clear()
-            self.keys_evicted_after_retrieval.clear()
-            self.new_redownload_witnessed = False
-        else:
-            entries_to_remove = [e for e in self.cache.values() if e.tbl_id == tbl_id]
-            _logger.debug(f'clearing {self.num_files(tbl_id)} entries from file cache for table {tbl_id}')
-        for entry in entries_to_remove:
-            os.remove(entry.path)
-            del self.cache[entry.key]
-            self.total_size -= entry.size
+        with self._transaction() as conn:
+            if tbl_id is None:
+                rows = conn.execute('SELECT key, tbl_id, col_id, size, last_used, ext FROM entries').fetchall()
+                _logger.debug(f'clearing {len(rows)} entries from file cache')
+                self.num_requests, self.num_hits, self.num_evictions = 0, 0, 0
+                self.keys_retrieved.clear()
+                self.keys_evicted_after_retrieval.clear()
+                self.new_redownload_witnessed = False
+                conn.execute('DELETE FROM ghosts')
+            else:
+                rows = conn.execute(
+                    'SELECT key, tbl_id, col_id, size, last_used, ext FROM entries WHERE tbl_id = ?',
+                    (str(tbl_id),)).fetchall()
+                _logger.debug(f'clearing {len(rows)} entries from file cache for table {tbl_id}')
+            for row in rows:
+                self._entry_from_row(row).path.unlink(missing_ok=True)
+            conn.executemany('DELETE FROM entries WHERE key = ?', [(row[0],) for row in rows])
 
     def emit_eviction_warnings(self) -> None:
         if self.new_redownload_witnessed:
             # Compute the additional capacity that would be needed in order to retain all the re-downloaded files
-            extra_capacity_needed = sum(self.cache[key].size for key in self.evicted_working_set_keys)
+            with self.lock:
+                entries = [self._get_entry(key) for key in self.evicted_working_set_keys]
+            extra_capacity_needed = sum(entry.size for entry in entries if entry is not None)
             suggested_cache_size = self.capacity_bytes + extra_capacity_needed + (1 << 30)
             warnings.warn(
                 f'{len(self.evicted_working_set_keys)} media file(s) had to be downloaded multiple times this session, '
@@ -163,44 +379,126 @@ class FileCache:
         h.update(url.encode())
         return h.hexdigest()
 
-    def lookup(self, url: str) -> Optional[Path]:
-        self.num_requests += 1
-        key = self._url_hash(url)
-        entry = self.cache.get(key, None)
-        if entry is None:
-            _logger.debug(f'file cache miss for {url}')
-            return None
-        # update mtime and cache
-        path = entry.path
-        path.touch(exist_ok=True)
-        file_info = os.stat(str(path))
-        entry.last_used = datetime.fromtimestamp(file_info.st_mtime)
-        self.cache.move_to_end(key, last=True)
-        self.num_hits += 1
-        self.keys_retrieved.add(key)
-        _logger.debug(f'file cache hit for {url}')
+    def lookup(self, url: str, scan: bool = False) -> Optional[Path]:
+        """Returns the path of the cached file for url, or None if it isn't cached.
+
+        Args:
+            scan: if True, the lookup is part of a one-shot scan and doesn't count as an access of the entry
+        """
+        with self.lock:
+            self.num_requests += 1
+            path = self._lookup(self._url_hash(url), scan)
+        _logger.debug(f'file cache {"hit" if path is not None else "miss"} for {url}')
         return path
 
-    def add(self, tbl_id: UUID, col_id: int, url: str, path: Path) -> Path:
+    def _lookup(self, key: str, scan: bool) -> Optional[Path]:
+        """lookup() without counting the request"""
+        # another process might evict the entry concurrently: we read and update it in the same transaction
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT key, tbl_id, col_id, size, last_used, ext, queue FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            entry = self._entry_from_row(row[:-1])
+            try:
+                if scan:
+                    # scans don't count as an access of the entry
+                    entry.path.stat()
+                else:
+                    # unlike touch(), this doesn't create a file that has gone missing
+                    os.utime(entry.path)
+            except FileNotFoundError:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            if not scan:
+                queue = row[-1]
+                if queue == self.SCAN:
+                    # someone other than the scan is interested in this
+                    queue = self.PROBATION
+                elif queue == self.PROBATION and self.policy == '2q':
+                    queue = self.HOT
+                conn.execute('UPDATE entries SET last_used = ?, queue = ? WHERE key = ?', (time.time(), queue, key))
+            self.num_hits += 1
+            self.keys_retrieved.add(key)
+        return entry.path
+
+    def fetch(self, tbl_id: UUID, col_id: int, url: str, download: Callable[[], Path], scan: bool = False) -> Path:
+        """
+        Brings url into the cache after a cache miss and returns the path of the cached file.
+
+        download() fetches the file and returns its (temporary) path. It is only called if no other process or
+        thread is already fetching url; otherwise we wait for that to finish and return its result.
+        """
+        key = self._url_hash(url)
+        with self._download_lock(key):
+            # someone else might have fetched it while we were waiting
+            path = self._lookup(key, scan)
+            if path is not None:
+                _logger.debug(f'file cache: {url} was fetched concurrently')
+                return path
+            return self.add(tbl_id, col_id, url, download(), scan=scan)
+
+    @contextlib.contextmanager
+    def _download_lock(self, key: str) -> Iterator[None]:
+        """Exclusive lock on fetching the file for key, across threads and processes"""
+        if fcntl is None:
+            # without file locks, we can only coordinate the threads of this process
+            with self.download_locks[int(key[:8], 16) % len(self.download_locks)]:
+                yield
+            return
+
+        self._db()  # make sure the lock directory exists
+        lock_path = Env.get().file_cache_dir / self.LOCK_DIRNAME / f'{key}.lock'
+        while True:
+            fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # the previous holder removes the lock file when it's done; if that happened while we were waiting,
+                # we're holding a lock on a file that nobody else sees
+                if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+        try:
+            yield
+        finally:
+            lock_path.unlink(missing_ok=True)
+            os.close(fd)  # this releases the lock
+
+    def add(self, tbl_id: UUID, col_id: int, url: str, path: Path, scan: bool = False) -> Path:
         """Adds url at 'path' to cache and returns its new path.
         'path' will not be accessible after this call. Retains the extension of 'path'.
+        If scan is True, the file was downloaded by a one-shot scan and is evicted ahead of all other entries.
         """
         file_info = os.stat(str(path))
-        self.ensure_capacity(file_info.st_size)
         key = self._url_hash(url)
-        assert key not in self.cache
-        if key in self.keys_evicted_after_retrieval:
-            # This key was evicted after being retrieved earlier this session, and is now being retrieved again.
-            # Add it to `keys_multiply_downloaded` so that we may generate a warning later.
-            self.evicted_working_set_keys.add(key)
-            self.new_redownload_witnessed = True
-        self.keys_retrieved.add(key)
-        entry = CacheEntry(key, tbl_id, col_id, file_info.st_size, datetime.fromtimestamp(file_info.st_mtime), path.suffix)
-        self.cache[key] = entry
-        self.total_size += entry.size
-        new_path = entry.path
-        os.rename(str(path), str(new_path))
-        new_path.touch(exist_ok=True)
+        with self._transaction() as conn:
+            # an existing entry for key (eg, one that another process added in the meantime) gets replaced
+            self.ensure_capacity(file_info.st_size)
+            queue = self.SCAN if scan else self.PROBATION
+            if self.policy == '2q':
+                cursor = conn.execute('DELETE FROM ghosts WHERE key = ?', (key,))
+                if cursor.rowcount > 0 and not scan:
+                    # we evicted this from probation recently: it's part of the working set after all
+                    queue = self.HOT
+            if key in self.keys_evicted_after_retrieval:
+                # This key was evicted after being retrieved earlier this session, and is now being retrieved again.
+                # Add it to `keys_multiply_downloaded` so that we may generate a warning later.
+                self.evicted_working_set_keys.add(key)
+                self.new_redownload_witnessed = True
+            self.keys_retrieved.add(key)
+            entry = CacheEntry(
+                key, tbl_id, col_id, file_info.st_size, datetime.now(tz=timezone.utc), path.suffix)
+            new_path = entry.path
+            os.rename(str(path), str(new_path))
+            new_path.touch(exist_ok=True)
+            conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, str(tbl_id), col_id, entry.size, entry.last_used.timestamp(), entry.ext, queue))
         _logger.debug(f'added entry for cell {url} to file cache')
         return new_path
 
@@ -208,16 +506,79 @@ class FileCache:
         """
         Evict entries from the cache until there is at least 'size' bytes of free space.
         """
-        while len(self.cache) > 0 and self.total_size + size > self.capacity_bytes:
-            _, lru_entry = self.cache.popitem(last=False)
-            self.total_size -= lru_entry.size
-            self.num_evictions += 1
-            if lru_entry.key in self.keys_retrieved:
-                # This key was retrieved at some point earlier this session and is now being evicted.
-                # Make a record of the eviction, so that we can generate a warning later if the key is retrieved again.
-                self.keys_evicted_after_retrieval.add(lru_entry.key)
-            os.remove(str(lru_entry.path))
-            _logger.debug(f'evicted entry for cell {lru_entry.key} from file cache (of size {lru_entry.size // (1 << 20)} MiB)')
+        with self._transaction() as conn:
+            total_size = self.total_size
+            while total_size + size > self.capacity_bytes:
+                rows = self._eviction_candidates(conn)
+                if len(rows) == 0:
+                    break
+                evicted_keys: list[str] = []
+                ghosts: list[tuple[str, int, float]] = []
+                for row in rows:
+                    if total_size + size <= self.capacity_bytes:
+                        break
+                    lru_entry = self._entry_from_row(row[:-1])
+                    total_size -= lru_entry.size
+                    self.num_evictions += 1
+                    if lru_entry.key in self.keys_retrieved:
+                        # This key was retrieved at some point earlier this session and is now being evicted.
+                        # Make a record of the eviction, so that we can generate a warning later if the key is
+                        # retrieved again.
+                        self.keys_evicted_after_retrieval.add(lru_entry.key)
+                    if self.policy == '2q' and row[-1] == self.PROBATION:
+                        ghosts.append((lru_entry.key, lru_entry.size, time.time()))
+                    lru_entry.path.unlink(missing_ok=True)
+                    evicted_keys.append(lru_entry.key)
+                    _logger.debug(
+                        f'evicted entry for cell {lru_entry.key} from file cache '
+                        f'(of size {lru_entry.size // (1 << 20)} MiB)')
+                conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in evicted_keys])
+                if len(ghosts) > 0:
+                    conn.executemany('INSERT OR REPLACE INTO ghosts VALUES (?, ?, ?)', ghosts)
+                    self._trim_ghosts(conn)
+
+    def _eviction_candidates(self, conn: sqlite3.Connection) -> list[tuple]:
+        """Returns the next entries to evict (with their queue), in eviction order"""
+        select = 'SELECT key, tbl_id, col_id, size, last_used, ext, queue FROM entries'
+        # the leftovers of one-shot scans go first
+        rows = conn.execute(
+            f'{select} WHERE queue = ? ORDER BY last_used LIMIT ?', (self.SCAN, self.EVICTION_BATCH_SIZE)).fetchall()
+        if len(rows) > 0 or self.policy == 'lru':
+            return rows if len(rows) > 0 else conn.execute(
+                f'{select} ORDER BY last_used LIMIT ?', (self.EVICTION_BATCH_SIZE,)).fetchall()
+
+        probation_size = conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries WHERE queue = ?', (self.PROBATION,)).fetchone()[0]
+        queues = [self.PROBATION, self.HOT]
+        if probation_size <= self.PROBATION_FRACTION * self.capacity_bytes:
+            # probation is small enough: the hot queue yields
+            queues.reverse()
+        for queue in queues:
+            rows = conn.execute(
+                f'{select} WHERE queue = ? ORDER BY last_used LIMIT ?', (queue, self.EVICTION_BATCH_SIZE)).fetchall()
+            if len(rows) > 0:
+                return rows
+        return []
+
+    def _trim_ghosts(self, conn: sqlite3.Connection) -> None:
+        """Forget the oldest evicted keys beyond GHOST_FRACTION of the capacity"""
+        excess = conn.execute('SELECT COALESCE(SUM(size), 0) FROM ghosts').fetchone()[0] \
+            - self.GHOST_FRACTION * self.capacity_bytes
+        if excess <= 0:
+            return
+        forgotten_keys: list[str] = []
+        for key, size in conn.execute('SELECT key, size FROM ghosts ORDER BY evicted_at'):
+            if excess <= 0:
+                break
+            forgotten_keys.append(key)
+            excess -= size
+        conn.executemany('DELETE FROM ghosts WHERE key = ?', [(key,) for key in forgotten_keys])
+
+    def set_policy(self, policy: str) -> None:
+        if policy not in self.POLICIES:
+            raise excs.Error(f'Invalid file cache policy: {policy!r} (must be one of {", ".join(self.POLICIES)})')
+        self.policy = policy
+        self.ensure_capacity(0)
 
     def set_capacity(self, capacity_bytes: int) -> None:
         self.capacity_bytes = capacity_bytes
@@ -225,18 +586,20 @@ class FileCache:
 
     def stats(self) -> FileCacheStats:
         # collect column stats
-        # (tbl_id, col_id) -> (num_files, total_size)
-        d: dict[tuple[UUID, int], list[int]] = defaultdict(lambda: [0, 0])
-        for entry in self.cache.values():
-            t = d[(entry.tbl_id, entry.col_id)]
-            t[0] += 1
-            t[1] += entry.size
+        with self.lock:
+            rows = self._db().execute(
+                'SELECT tbl_id, col_id, COUNT(*), SUM(size) FROM entries GROUP BY tbl_id, col_id').fetchall()
         col_stats = [
-            self.FileCacheColumnStats(tbl_id, col_id, num_files, size) for (tbl_id, col_id), (num_files, size) in d.items()
+            self.FileCacheColumnStats(UUID(tbl_id), col_id, num_files, size) for tbl_id, col_id, num_files, size in rows
         ]
         col_stats.sort(key=lambda e: e[3], reverse=True)
         return self.FileCacheStats(self.total_size, self.num_requests, self.num_hits, self.num_evictions, col_stats)
 
     def debug_print(self) -> None:
-        for entry in self.cache.values():
-            print(f'CacheEntry: tbl_id={entry.tbl_id}, col_id={entry.col_id}, size={entry.size}')
+        with self.lock:
+            rows = self._db().execute('SELECT tbl_id, col_id, size FROM entries ORDER BY last_used').fetchall()
+        for tbl_id, col_id, size in rows:
+            print(f'CacheEntry: tbl_id={tbl_id}, col_id={col_id}, size={size}')
+
+
+register_fork_reset(FileCache._reset_after_fork)
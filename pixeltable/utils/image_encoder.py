@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Optional
+
+import PIL.Image
+
+from pixeltable.env import Env
+from pixeltable.utils import register_fork_reset
+
+_logger = logging.getLogger('pixeltable')
+
+
+class ImageEncoder:
+    """
+    A bounded pool of threads that encode computed images and write them to the media store.
+
+    Pillow releases the GIL while encoding, so images get written in parallel while the evaluating thread moves on to
+    the next batch of rows. The number of images that are waiting to be encoded is bounded: submit() blocks when that
+    limit is reached, which also bounds the memory held by pending images.
+
+    The number of threads is determined by the `image_encoder_threads` config parameter; if that is 0, images are
+    encoded synchronously by the caller (see get()).
+    """
+    __instance: Optional[ImageEncoder] = None
+    __lock = threading.Lock()
+
+    FORMATS = ('jpeg', 'png', 'webp')
+    # formats that accept a quality setting
+    LOSSY_FORMATS = ('jpeg', 'webp')
+    # image modes that can be written as JPEG
+    JPEG_MODES = ('1', 'L', 'RGB', 'CMYK')
+    # max. number of pending images per thread
+    MAX_PENDING_PER_THREAD = 4
+
+    executor: concurrent.futures.ThreadPoolExecutor
+    max_workers: int
+    pending: threading.BoundedSemaphore
+
+    @classmethod
+    def get(cls) -> Optional[ImageEncoder]:
+        """Returns the shared encoder, or None if images should be encoded synchronously"""
+        with cls.__lock:
+            if cls.__instance is None:
+                num_threads = Env.get().config.get_int_value('image_encoder_threads')
+                if num_threads is None:
+                    num_threads = min(8, os.cpu_count() or 1)
+                if num_threads <= 0:
+                    return None
+                cls.__instance = cls(num_threads)
+            return cls.__instance
+
+    @classmethod
+    def _reset_after_fork(cls) -> None:
+        """Runs in a forked process: the threads of the inherited executor don't exist there"""
+        cls.__instance = None
+        cls.__lock = threading.Lock()
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='pxt-img-encoder')
+        self.pending = threading.BoundedSemaphore(max_workers * self.MAX_PENDING_PER_THREAD)
+
+    def submit(
+            self, image: PIL.Image.Image, filepath: str, format: Optional[str] = None, quality: Optional[int] = None
+    ) -> concurrent.futures.Future:
+        """Schedules save(image, filepath, format, quality); blocks while too many images are pending"""
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self.save, image, filepath, format, quality)
+        except BaseException:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda _: self.pending.release())
+        return future
+
+    @classmethod
+    def save(
+            cls, image: PIL.Image.Image, filepath: str, format: Optional[str] = None, quality: Optional[int] = None
+    ) -> None:
+        """Writes image to filepath in the given format (jpeg, png or webp)
+
+        If no format is given, JPEG is used, unless the image has a transparency layer (which isn't supported by JPEG),
+        in which case we use WebP.
+        """
+        if format is None:
+            format = 'webp' if image.has_transparency_data else 'jpeg'
+        elif format == 'jpeg' and image.mode not in cls.JPEG_MODES:
+            # JPEG was requested explicitly: drop the alpha channel/palette
+            image = image.convert('RGB')
+        kwargs = {'quality': quality} if quality is not None else {}
+        image.save(filepath, format=format, **kwargs)
+
+
+register_fork_reset(ImageEncoder._reset_after_fork)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+import av  # type: ignore[import-untyped]
+import numpy as np
+
+from pixeltable.env import Env
+from pixeltable.utils import register_fork_reset
+
+_logger = logging.getLogger('pixeltable')
+
+
+class KeyframeIndex:
+    """
+    A persistent index of the keyframes of video files.
+
+    FrameIterator uses it to seek directly to the keyframe that precedes a frame, instead of decoding all the frames
+    in between. The keyframes of a video are found by demuxing it (which doesn't require decoding any frames), once per
+    file: the result is stored in a SQLite database in the Pixeltable home directory, keyed by the path of the file,
+    and is invalidated when the size or modification time of the file change.
+    """
+    __instance: Optional[KeyframeIndex] = None
+
+    FILENAME = 'keyframe_index.db'
+
+    path: Path
+    conn: sqlite3.Connection
+    lock: threading.Lock
+
+    @classmethod
+    def get(cls) -> KeyframeIndex:
+        if cls.__instance is None:
+            cls.init()
+        return cls.__instance
+
+    @classmethod
+    def init(cls) -> None:
+        cls.__instance = cls()
+
+    @classmethod
+    def _reset_after_fork(cls) -> Optional[KeyframeIndex]:
+        """Runs in a forked process that iterates over videos: it needs its own connection to the index"""
+        inherited, cls.__instance = cls.__instance, None
+        return inherited
+
+    def __init__(self):
+        self.path = Env.get().home / self.FILENAME
+        # we serialize access ourselves: iterators can run in multiple threads
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS keyframes '
+            '(path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, pts BLOB NOT NULL)')
+        self.lock = threading.Lock()
+
+    def get_keyframes(self, video_path: Path) -> np.ndarray:
+        """Returns the sorted presentation timestamps of the keyframes of the first video stream of video_path"""
+        key = str(video_path.absolute())
+        stat = video_path.stat()
+        with self.lock:
+            row = self.conn.execute('SELECT size, mtime_ns, pts FROM keyframes WHERE path = ?', (key,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return np.frombuffer(row[2], dtype=np.int64)
+
+        pts = self._scan(video_path)
+        _logger.debug(f'found {len(pts)} keyframes in {video_path}')
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO keyframes VALUES (?, ?, ?, ?)',
+                (key, stat.st_size, stat.st_mtime_ns, pts.tobytes()))
+        return pts
+
+    @classmethod
+    def _scan(cls, video_path: Path) -> np.ndarray:
+        with av.open(str(video_path)) as container:
+            stream = container.streams.video[0]
+            pts = [packet.pts for packet in container.demux(stream) if packet.is_keyframe and packet.pts is not None]
+        return np.unique(np.array(pts, dtype=np.int64))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute('DELETE FROM keyframes')
+
+
+register_fork_reset(KeyframeIndex._reset_after_fork)
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional, Sequence
+
+import numpy as np
+import PIL.Image
+
+import pixeltable.type_system as ts
+from pixeltable.env import Env
+from pixeltable.utils import register_fork_reset
+
+if TYPE_CHECKING:
+    from pixeltable.func import CallableFunction
+
+_logger = logging.getLogger('pixeltable')
+
+
+class ResultCache:
+    """
+    A persistent cache of the results of calls to deterministic UDFs (those created with `is_deterministic=True`).
+
+    Entries are keyed by a hash of the function identity (its path or name and its source code), the argument values
+    (for media files: their path, size and modification time; calls with remote media files aren't cached) and the
+    constant kwargs, and they are stored in a SQLite database in the Pixeltable home directory, so that they
+    survive across sessions. The total size of the pickled results is bounded by the `udf_cache_size_g` config
+    parameter; when that is exceeded, the least recently used entries get evicted.
+    """
+    __instance: Optional[ResultCache] = None
+
+    DEFAULT_CAPACITY_G = 1.0
+    FILENAME = 'result_cache.db'
+
+    # returned by lookup() for cache misses (None is a valid cached result)
+    MISS = object()
+
+    ResultCacheStats = namedtuple('ResultCacheStats', ('num_entries', 'total_size', 'num_requests', 'num_hits'))
+
+    path: Path
+    conn: sqlite3.Connection
+    lock: threading.Lock
+    capacity_bytes: int
+    total_size: int
+    num_requests: int
+    num_hits: int
+
+    @classmethod
+    def get(cls) -> ResultCache:
+        if cls.__instance is None:
+            cls.init()
+        return cls.__instance
+
+    @classmethod
+    def init(cls) -> None:
+        cls.__instance = cls()
+
+    @classmethod
+    def _reset_after_fork(cls) -> Optional[ResultCache]:
+        """Runs in a forked process that evaluates UDFs: it needs its own connection to the cache database"""
+        inherited, cls.__instance = cls.__instance, None
+        return inherited
+
+    def __init__(self):
+        self.path = Env.get().home / self.FILENAME
+        # we serialize access ourselves: calls to concurrent UDFs look up results from multiple threads
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS results '
+            '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.lock = threading.Lock()
+        capacity_g = Env.get().config.get_float_value('udf_cache_size_g')
+        self.capacity_bytes = int((capacity_g if capacity_g is not None else self.DEFAULT_CAPACITY_G) * (1 << 30))
+        self.total_size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        self.num_requests = 0
+        self.num_hits = 0
+
+    def set_capacity(self, capacity_bytes: int) -> None:
+        with self.lock:
+            self.capacity_bytes = capacity_bytes
+            self._evict()
+
+    def make_key(self, fn: CallableFunction, args: Sequence[Any], kwargs: dict[str, Any]) -> Optional[str]:
+        """Returns the cache key for the call fn(*args, **kwargs), or None if the arguments can't be hashed"""
+        h = hashlib.sha256()
+        h.update(self._fn_version(fn).encode())
+        params = fn.signature.parameters_by_pos
+        try:
+            for i, arg in enumerate(args):
+                self._hash_arg(arg, params[i].col_type if i < len(params) else None, h)
+            for name in sorted(kwargs.keys()):
+                h.update(b'K' + name.encode())
+                param = fn.signature.parameters.get(name)
+                self._hash_arg(kwargs[name], param.col_type if param is not None else None, h)
+        except TypeError:
+            return None
+        return h.hexdigest()
+
+    def _fn_version(self, fn: CallableFunction) -> str:
+        """Identifies fn, including its implementation: changing the code of a function invalidates its results"""
+        # the version is stored on fn itself: a redefined function is a new object and gets its own version
+        version = fn.result_cache_version
+        if version is None:
+            try:
+                code = inspect.getsource(fn.py_fn)
+            except (OSError, TypeError):
+                code = repr(fn.py_fn.__code__.co_code) if hasattr(fn.py_fn, '__code__') else repr(fn.py_fn)
+            identity = fn.self_path if fn.self_path is not None else fn.name
+            version = hashlib.sha256(f'{identity}\n{code}'.encode()).hexdigest()
+            fn.result_cache_version = version
+        return version
+
+    @classmethod
+    def _hash_arg(cls, val: Any, col_type: Optional[ts.ColumnType], h: Any) -> None:
+        if isinstance(val, str) and col_type is not None and col_type.is_media_type():
+            cls._hash_media_file(val, h)
+        else:
+            cls._hash_value(val, h)
+
+    @classmethod
+    def _hash_media_file(cls, val: str, h: Any) -> None:
+        """
+        Media arguments are file paths or URLs, whose contents can change: local files are identified by their size and
+        modification time as well; remote files raise TypeError, ie, those calls don't get cached
+        """
+        parsed = urllib.parse.urlparse(val)
+        if len(parsed.scheme) > 1 and parsed.scheme != 'file':
+            raise TypeError(f'cannot hash remote file {val}')
+        path = urllib.parse.unquote(urllib.request.url2pathname(parsed.path))
+        try:
+            stat = os.stat(path)
+        except OSError as exc:
+            raise TypeError(f'cannot hash {path}: {exc}') from exc
+        h.update(f'M{len(path)}:{path}{stat.st_size}:{stat.st_mtime_ns}'.encode())
+
+    @classmethod
+    def _hash_value(cls, val: Any, h: Any) -> None:
+        """Feeds a canonical representation of val into h; raises TypeError for values we can't hash"""
+        if val is None:
+            h.update(b'N')
+        elif isinstance(val, bool):
+            h.update(b'B1' if val else b'B0')
+        elif isinstance(val, (int, float, str)):
+            h.update(f'{type(val).__name__[0]}{len(str(val))}:{val}'.encode())
+        elif isinstance(val, np.generic):
+            cls._hash_value(val.item(), h)
+        elif isinstance(val, (datetime.datetime, datetime.date)):
+            h.update(f'T{val.isoformat()}'.encode())
+        elif isinstance(val, (list, tuple)):
+            h.update(f'L{len(val)}'.encode())
+            for v in val:
+                cls._hash_value(v, h)
+        elif isinstance(val, dict):
+            h.update(f'D{len(val)}'.encode())
+            for k in sorted(val.keys(), key=str):
+                cls._hash_value(str(k), h)
+                cls._hash_value(val[k], h)
+        elif isinstance(val, np.ndarray):
+            if val.dtype == np.object_:
+                raise TypeError('object arrays are not hashable')
+            h.update(f'A{val.dtype.str}{val.shape}'.encode())
+            h.update(np.ascontiguousarray(val).data)
+        elif isinstance(val, PIL.Image.Image):
+            h.update(f'I{val.mode}{val.size}'.encode())
+            h.update(val.tobytes())
+            if val.mode == 'P':
+                h.update(bytes(val.getpalette() or []))
+        else:
+            raise TypeError(f'cannot hash {type(val)}')
+
+    def lookup(self, key: str) -> Any:
+        """Returns the cached result for key, or MISS"""
+        with self.lock:
+            self.num_requests += 1
+            row = self.conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return self.MISS
+            self.num_hits += 1
+            self.conn.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def lookup_batch(self, keys: Sequence[Optional[str]]) -> list[Any]:
+        """Returns the cached results for keys (MISS for missing entries and None keys)"""
+        results: list[Any] = [self.MISS] * len(keys)
+        valid_keys = list({k for k in keys if k is not None})
+        if len(valid_keys) == 0:
+            return results
+        vals: dict[str, bytes] = {}
+        with self.lock:
+            self.num_requests += len(keys)
+            # stay below SQLite's limit on the number of host parameters
+            for i in range(0, len(valid_keys), 500):
+                chunk = valid_keys[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                vals.update(self.conn.execute(
+                    f'SELECT key, value FROM results WHERE key IN ({placeholders})', chunk).fetchall())
+                self.conn.execute(
+                    f'UPDATE results SET last_used = ? WHERE key IN ({placeholders})', [time.time(), *chunk])
+            self.num_hits += sum(1 for k in keys if k in vals)
+        for i, key in enumerate(keys):
+            if key in vals:
+                results[i] = pickle.loads(vals[key])
+        return results
+
+    def put(self, key: str, val: Any) -> None:
+        self.put_batch([key], [val])
+
+    def put_batch(self, keys: Sequence[Optional[str]], vals: Sequence[Any]) -> None:
+        entries: list[tuple[str, bytes, int, float]] = []
+        now = time.time()
+        for key, val in zip(keys, vals):
+            if key is None:
+                continue
+            try:
+                data = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                # not all results can be pickled; those simply don't get cached
+                continue
+            if len(data) > self.capacity_bytes:
+                continue
+            entries.append((key, data, len(data), now))
+        if len(entries) == 0:
+            return
+        with self.lock:
+            # replace existing entries for the same key; adjust total_size accordingly
+            for key, _, size, _ in entries:
+                row = self.conn.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self.total_size -= row[0]
+            self.conn.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', entries)
+            self.total_size += sum(size for _, _, size, _ in entries)
+            self._evict()
+
+    def _evict(self) -> None:
+        """Evict least recently used entries until we're within capacity; requires self.lock"""
+        # other processes share the cache: our running total doesn't reflect their changes
+        self.total_size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if self.total_size <= self.capacity_bytes:
+            return
+        cursor = self.conn.execute('SELECT key, size FROM results ORDER BY last_used')
+        evicted_keys: list[str] = []
+        excess = self.total_size - self.capacity_bytes
+        for key, size in cursor:
+            if excess <= 0:
+                break
+            evicted_keys.append(key)
+            excess -= size
+            self.total_size -= size
+        self.conn.executemany('DELETE FROM results WHERE key = ?', [(k,) for k in evicted_keys])
+        _logger.debug(f'evicted {len(evicted_keys)} entries from the UDF result cache')
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute('DELETE FROM results')
+            self.total_size = 0
+            self.num_requests, self.num_hits = 0, 0
+
+    def stats(self) -> ResultCacheStats:
+        with self.lock:
+            num_entries = self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            return self.ResultCacheStats(num_entries, self.total_size, self.num_requests, self.num_hits)
+
+
+register_fork_reset(ResultCache._reset_after_fork)
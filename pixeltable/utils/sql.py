@@ -1,4 +1,5 @@
 import logging
+from typing import Optional, Sequence
 
 import sqlalchemy as sql
 from sqlalchemy.dialects import postgresql
@@ -16,3 +17,16 @@ def log_explain(logger: logging.Logger, stmt: sql.sql.ClauseElement, conn: sql.e
         logger.debug(f'SqlScanNode explain:\n{explain_str}')
     except Exception as e:
         logger.warning(f'EXPLAIN failed')
+
+
+def in_ranges(col: sql.ColumnElement, ranges: Sequence[tuple[Optional[int], Optional[int]]]) -> sql.ColumnElement[bool]:
+    """Returns a predicate that is true if col is in any of the [lower, upper) ranges (None: unbounded)"""
+    clauses: list[sql.ColumnElement[bool]] = []
+    for lower, upper in ranges:
+        bounds: list[sql.ColumnElement[bool]] = []
+        if lower is not None:
+            bounds.append(col >= lower)
+        if upper is not None:
+            bounds.append(col < upper)
+        clauses.append(sql.and_(sql.true(), *bounds))
+    return sql.or_(sql.false(), *clauses)
@@ -271,6 +271,46 @@ class TestDataFrame:
             _ = res['c2', 0]
         assert 'Bad index' in str(exc_info.value)
 
+    def test_iter_batches(self, test_tbl: catalog.Table, monkeypatch) -> None:
+        t = test_tbl
+        # record the batches produced by the SqlNode
+        sql_batch_sizes: list[int] = []
+        sql_node_iter = pxt.exec.SqlNode.__iter__
+
+        def recording_iter(self):
+            for batch in sql_node_iter(self):
+                sql_batch_sizes.append(len(batch))
+                yield batch
+
+        monkeypatch.setattr(pxt.exec.SqlNode, '__iter__', recording_iter)
+
+        df = t.select(t.c1, t.c2, t.c6).order_by(t.c2)
+        expected = df.collect()
+        sql_batch_sizes.clear()
+        batches = list(df.iter_batches(batch_size=30))
+        assert [len(b) for b in batches] == [30, 30, 30, 10]
+        assert sql_batch_sizes == [30, 30, 30, 10]
+        assert all(b.schema == expected.schema for b in batches)
+        assert [row for b in batches for row in b] == list(expected)
+        assert list(df.iter_rows(batch_size=7)) == list(expected)
+        assert [row['c2'] for row in t.iter_rows()] == t.collect()['c2']
+
+        # where clause and limit
+        res = [row['c2'] for row in t.where(t.c2 >= 50).select(t.c2).limit(25).iter_rows(batch_size=10)]
+        assert res == list(range(50, 75))
+        # aggregation
+        batches = list(t.group_by(t.c4).select(t.c4, n=pxt.functions.count(t.c2)).iter_batches(batch_size=1))
+        assert sorted((b[0, 'c4'], b[0, 'n']) for b in batches) == [(False, 50), (True, 50)]
+        # partial consumption
+        it = df.iter_rows(batch_size=10)
+        assert next(it)['c2'] == 0
+        it.close()
+        assert t.count() == 100
+
+        with pytest.raises(excs.Error) as exc_info:
+            _ = list(df.iter_batches(batch_size=0))
+        assert 'batch_size must be a positive integer' in str(exc_info.value)
+
     def test_order_by(self, test_tbl: catalog.Table) -> None:
         t = test_tbl
         res = t.select(t.c4, t.c2).order_by(t.c4).order_by(t.c2, asc=False).collect()
@@ -411,6 +411,61 @@ class TestExprs:
                 assert results['gt'] == [a > b for a, b in zip(a_results, b_results)], f'{a_expr} > {b_expr}'
                 assert results['ge'] == [a >= b for a, b in zip(a_results, b_results)], f'{a_expr} >= {b_expr}'
 
+    def test_vectorized_eval(self, test_tbl: catalog.Table) -> None:
+        # exprs that aren't evaluated in SQL get evaluated over entire batches; make sure the results (including nulls
+        # and errors) match row-wise Python semantics
+        t = test_tbl
+        t.add_column(c2n=pxt.Int)
+        t.add_column(c3n=pxt.Float)
+        t.where(t.c2 % 7 != 0).update({'c2n': t.c2 - 50, 'c3n': t.c3})
+        c2 = t.c2.apply(lambda x: x, col_type=t.c2.col_type)
+        c2n = t.c2n.apply(lambda x: x, col_type=t.c2n.col_type)
+        c3n = t.c3n.apply(lambda x: x, col_type=t.c3n.col_type)
+        c1 = t.c1.apply(lambda x: x, col_type=t.c1.col_type)
+        res = t.select(
+            c2=c2, c2n=c2n, c3n=c3n, c1=c1,
+            add=c2 + c2n, sub=c2n - c3n, mul=c2n * 3, fdiv=c2 // 7, mod=c2n % 7, div=c3n / (c2 + 1),
+            eq=c2n == c2 - 50, ne=c2n != 0, lt=c2 < 50, ge=c2 >= 50.5, str_eq=c1 == 'test string 10',
+            is_null=c2n == None, and_=(c2 > 10) & (c2 < 50), or_=(c2 < 10) | (c2 > 50), not_=~(c2 > 10),
+            isin=c2.isin([1, 2, 3, 99]),
+        ).order_by(t.c2).collect()
+
+        def nullable(f):
+            return lambda *args: None if any(arg is None for arg in args) else f(*args)
+
+        assert res['add'] == [nullable(lambda a, b: a + b)(a, b) for a, b in zip(res['c2'], res['c2n'])]
+        assert res['sub'] == [nullable(lambda a, b: a - b)(a, b) for a, b in zip(res['c2n'], res['c3n'])]
+        assert res['mul'] == [nullable(lambda a: a * 3)(a) for a in res['c2n']]
+        assert res['fdiv'] == [a // 7 for a in res['c2']]
+        assert res['mod'] == [nullable(lambda a: a % 7)(a) for a in res['c2n']]
+        assert res['div'] == [nullable(lambda a, b: a / (b + 1))(a, b) for a, b in zip(res['c3n'], res['c2'])]
+        assert res['eq'] == [a == b - 50 for a, b in zip(res['c2n'], res['c2'])]
+        assert res['ne'] == [a != 0 for a in res['c2n']]
+        assert res['lt'] == [a < 50 for a in res['c2']]
+        assert res['ge'] == [a >= 50.5 for a in res['c2']]
+        assert res['str_eq'] == [a == 'test string 10' for a in res['c1']]
+        assert res['is_null'] == [a is None for a in res['c2n']]
+        assert res['and_'] == [10 < a < 50 for a in res['c2']]
+        assert res['or_'] == [a < 10 or a > 50 for a in res['c2']]
+        assert res['not_'] == [not a > 10 for a in res['c2']]
+        assert res['isin'] == [a in (1, 2, 3, 99) for a in res['c2']]
+
+        # None < int raises: those rows (and only those) record an error
+        num_nulls = t.where(t.c2n == None).count()
+        assert t.add_column(lt=c2n < c2, on_error='ignore').num_excs == num_nulls
+        res = t.select(t.c2n, t.lt, t.lt.errortype).order_by(t.c2).collect()
+        for c2n_val, lt_val, errortype in zip(res['c2n'], res['lt'], res['lt_errortype']):
+            assert (errortype == 'TypeError') == (c2n_val is None)
+            assert lt_val == (None if c2n_val is None else True)
+
+        # division by zero: only the offending rows record an error
+        assert t.add_column(quot=c2 // c2n, on_error='ignore').num_excs == t.where(t.c2n == 0).count()
+        res = t.select(t.c2, t.c2n, t.quot, t.quot.errortype).order_by(t.c2).collect()
+        for c2_val, c2n_val, quot, errortype in zip(res['c2'], res['c2n'], res['quot'], res['quot_errortype']):
+            assert (errortype == 'ZeroDivisionError') == (c2n_val == 0)
+            if c2n_val is not None and c2n_val != 0:
+                assert quot == c2_val // c2n_val
+
     def test_inline_dict(self, test_tbl: catalog.Table) -> None:
         t = test_tbl
         df = t[[{'a': t.c1, 'b': {'c': t.c2}, 'd': 1, 'e': {'f': 2}}]]
@@ -499,7 +554,7 @@ class TestExprs:
         def selection_equals(expr: Expr, expected: list[np.ndarray]) -> bool:
             return all(
                 np.array_equal(x, y)
-                for x, y in zip(t.select(out=expr).collect()['out'], expected)
+                for x, y in zip(t.select(out=expr).order_by(t.c2).collect()['out'], expected)
             )
 
         assert selection_equals(t.array_col, [np.array([[i, 1], [5, i]]) for i in range(100)])
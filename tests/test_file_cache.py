@@ -1,16 +1,25 @@
+import hashlib
+import multiprocessing
 import os
 import platform
+import shutil
+import threading
+import time
+import uuid
 from collections import OrderedDict
 from pathlib import Path
+from typing import Optional
 
 import pytest
 
 import pixeltable as pxt
 import pixeltable.exceptions as excs
 from pixeltable.env import Env
+from pixeltable.exec import CachePrefetchNode
 from pixeltable.utils.filecache import FileCache
+from pixeltable.utils.http_server import AbsolutePathHandler, LoggingHTTPServer, get_file_uri
 
-from .utils import get_image_files
+from .utils import get_image_files, get_video_files
 
 
 class TestFileCache:
@@ -78,3 +87,379 @@ class TestFileCache:
             t.insert({'index': len(image_files) + n, 'image': image_urls[n]} for n in range(10, 15))
         # Check that we saw the warning exactly once
         assert sum(r.category is excs.PixeltableWarning for r in record) == 1
+
+    def test_persistent_index(self, reset_db, tmp_path: Path) -> None:
+        fc = FileCache.get()
+        fc.clear()
+        tbl_id = uuid.uuid4()
+        image_files = get_image_files()[:6]
+        urls = [f'https://example.com/{Path(file).name}' for file in image_files]
+        for file, url in zip(image_files[:5], urls[:5]):
+            tmp_file = tmp_path / Path(file).name
+            shutil.copyfile(file, tmp_file)
+            fc.add(tbl_id, 0, url, tmp_file)
+        sizes = [os.stat(file).st_size for file in image_files]
+        assert fc.num_files(tbl_id) == 5
+        assert fc.total_size == sum(sizes[:5])
+
+        # a new instance picks up the entries from the index
+        FileCache.init()
+        fc = FileCache.get()
+        assert fc.num_files(tbl_id) == 5
+        assert fc.total_size == sum(sizes[:5])
+        assert all(fc.lookup(url) is not None for url in urls[:5])
+        assert fc.stats().num_hits == 5
+        fc.reconciler.join()
+        assert fc.num_files(tbl_id) == 5
+
+        # files that are added or removed behind the index's back get reconciled in the background
+        os.remove(fc.lookup(urls[0]))
+        key = hashlib.sha256(urls[5].encode()).hexdigest()
+        shutil.copyfile(image_files[5], Env.get().file_cache_dir / f'{tbl_id.hex}_0_{key}.JPEG')
+        prev_fc = fc
+        FileCache.init()
+        # the previous instance doesn't hold on to its connection and reconciler
+        assert prev_fc.conn is None and prev_fc.reconciler is None
+        fc = FileCache.get()
+        assert fc.num_files(tbl_id) == 5  # the reconciler has been started, but may not be done yet
+        fc.reconciler.join()
+        assert fc.num_files(tbl_id) == 5
+        assert fc.total_size == sum(sizes[1:])
+        assert fc.lookup(urls[0]) is None
+        assert fc.lookup(urls[5]) is not None
+
+        # without an index, it is rebuilt from the directory before the cache gets used
+        for path in Env.get().file_cache_dir.glob(f'{FileCache.INDEX_FILENAME}*'):
+            path.unlink()
+        FileCache.init()
+        fc = FileCache.get()
+        assert fc.num_files(tbl_id) == 5
+        assert fc.reconciler is None
+        assert fc.total_size == sum(sizes[1:])
+        assert all(fc.lookup(url) is not None for url in urls[1:])
+
+        fc.clear(tbl_id=tbl_id)
+        assert fc.num_files(tbl_id) == 0
+        assert len(list(Env.get().file_cache_dir.glob(f'{tbl_id.hex}_*'))) == 0
+
+    def test_eviction_policy(self, reset_db, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        fc = FileCache.get()
+        fc.clear()
+        file_size = 1000
+        fc.set_capacity(10 * file_size)
+        tbl_id = uuid.uuid4()
+
+        def add(name: str, scan: bool = False) -> None:
+            path = tmp_path / f'{name}.bin'
+            path.write_bytes(b'x' * file_size)
+            fc.add(tbl_id, 0, f'https://example.com/{name}', path, scan=scan)
+
+        def is_cached(name: str) -> bool:
+            # a scan lookup doesn't affect the state of the cache
+            return fc.lookup(f'https://example.com/{name}', scan=True) is not None
+
+        def run_workload() -> None:
+            fc.clear(tbl_id)
+            # a working set that gets accessed repeatedly
+            for i in range(4):
+                add(f'hot{i}')
+            for i in range(4):
+                assert fc.lookup(f'https://example.com/hot{i}') is not None
+            # followed by a large scan
+            for i in range(30):
+                add(f'scan{i}')
+
+        # with LRU, the scan flushes the working set
+        run_workload()
+        assert not any(is_cached(f'hot{i}') for i in range(4))
+        assert fc.total_size == 10 * file_size
+
+        # 2Q protects it
+        monkeypatch.setattr(fc, 'policy', '2q')
+        run_workload()
+        assert all(is_cached(f'hot{i}') for i in range(4))
+        assert is_cached('scan29') and not is_cached('scan0')
+        assert fc.total_size == 10 * file_size
+        # an entry that was evicted from probation recently and gets re-added is part of the working set
+        add('scan23')
+        for i in range(30, 50):
+            add(f'scan{i}')
+        assert is_cached('scan23')
+        assert all(is_cached(f'hot{i}') for i in range(4))
+
+        # with LRU, a one-shot scan doesn't flush the working set either
+        monkeypatch.setattr(fc, 'policy', 'lru')
+        fc.clear(tbl_id)
+        for i in range(8):
+            add(f'hot{i}')
+        for i in range(30):
+            add(f'scan{i}', scan=True)
+        assert all(is_cached(f'hot{i}') for i in range(8))
+        # the scan only retains its most recent files
+        assert [i for i in range(30) if is_cached(f'scan{i}')] == [28, 29]
+        # the scan's files go first
+        add('new0')
+        assert not is_cached('scan28') and is_cached('scan29') and is_cached('hot0')
+        # a regular lookup of a file downloaded by a scan makes it a regular entry
+        assert fc.lookup('https://example.com/scan29') is not None
+        # scan lookups don't count as accesses: hot0 is still the least recently used entry
+        add('new1')
+        assert not is_cached('hot0') and is_cached('hot1')
+        add('new2')
+        assert not is_cached('hot1') and is_cached('scan29')
+        # a scan lookup of an entry whose file is gone is a miss that drops the entry
+        num_files = fc.num_files(tbl_id)
+        fc.lookup('https://example.com/scan29').unlink()
+        assert not is_cached('scan29')
+        assert fc.num_files(tbl_id) == num_files - 1
+
+        with pytest.raises(excs.Error, match='Invalid file cache policy'):
+            fc.set_policy('mru')
+        fc.clear()
+
+        # the hint can be given per query
+        t = pxt.create_table('images', {'image': pxt.Image})
+        t.insert({'image': file} for file in get_image_files()[:2])
+        assert len(t.select(t.image).collect(one_shot=True)) == 2
+        assert len(list(t.select(t.image).iter_rows(batch_size=1, one_shot=True))) == 2
+
+    @pytest.mark.skipif(platform.system() == 'Windows', reason='Requires fork and file locks')
+    def test_shared_cache(self, reset_db, tmp_path: Path) -> None:
+        fc = FileCache.get()
+        fc.clear()
+        fc.set_capacity(20 * 1000)
+        tbl_id = uuid.uuid4()
+        ctx = multiprocessing.get_context('fork')
+        num_downloads = ctx.Value('i', 0)
+
+        def run_worker(worker_idx: int, result_queue: multiprocessing.Queue) -> None:
+            worker_fc = FileCache.get()
+            # the capacity is a per-process setting
+            worker_fc.set_capacity(20 * 1000)
+
+            def download(name: str) -> Path:
+                with num_downloads.get_lock():
+                    num_downloads.value += 1
+                time.sleep(0.2)  # make sure the other workers show up while we're downloading
+                path = tmp_path / f'{name}_{worker_idx}.bin'
+                path.write_bytes(b'x' * 1000)
+                return path
+
+            # all workers want the same file: only one of them downloads it
+            path = worker_fc.fetch(tbl_id, 0, 'https://example.com/shared', lambda: download('shared'))
+            result_queue.put(str(path))
+            # each worker adds its own files, which forces evictions in all processes
+            for i in range(15):
+                path = tmp_path / f'own{i}_{worker_idx}.bin'
+                path.write_bytes(b'x' * 1000)
+                worker_fc.add(tbl_id, 1, f'https://example.com/{worker_idx}/{i}', path)
+
+        result_queue = ctx.Queue()
+        workers = [ctx.Process(target=run_worker, args=(i, result_queue)) for i in range(4)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join(timeout=60)
+            assert w.exitcode == 0
+        paths = {result_queue.get(timeout=5) for _ in workers}
+        assert len(paths) == 1
+        assert num_downloads.value == 1
+
+        # the index is consistent with the directory, and the capacity was respected across processes
+        files = list(Env.get().file_cache_dir.glob(f'{tbl_id.hex}_*'))
+        assert fc.num_files(tbl_id) == len(files)
+        assert fc.total_size == sum(f.stat().st_size for f in files) <= 20 * 1000
+        assert len(list((Env.get().file_cache_dir / FileCache.LOCK_DIRNAME).iterdir())) == 0
+        fc.clear()
+
+    def test_concurrent_lookup(self, reset_db, tmp_path: Path) -> None:
+        fc = FileCache.get()
+        fc.clear()
+        tbl_id = uuid.uuid4()
+        urls = [f'https://example.com/{i}' for i in range(10)]
+
+        def add(fc: FileCache, url: str) -> None:
+            path = tmp_path / f'{uuid.uuid4().hex}.bin'
+            path.write_bytes(b'x' * 1000)
+            fc.add(tbl_id, 0, url, path)
+
+        # a file that disappeared behind the index's back is a cache miss, and it doesn't get recreated
+        add(fc, urls[0])
+        path = fc.lookup(urls[0])
+        path.unlink()
+        assert fc.lookup(urls[0]) is None
+        assert not path.exists()
+        assert fc.num_files(tbl_id) == 0
+
+        # a second instance on the same directory behaves like another process: it keeps evicting the entries that
+        # the first one is looking up
+        other_fc = FileCache()
+        other_fc.set_capacity(3 * 1000)
+        stop = threading.Event()
+        errors: list[Exception] = []
+
+        def evict() -> None:
+            try:
+                i = 0
+                while not stop.is_set():
+                    add(other_fc, urls[i % len(urls)])
+                    i += 1
+            except Exception as exc:
+                errors.append(exc)
+
+        evictor = threading.Thread(target=evict)
+        evictor.start()
+        try:
+            for i in range(500):
+                path = fc.lookup(urls[i % len(urls)])
+                assert path is None or path.suffix == '.bin'
+        finally:
+            stop.set()
+            evictor.join()
+        assert errors == []
+        files = list(Env.get().file_cache_dir.glob(f'{tbl_id.hex}_*'))
+        assert all(f.stat().st_size == 1000 for f in files)
+        assert fc.num_files(tbl_id) == len(files)
+        fc.clear()
+
+    def test_http_downloads(self, reset_db, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        fc = FileCache.get()
+        fc.clear()
+        image_files = get_image_files()[:40]
+        urls = [get_file_uri(Env.get().http_address, file) for file in image_files]
+        t = pxt.create_table('images', {'index': pxt.Int, 'image': pxt.Image})
+        capsys.readouterr()
+        t.insert(({'index': i, 'image': url} for i, url in enumerate(urls)), print_stats=True)
+        total_size = sum(os.stat(file).st_size for file in image_files)
+        assert f'CachePrefetchNode: 40 downloads (0 errors), {total_size} bytes' in capsys.readouterr().out
+        # the downloads were written correctly
+        for file, url in zip(image_files, urls):
+            assert fc.lookup(url).read_bytes() == Path(file).read_bytes()
+
+        # failed downloads are reported with their url and don't leave anything behind
+        missing_url = get_file_uri(Env.get().http_address, str(tmp_path / 'missing.jpg'))
+        with pytest.raises(excs.Error, match=f'Failed to download {missing_url}'):
+            t.insert(index=100, image=missing_url)
+        status = t.insert(index=101, image=missing_url, on_error='ignore')
+        assert status.num_excs > 0
+        assert fc.lookup(missing_url) is None
+        fc.clear()
+
+    def test_concurrency_tuner(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        now = 0.0
+        monkeypatch.setattr(time, 'perf_counter', lambda: now)
+        tuner = CachePrefetchNode.ConcurrencyTuner(16, 2, 64)
+        window_size = CachePrefetchNode.ConcurrencyTuner.WINDOW_SIZE
+
+        def run_window(max_useful_concurrency: int, num_errors: int = 0, saturated: bool = True) -> None:
+            """Simulates a server that doesn't get faster beyond max_useful_concurrency connections (1MB/s each)"""
+            nonlocal now
+            for i in range(window_size):
+                now += 1 / min(tuner.concurrency, max_useful_concurrency)
+                tuner.record(1_000_000, i < num_errors, saturated)
+
+        # the concurrency converges on what the server can handle
+        for _ in range(40):
+            run_window(24)
+        assert 16 <= tuner.concurrency <= 36
+        for _ in range(40):
+            run_window(4)
+        assert tuner.concurrency <= 8
+
+        # windows in which the download slots weren't all busy don't change the concurrency
+        concurrency = tuner.concurrency
+        for _ in range(10):
+            run_window(64, saturated=False)
+        assert tuner.concurrency == concurrency
+
+        # errors make us back off
+        tuner = CachePrefetchNode.ConcurrencyTuner(16, 2, 64)
+        run_window(64, num_errors=window_size // 2)
+        assert tuner.concurrency == 8
+        for _ in range(10):
+            run_window(64, num_errors=window_size // 2)
+        assert tuner.concurrency == 2
+
+    def test_ranged_downloads(self, reset_db, monkeypatch: pytest.MonkeyPatch) -> None:
+        range_headers: list[Optional[str]] = []
+        if_range_headers: list[Optional[str]] = []
+        # validators of the served file: the n-th response has the ETag etags[min(n, len(etags) - 1)]
+        etags: list[Optional[str]] = [None]
+        last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        lock = threading.Lock()
+
+        class RangeRequestHandler(AbsolutePathHandler):
+            """Adds support for (single) range requests, with If-Range"""
+            def do_GET(self) -> None:
+                range_header = self.headers.get('Range')
+                with lock:
+                    self.etag = etags[min(len(range_headers), len(etags) - 1)]
+                    range_headers.append(range_header)
+                    if range_header is not None:
+                        if_range_headers.append(self.headers.get('If-Range'))
+                if_range = self.headers.get('If-Range')
+                if range_header is None or (if_range is not None and if_range not in (self.etag, last_modified)):
+                    super().do_GET()
+                    return
+                data = Path(self.translate_path(self.path)).read_bytes()
+                start, end = (int(pos) for pos in range_header.removeprefix('bytes=').split('-'))
+                end = min(end, len(data) - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                self.send_header('Last-Modified', last_modified)
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                self.wfile.write(data[start:end + 1])
+
+            def end_headers(self) -> None:
+                if getattr(self, 'etag', None) is not None:
+                    self.send_header('ETag', self.etag)
+                super().end_headers()
+
+        httpd = LoggingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        try:
+            fc = FileCache.get()
+            fc.clear()
+            video_file = next(f for f in get_video_files() if os.stat(f).st_size > 2 << 20)
+            url = get_file_uri(f'http://127.0.0.1:{httpd.server_address[1]}', video_file)
+            t = pxt.create_table('videos', {'video': pxt.Video})
+
+            # the file is downloaded in 1 MiB parts
+            monkeypatch.setenv('PIXELTABLE_DOWNLOAD_PART_SIZE_M', '1')
+            t.insert(video=url)
+            num_parts = (os.stat(video_file).st_size + (1 << 20) - 1) >> 20
+            assert sorted(range_headers) == sorted(
+                f'bytes={i << 20}-{min((i + 1) << 20, os.stat(video_file).st_size) - 1}' for i in range(num_parts))
+            assert fc.lookup(url).read_bytes() == Path(video_file).read_bytes()
+            # without an ETag, the parts are validated with the Last-Modified date
+            assert if_range_headers == [None] + [last_modified] * (num_parts - 1)
+
+            # weak ETags can't be used with If-Range
+            range_headers.clear()
+            if_range_headers.clear()
+            etags[:] = ['W/"v1"']
+            t.insert(video=url + '?v=1')
+            assert len(range_headers) == num_parts
+            assert if_range_headers == [None] + [last_modified] * (num_parts - 1)
+            assert fc.lookup(url + '?v=1').read_bytes() == Path(video_file).read_bytes()
+
+            # if the file changes after the first part, we fall back to downloading it in one go
+            range_headers.clear()
+            if_range_headers.clear()
+            etags[:] = ['"v1"', '"v2"']
+            t.insert(video=url + '?v=3')
+            assert if_range_headers == [None] + ['"v1"'] * (num_parts - 1)
+            assert range_headers[-1] is None
+            assert fc.lookup(url + '?v=3').read_bytes() == Path(video_file).read_bytes()
+            etags[:] = [None]
+
+            # with a part size of 0, we download the file in one go
+            range_headers.clear()
+            monkeypatch.setenv('PIXELTABLE_DOWNLOAD_PART_SIZE_M', '0')
+            t.insert(video=url + '?v=2')
+            assert range_headers == [None]
+            assert fc.lookup(url + '?v=2').read_bytes() == Path(video_file).read_bytes()
+            fc.clear()
+        finally:
+            httpd.shutdown()
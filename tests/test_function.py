@@ -1,13 +1,22 @@
+import os
+import threading
+import time
+from pathlib import Path
 from typing import Optional
 
 import numpy as np
+import PIL.Image
+import PIL.ImageOps
 import pytest
 
 import pixeltable as pxt
 import pixeltable.exceptions as excs
 import pixeltable.func as func
 from pixeltable import catalog
+from pixeltable.exec import ExprEvalNode
+from pixeltable.exec.process_pool import ProcessPool
 from pixeltable.func import Batch, Function, FunctionRegistry
+from pixeltable.utils.result_cache import ResultCache
 
 from .utils import assert_resultset_eq, reload_catalog, validate_update_status
 
@@ -435,6 +444,201 @@ class TestFunction:
             from .module_with_duplicate_udf import duplicate_udf
         assert 'A UDF with that name already exists: tests.module_with_duplicate_udf.duplicate_udf' in str(exc_info.value)
 
+    def test_concurrent_udf(self, reset_db) -> None:
+        _concurrency_stats.update(in_flight=0, max_in_flight=0)
+        assert concurrent_udf.is_concurrent
+        t = pxt.create_table('test', {'c1': pxt.IntType()})
+        t.insert({'c1': i} for i in range(50))
+        status = t.add_column(out=concurrent_udf(t.c1), on_error='ignore')
+        assert status.num_excs == 7
+        assert 1 < _concurrency_stats['max_in_flight'] <= 4
+        res = t.select(t.c1, t.out, t.out.errortype).order_by(t.c1).collect()
+        for row in res:
+            if row['c1'] % 7 == 3:
+                assert row['out'] is None
+                assert row['out_errortype'] == 'ValueError'
+            else:
+                assert row['out'] == row['c1'] * 2
+
+        with pytest.raises(excs.Error) as exc_info:
+            t.add_column(out2=concurrent_udf(t.c1), on_error='abort')
+        assert 'bad input' in str(exc_info.value)
+
+        with pytest.raises(excs.Error) as exc_info:
+            @pxt.udf(batch_size=8, max_concurrency=4)
+            def udf7(x: Batch[int]) -> Batch[int]:
+                return x
+        assert '`max_concurrency` cannot be combined with `batch_size`' in str(exc_info.value)
+
+    def test_batched_udf_full_batches(self, img_tbl: catalog.Table) -> None:
+        # the CachePrefetchNode produces batches of 16 rows; the batched udf should nonetheless see batches of 12
+        _batch_sizes.clear()
+        t = img_tbl
+        res = t.select(t.img, out=batched_width(t.img)).collect()
+        assert all(row['out'] == row['img'].width for row in res)
+        assert sum(_batch_sizes) == len(res)
+        assert all(size == 12 for size in _batch_sizes[:-1])
+
+    def test_batched_udf_latency(self, reset_db, monkeypatch: pytest.MonkeyPatch) -> None:
+        from pixeltable.exec import InMemoryDataNode
+        monkeypatch.setattr(InMemoryDataNode, 'CHUNK_SIZE', 5)
+        _timed_batches.clear()
+        t = pxt.create_table('test', {'c1': pxt.Int})
+        t.add_computed_column(out=timed_batched_double(t.c1))
+        resume_ts: list[float] = []
+
+        def slow_rows():
+            yield from ({'c1': i} for i in range(5))
+            # the input stalls, but the partial batch isn't held back past the deadline
+            time.sleep(2)
+            resume_ts.append(time.monotonic())
+            yield from ({'c1': i} for i in range(5, 10))
+
+        validate_update_status(t.insert(slow_rows()), expected_rows=10)
+        assert [size for size, _ in _timed_batches] == [5, 5]
+        assert _timed_batches[0][1] < resume_ts[0]
+        assert t.where(t.out != t.c1 * 2).count() == 0
+
+    def test_adaptive_batch_size(self, reset_db, monkeypatch: pytest.MonkeyPatch) -> None:
+        _adaptive_batch_sizes.clear()
+        t = pxt.create_table('test', {'c1': pxt.IntType()})
+        t.insert({'c1': i} for i in range(200))
+        validate_update_status(t.add_column(out=adaptive_batched(t.c1)), expected_rows=200)
+        assert t.where(t.out != t.c1 * 2).count() == 0
+        # the batch size grew from 4 to 32, which got rejected; after that, it stayed at 16
+        first_rejected = _adaptive_batch_sizes.index(32)
+        assert _adaptive_batch_sizes[:first_rejected] == sorted(_adaptive_batch_sizes[:first_rejected])
+        assert _adaptive_batch_sizes[0] == 4 and 8 in _adaptive_batch_sizes and 16 in _adaptive_batch_sizes
+        assert all(size <= 16 for size in _adaptive_batch_sizes[first_rejected + 1:])
+        assert adaptive_batched.get_batch_size() == 16
+
+        # rate limiting doesn't affect the batch size: the call is retried after a delay
+        monkeypatch.setattr(ExprEvalNode, 'RATE_LIMIT_DELAY', 0.01)
+        _adaptive_batch_sizes.clear()
+        _rate_limited_calls[:] = [0, 3]
+        t2 = pxt.create_table('test2', {'c1': pxt.Int})
+        t2.insert({'c1': i} for i in range(64))
+        validate_update_status(t2.add_column(out=rate_limited_batched(t2.c1)), expected_rows=64)
+        assert t2.where(t2.out != t2.c1 * 2).count() == 0
+        assert _rate_limited_calls[0] == 3
+        assert rate_limited_batched.get_batch_size() > 4
+
+        with pytest.raises(excs.Error) as exc_info:
+            @pxt.udf(batch_size=8, max_batch_size=4)
+            def udf9(x: Batch[int]) -> Batch[int]:
+                return x
+        assert '1 <= min_batch_size <= batch_size <= max_batch_size' in str(exc_info.value)
+
+    def test_process_pool_udf(self, img_tbl: catalog.Table) -> None:
+        assert process_pid.runs_in_process_pool and not process_pid.is_concurrent
+        t = img_tbl
+        # images and arrays are large enough to be passed via shared memory, in both directions
+        res = t.select(
+            t.img, inverted=process_invert(t.img), pixel_sum=process_pixel_sum(t.img.resize([256, 256])),
+            arr=process_to_array(t.img.resize([256, 256]))
+        ).collect()
+        for row in res:
+            img = row['img'].convert('RGB')
+            assert np.array_equal(np.asarray(row['inverted']), np.asarray(PIL.ImageOps.invert(img)))
+            arr = np.asarray(row['img'].resize((256, 256)).convert('RGB'))
+            assert row['pixel_sum'] == int(arr.sum())
+            assert np.array_equal(row['arr'], arr)
+
+        status = t.add_column(pid=process_pid(t.img.width), on_error='ignore')
+        res = t.select(t.img.width, t.pid, t.pid.errortype).collect()
+        assert status.num_excs == sum(1 for row in res if row['width'] % 7 == 3)
+        pids = set()
+        for row in res:
+            if row['width'] % 7 == 3:
+                assert row['pid_errortype'] == 'ValueError'
+            else:
+                pids.add(row['pid'])
+        assert os.getpid() not in pids
+
+        with pytest.raises(excs.Error) as exc_info:
+            t.add_column(pid2=process_pid(t.img.width), on_error='abort')
+        assert 'bad width' in str(exc_info.value)
+
+        # results that are never retrieved after a failure still release their shared memory
+        shm_names = set(os.listdir('/dev/shm'))
+        with pytest.raises(excs.Error) as exc_info:
+            _ = t.select(arr=process_array_or_fail(t.img.width)).collect()
+        assert 'bad width' in str(exc_info.value)
+        ProcessPool.shutdown_all()
+        assert set(os.listdir('/dev/shm')) <= shm_names
+
+        with pytest.raises(excs.Error) as exc_info:
+            @pxt.udf(executor='thread')
+            def udf8(x: int) -> int:
+                return x
+        assert "`executor` must be one of 'process'" in str(exc_info.value)
+
+    def test_result_cache(self, reset_db, tmp_path: Path) -> None:
+        cache = ResultCache.get()
+        cache.clear()
+        _memoized_calls.clear()
+        t = pxt.create_table('test', {'c1': pxt.Int, 'c2': pxt.Json})
+        t.insert({'c1': i % 20, 'c2': {'a': i % 20}} for i in range(40))
+
+        # duplicate arguments are only computed once, also across operations
+        validate_update_status(t.add_column(sq=memoized_square(t.c1)), expected_rows=40)
+        assert sorted(_memoized_calls) == list(range(20))
+        t.drop_column('sq')
+        _memoized_calls.clear()
+        validate_update_status(t.add_column(sq=memoized_square(t.c1)), expected_rows=40)
+        assert _memoized_calls == []
+        assert t.where(t.sq != t.c1 * t.c1).count() == 0
+        res = t.select(out=memoized_square(t.c1, offset=100)).order_by(t.c1).collect()
+        assert res['out'] == sorted((i + 100) ** 2 for i in range(40) for i in [i % 20])
+        assert sorted(_memoized_calls) == list(range(100, 120))
+        assert cache.stats().num_hits >= 60
+
+        # batched functions: only the misses are passed to the function
+        _memoized_calls.clear()
+        res = t.select(out=memoized_batched_square(t.c1)).collect()
+        assert sorted(res['out']) == sorted((i % 20) ** 2 for i in range(40))
+        assert sorted(_memoized_calls) == list(range(20))
+        _memoized_calls.clear()
+        t.insert({'c1': i, 'c2': {'a': i}} for i in range(15, 25))
+        _ = t.select(out=memoized_batched_square(t.c1)).collect()
+        assert set(_memoized_calls) == set(range(20, 25))
+
+        # Json arguments
+        _memoized_calls.clear()
+        _ = t.select(out=memoized_json(t.c2)).collect()
+        _ = t.select(out=memoized_json(t.c2)).collect()
+        assert sorted(_memoized_calls) == list(range(25))
+
+        # results are persistent
+        ResultCache.init()
+        _memoized_calls.clear()
+        res = t.select(out=memoized_batched_square(t.c1)).collect()
+        assert _memoized_calls == []
+        assert sorted(res['out']) == sorted(row['c1'] ** 2 for row in t.select(t.c1).collect())
+        assert memoized_batched_square.is_deterministic
+
+        # eviction
+        cache = ResultCache.get()
+        num_entries = cache.stats().num_entries
+        cache.set_capacity(cache.stats().total_size // 2)
+        assert 0 < cache.stats().num_entries < num_entries
+        cache.set_capacity(1 << 30)
+
+        # the total size reflects entries added by other processes (here: another instance)
+        other_cache = ResultCache()
+        other_cache.put(cache.make_key(memoized_square, [1000], {}), b'x' * 1000)
+        cache.set_capacity(1 << 30)
+        assert cache.stats().total_size == other_cache.total_size
+
+        # media files are identified by their contents' version; calls with remote files don't get cached
+        path = tmp_path / 'video.mp4'
+        path.write_bytes(b'x' * 100)
+        key = cache.make_key(memoized_video_size, [str(path)], {})
+        assert key is not None and key == cache.make_key(memoized_video_size, [str(path)], {})
+        path.write_bytes(b'x' * 200)
+        assert cache.make_key(memoized_video_size, [str(path)], {}) not in (key, None)
+        assert cache.make_key(memoized_video_size, ['https://example.com/video.mp4'], {}) is None
+
     def test_udf_docstring(self) -> None:
         assert self.func.__doc__ == "A UDF."
         assert self.agg.__doc__ == "An aggregator."
@@ -443,3 +647,127 @@ class TestFunction:
 @pxt.udf
 def udf6(name: str) -> str:
     return ''
+
+
+_concurrency_lock = threading.Lock()
+_concurrency_stats = {'in_flight': 0, 'max_in_flight': 0}
+
+
+@pxt.udf(max_concurrency=4)
+def concurrent_udf(x: int) -> int:
+    with _concurrency_lock:
+        _concurrency_stats['in_flight'] += 1
+        _concurrency_stats['max_in_flight'] = max(_concurrency_stats['max_in_flight'], _concurrency_stats['in_flight'])
+    time.sleep(0.01)
+    with _concurrency_lock:
+        _concurrency_stats['in_flight'] -= 1
+    if x % 7 == 3:
+        raise ValueError(f'bad input: {x}')
+    return x * 2
+
+
+_timed_batches: list[tuple[int, float]] = []  # (batch size, time of the call)
+
+
+@pxt.udf(batch_size=8)
+def timed_batched_double(x: Batch[int]) -> Batch[int]:
+    _timed_batches.append((len(x), time.monotonic()))
+    return [v * 2 for v in x]
+
+
+_batch_sizes: list[int] = []
+
+
+@pxt.udf(batch_size=12)
+def batched_width(imgs: Batch[PIL.Image.Image]) -> Batch[int]:
+    _batch_sizes.append(len(imgs))
+    return [img.width for img in imgs]
+
+
+@pxt.udf(executor='process', max_concurrency=2)
+def process_invert(img: PIL.Image.Image) -> PIL.Image.Image:
+    return PIL.ImageOps.invert(img.convert('RGB'))
+
+
+@pxt.udf(executor='process', max_concurrency=2)
+def process_pixel_sum(img: PIL.Image.Image) -> int:
+    return int(np.asarray(img.convert('RGB')).sum())
+
+
+@pxt.udf(executor='process', max_concurrency=2)
+def process_to_array(img: PIL.Image.Image) -> pxt.Array[(256, 256, 3), pxt.Int]:
+    return np.asarray(img.convert('RGB'))
+
+
+@pxt.udf(executor='process', max_concurrency=2)
+def process_pid(width: int) -> int:
+    if width % 7 == 3:
+        raise ValueError(f'bad width: {width}')
+    return os.getpid()
+
+
+@pxt.udf(executor='process', max_concurrency=2)
+def process_array_or_fail(width: int) -> pxt.Array[(256, 256), pxt.Int]:
+    if width % 7 == 3:
+        raise ValueError(f'bad width: {width}')
+    return np.full((256, 256), width, dtype=np.int64)
+
+
+_adaptive_batch_sizes: list[int] = []
+
+
+class PayloadTooLargeError(Exception):
+    status_code = 413
+
+
+@pxt.udf(batch_size=4, min_batch_size=2, max_batch_size=64)
+def adaptive_batched(x: Batch[int]) -> Batch[int]:
+    _adaptive_batch_sizes.append(len(x))
+    if len(x) > 16:
+        raise PayloadTooLargeError('batch too large')
+    # fixed per-call overhead: larger batches have higher throughput
+    time.sleep(0.01)
+    return [val * 2 for val in x]
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+# number of calls to rate_limited_batched() that were rejected so far, number of calls to reject
+_rate_limited_calls: list[int] = [0, 0]
+
+
+@pxt.udf(batch_size=4, min_batch_size=2, max_batch_size=64)
+def rate_limited_batched(x: Batch[int]) -> Batch[int]:
+    if _rate_limited_calls[0] < _rate_limited_calls[1]:
+        _rate_limited_calls[0] += 1
+        raise RateLimitError('too many requests')
+    time.sleep(0.01)
+    return [val * 2 for val in x]
+
+
+_memoized_calls: list[int] = []
+
+
+@pxt.udf(is_deterministic=True)
+def memoized_square(x: int, offset: int = 0) -> int:
+    _memoized_calls.append(x + offset)
+    return (x + offset) ** 2
+
+
+@pxt.udf(is_deterministic=True)
+def memoized_video_size(video: pxt.Video) -> int:
+    return os.stat(video).st_size
+
+
+@pxt.udf(batch_size=8, is_deterministic=True)
+def memoized_batched_square(x: Batch[int]) -> Batch[int]:
+    _memoized_calls.extend(x)
+    return [val * val for val in x]
+
+
+@pxt.udf(is_deterministic=True)
+def memoized_json(d: dict) -> int:
+    _memoized_calls.append(d['a'])
+    return d['a']
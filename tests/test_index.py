@@ -1,3 +1,4 @@
+import hashlib
 import random
 import string
 import sys
@@ -7,9 +8,13 @@ from typing import Union, _GenericAlias
 import numpy as np
 import PIL.Image
 import pytest
+import sqlalchemy as sql
 
 import pixeltable as pxt
+from pixeltable.env import Env
+from pixeltable.func import Batch
 from pixeltable.functions.huggingface import clip_image, clip_text
+from pixeltable.index import EmbeddingIndex
 
 from .utils import (assert_img_eq, clip_img_embed, clip_text_embed, e5_embed, reload_catalog,
                     skip_test_if_not_installed, validate_update_status, ReloadTester, get_sentences, assert_resultset_eq)
@@ -27,6 +32,23 @@ class TestIndex:
     def bad_embed2(x: str) -> pxt.Array[(None,), pxt.Float]:
         return np.zeros(10)
 
+    num_embed_calls = 0
+
+    # counts its calls
+    @pxt.udf
+    def counting_embed(x: str) -> pxt.Array[(4,), pxt.Float]:
+        TestIndex.num_embed_calls += 1
+        return np.array([len(x), x.count('a'), x.count('e'), 1.0], dtype=np.float32)
+
+    # a batched embedding function without ties; counts its calls
+    @pxt.udf(batch_size=16)
+    def batched_embed(x: Batch[str]) -> Batch[pxt.Array[(8,), pxt.Float]]:
+        TestIndex.num_embed_calls += 1
+        return [
+            np.random.default_rng(int(hashlib.sha256(s.encode()).hexdigest()[:8], 16)).random(8, dtype=np.float32)
+            for s in x
+        ]
+
     def test_similarity(self, small_img_tbl: pxt.Table, reload_tester: ReloadTester) -> None:
         skip_test_if_not_installed('transformers')
         t = small_img_tbl
@@ -111,6 +133,170 @@ class TestIndex:
 
         res = list(t.select(img=t.img.localpath, matches=t.queries.img_matches(t.img)).head(1))
 
+    def test_query_embedding_cache(self, reset_db) -> None:
+        t = pxt.create_table('docs', {'text': pxt.String})
+        t.insert({'text': text} for text in get_sentences(20))
+        t.add_embedding_index('text', string_embed=self.counting_embed)
+
+        def run_query(query: str) -> pxt.DataFrame:
+            sim = t.text.similarity(query)
+            return t.select(t.text, sim=sim).order_by(sim, asc=False).limit(5).collect()
+
+        # the query is embedded once, even though similarity() appears twice
+        TestIndex.num_embed_calls = 0
+        res = run_query('a banana')
+        assert TestIndex.num_embed_calls == 1
+        # repeated queries don't need to embed it again
+        assert_resultset_eq(run_query('a banana'), res)
+        assert TestIndex.num_embed_calls == 1
+        _ = run_query('an apple')
+        assert TestIndex.num_embed_calls == 2
+
+        # the cache is bounded
+        idx = next(info.idx for info in t._tbl_version.idxs_by_name.values() if isinstance(info.idx, EmbeddingIndex))
+        for i in range(idx.QUERY_CACHE_SIZE):
+            idx.embed_query(f'query {i}')
+        assert len(idx.query_cache) == idx.QUERY_CACHE_SIZE
+        TestIndex.num_embed_calls = 0
+        _ = run_query('a banana')
+        assert TestIndex.num_embed_calls == 1
+
+    def test_similarity_search(self, reset_db) -> None:
+        t = pxt.create_table('docs', {'id': pxt.Int, 'text': pxt.String})
+        t.insert({'id': i, 'text': text} for i, text in enumerate(get_sentences(50)))
+        # the first and last query are identical
+        queries = ['a banana', 'an apple', 'the red car', 'a banana']
+
+        for metric, is_asc in [('cosine', False), ('ip', False), ('l2', True)]:
+            t.add_embedding_index('text', idx_name='search_idx', metric=metric, string_embed=self.batched_embed)
+            df = t.where(t.id < 40).select(t.id, t.text)
+            TestIndex.num_embed_calls = 0
+            results = df.similarity_search(t.text, queries, k=5)
+            # the distinct queries are embedded as a single batch
+            assert TestIndex.num_embed_calls == 1
+            assert len(results) == len(queries)
+            # the results are the same as those of individual similarity() queries
+            for query, result in zip(queries, results):
+                sim = t.text.similarity(query)
+                expected = (
+                    t.where(t.id < 40).select(t.id, t.text, similarity=sim).order_by(sim, asc=is_asc).limit(5).collect()
+                )
+                assert_resultset_eq(result, expected, compare_col_names=True)
+            assert TestIndex.num_embed_calls == 1
+
+            # k can exceed the number of rows
+            results = t.where(t.id < 3).similarity_search(t.text, queries[:2], k=5)
+            assert [len(r) for r in results] == [3, 3]
+            assert list(results[0].schema.keys()) == ['id', 'text', 'similarity']
+            t.drop_embedding_index(idx_name='search_idx')
+
+        t.add_embedding_index('text', string_embed=self.batched_embed)
+        assert t.similarity_search(t.text, []) == []
+        with pytest.raises(pxt.Error, match='k must be a positive integer'):
+            t.similarity_search(t.text, queries, k=0)
+        with pytest.raises(pxt.Error, match='not supported for DataFrames with'):
+            t.order_by(t.id).similarity_search(t.text, queries)
+        with pytest.raises(pxt.Error, match='query items must be strings'):
+            t.similarity_search(t.text, ['a banana', 17])
+        with pytest.raises(pxt.Error, match='No index found'):
+            t.similarity_search(t.id, queries)
+        with pytest.raises(pxt.Error, match='needs to be evaluated by the store'):
+            t.where(t.text.apply(len, col_type=pxt.Int) > 10).similarity_search(t.text, queries)
+
+    def test_index_params(self, reset_db) -> None:
+        t = pxt.create_table('docs', {'id': pxt.Int, 'text': pxt.String})
+        sentences = get_sentences(50)
+        t.insert({'id': i, 'text': text} for i, text in enumerate(sentences))
+        vectors = np.stack(self.batched_embed.py_fn(sentences))
+        query = 'a banana'
+        query_vector = self.batched_embed.py_fn([query])[0]
+
+        def store_idx_def(idx_name: str) -> str:
+            idx_info = t._tbl_version.idxs_by_name[idx_name]
+            store_idx_name = t._tbl_version._store_idx_name(idx_info.id)
+            with Env.get().engine.begin() as conn:
+                return conn.execute(
+                    sql.text('SELECT indexdef FROM pg_indexes WHERE indexname = :name'), {'name': store_idx_name}
+                ).scalar_one()
+
+        # (index kwargs, query-time kwargs, expected fragments of the index definition)
+        configs = [
+            ({}, {}, ['USING hnsw', 'vector_cosine_ops', 'm=16', 'ef_construction=64']),
+            ({'build_params': {'m': 8, 'ef_construction': 32}}, {'ef_search': 100}, ['m=8', 'ef_construction=32']),
+            ({'precision': 'halfvec'}, {}, ['halfvec(8)', 'halfvec_cosine_ops']),
+            ({'index_type': 'ivfflat', 'build_params': {'lists': 4}}, {'probes': 4}, ['USING ivfflat', 'lists=4']),
+            # all rows are candidates, which makes the result exact
+            ({'precision': 'binary', 'rerank_factor': 10}, {}, ['binary_quantize', 'bit(8)', 'bit_hamming_ops']),
+        ]
+        for metric in ['cosine', 'l2']:
+            if metric == 'cosine':
+                dists = 1 - vectors @ query_vector / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector))
+            else:
+                dists = np.linalg.norm(vectors - query_vector, axis=1)
+            expected_ids = list(np.argsort(dists)[:5])
+
+            for idx_kwargs, search_kwargs, idx_def_fragments in configs:
+                t.add_embedding_index(
+                    'text', idx_name='params_idx', metric=metric, string_embed=self.batched_embed, **idx_kwargs)
+                # compare without whitespace and quotes
+                idx_def = store_idx_def('params_idx').lower().replace(' ', '').replace("'", '')
+                for fragment in idx_def_fragments:
+                    assert fragment.lower().replace(' ', '').replace('cosine', metric) in idx_def, idx_def
+
+                for _ in range(2):
+                    sim = t.text.similarity(query, **search_kwargs)
+                    res = t.select(t.id, sim=sim).order_by(sim, asc=(metric == 'l2')).limit(5).collect()
+                    assert res['id'] == expected_ids
+                    results = t.similarity_search(t.text, [query], k=5, **search_kwargs)
+                    assert results[0]['id'] == expected_ids
+                    # the index parameters are persisted
+                    reload_catalog()
+                    t = pxt.get_table('docs')
+                idx = t._tbl_version.idxs_by_name['params_idx'].idx
+                assert idx.as_dict()['index_type'] == idx_kwargs.get('index_type', 'hnsw')
+                assert idx.as_dict()['precision'] == idx_kwargs.get('precision', 'vector')
+                t.drop_embedding_index(idx_name='params_idx')
+
+        # query-time parameters are applied as settings of the query's transaction
+        t.add_embedding_index('text', idx_name='hnsw_idx', string_embed=self.batched_embed)
+        t.add_embedding_index(
+            'text', idx_name='ivfflat_idx', string_embed=self.batched_embed, index_type='ivfflat')
+        stmts: list[str] = []
+
+        def record_stmt(conn, cursor, statement, parameters, context, executemany) -> None:
+            stmts.append(statement % parameters if isinstance(parameters, dict) else statement)
+
+        sql.event.listen(Env.get().engine, 'before_cursor_execute', record_stmt)
+        try:
+            sim = t.text.similarity(query, idx='hnsw_idx', ef_search=123)
+            _ = t.order_by(sim, asc=False).limit(5).collect()
+            sim = t.text.similarity(query, idx='ivfflat_idx', probes=3)
+            _ = t.order_by(sim, asc=False).limit(5).collect()
+        finally:
+            sql.event.remove(Env.get().engine, 'before_cursor_execute', record_stmt)
+        assert any('hnsw.ef_search' in stmt and '123' in stmt for stmt in stmts)
+        assert any('ivfflat.probes' in stmt and '3' in stmt for stmt in stmts)
+        # the settings don't outlive the query
+        with Env.get().engine.connect() as conn:
+            assert conn.execute(sql.text('SHOW ivfflat.probes')).scalar_one() == '1'
+
+        with pytest.raises(pxt.Error, match="'probes' is not supported by index 'hnsw_idx'"):
+            _ = t.text.similarity(query, idx='hnsw_idx', probes=3)
+        with pytest.raises(pxt.Error, match="'ef_search' is not supported by index 'ivfflat_idx'"):
+            _ = t.text.similarity(query, idx='ivfflat_idx', ef_search=3)
+        with pytest.raises(pxt.Error, match="'ef_search' must be a positive integer"):
+            _ = t.text.similarity(query, idx='hnsw_idx', ef_search=0)
+        with pytest.raises(pxt.Error, match='Invalid index type'):
+            t.add_embedding_index('text', string_embed=self.batched_embed, index_type='flat')
+        with pytest.raises(pxt.Error, match='Invalid precision'):
+            t.add_embedding_index('text', string_embed=self.batched_embed, precision='int8')
+        with pytest.raises(pxt.Error, match="Invalid build parameter 'lists' for a hnsw index"):
+            t.add_embedding_index('text', string_embed=self.batched_embed, build_params={'lists': 10})
+        with pytest.raises(pxt.Error, match="'m' must be a positive integer"):
+            t.add_embedding_index('text', string_embed=self.batched_embed, build_params={'m': 0})
+        with pytest.raises(pxt.Error, match="'rerank_factor' is only supported with precision='binary'"):
+            t.add_embedding_index('text', string_embed=self.batched_embed, rerank_factor=2)
+
     def test_similarity_errors(self, indexed_img_tbl: pxt.Table, small_img_tbl: pxt.Table) -> None:
         skip_test_if_not_installed('transformers')
         t = indexed_img_tbl
@@ -1,23 +1,28 @@
 import datetime
+import io
 import random
 import math
 import os
 import random
-from typing import Union, _GenericAlias
+from typing import Optional, Union, _GenericAlias
 
 import av  # type: ignore[import-untyped]
 import numpy as np
 import pandas as pd
 import PIL
 import pytest
+import sqlalchemy as sql
 
 import pixeltable as pxt
 import pixeltable.functions as pxtf
 from pixeltable import catalog
 from pixeltable import exceptions as excs
+from pixeltable.env import Env
 from pixeltable.io.external_store import MockProject
 from pixeltable.iterators import FrameIterator
+from pixeltable.store import StoreBase
 from pixeltable.utils.filecache import FileCache
+from pixeltable.utils.image_encoder import ImageEncoder
 from pixeltable.utils.media_store import MediaStore
 
 from .utils import (assert_resultset_eq, create_table_data, get_audio_files, get_documents, get_image_files,
@@ -25,6 +30,19 @@ from .utils import (assert_resultset_eq, create_table_data, get_audio_files, get
                     validate_update_status, get_multimedia_commons_video_uris, ReloadTester)
 
 
+# arguments of calls to resumable_square(); it fails for arguments >= _resumable_square_fail_at
+_resumable_square_calls: list[int] = []
+_resumable_square_fail_at: Optional[int] = None
+
+
+@pxt.udf
+def resumable_square(a: int) -> int:
+    if _resumable_square_fail_at is not None and a >= _resumable_square_fail_at:
+        raise RuntimeError(f'failed for {a}')
+    _resumable_square_calls.append(a)
+    return a * a
+
+
 class TestTable:
     # exc for a % 10 == 0
     @pxt.udf
@@ -1273,6 +1291,189 @@ class TestTable:
         # now it works
         t.drop_column('c4')
 
+    def test_insert_special_values(self, reset_db: None) -> None:
+        # values that need escaping or special treatment when they're written with COPY
+        schema = {
+            'id': pxt.Int, 's': pxt.String, 'j': pxt.Json, 'ts': pxt.Timestamp, 'f': pxt.Float,
+            'b': pxt.Bool, 'a': pxt.Array[(None, 2), pxt.Float]
+        }
+        t = pxt.create_table('test', schema)
+        rows = [
+            {
+                'id': 0, 's': 'tab\tnewline\nbackslash\\N quote\'" carriage\r', 'j': {'k': 'a\tb\\c\n', 'l': [1, None]},
+                'ts': datetime.datetime(2024, 5, 6, 7, 8, 9, 123456, tzinfo=datetime.timezone.utc), 'f': -1.5e-300,
+                'b': True, 'a': np.array([[1.0, 2.0], [3.0, 4.0]], dtype=np.float32),
+            },
+            {
+                'id': 1, 's': '\\N', 'j': ['\\N', 'x\ty'], 'f': float('inf'), 'b': False,
+                'a': np.zeros((0, 2), dtype=np.float32),
+            },
+            {'id': 2, 's': '', 'j': [], 'ts': datetime.datetime(1999, 12, 31, 23, 59, 59)},
+            {'id': 3},
+        ]
+        validate_update_status(t.insert(rows), expected_rows=len(rows))
+        t.add_column(s2=t.s.upper())
+        t.add_column(j2=t.j)
+        res = t.order_by(t.id).collect()
+        for row, expected in zip(res, rows):
+            for col_name in ('s', 'j', 'f', 'b'):
+                assert row[col_name] == expected.get(col_name), col_name
+            assert row['s2'] == (expected['s'].upper() if 's' in expected else None)
+            assert row['j2'] == expected.get('j')
+            if 'a' in expected:
+                assert np.array_equal(row['a'], expected['a'])
+            else:
+                assert row['a'] is None
+        assert res[0, 'ts'] == rows[0]['ts']
+        assert res[2, 'ts'].replace(tzinfo=None) == rows[2]['ts']
+        assert res[3, 'ts'] is None
+        # a Json None is stored as SQL NULL
+        assert t.where(t.j == None).count() == 1
+
+    def test_array_storage(self, reset_db: None) -> None:
+        schema = {
+            'id': pxt.Int, 'f': pxt.Array[(3, 4), pxt.Float], 'i': pxt.Array[(5,), pxt.Int],
+            'b': pxt.Array[(2,), pxt.Bool], 'v': pxt.Array[(None, 2), pxt.Float]
+        }
+        t = pxt.create_table('test', schema)
+        rows = [
+            {
+                'id': i, 'f': np.arange(12, dtype=np.float32).reshape(3, 4) + i, 'i': np.arange(5) * i,
+                'b': np.array([True, i % 2 == 0]), 'v': np.ones((i, 2), dtype=np.float32)
+            }
+            for i in range(10)
+        ]
+        validate_update_status(t.insert(rows), expected_rows=len(rows))
+
+        # fixed-shape arrays are stored as raw data (with a 16-byte header), the others in np.save() format
+        tbl_version = t._tbl_version
+        cols = {name: tbl_version.cols_by_name[name].sa_col for name in ('f', 'i', 'b', 'v')}
+        with Env.get().engine.begin() as conn:
+            lengths = conn.execute(
+                sql.select(*[sql.func.octet_length(col) for col in cols.values()])
+                .select_from(tbl_version.store_tbl.sa_tbl)).all()
+        for f_len, i_len, b_len, v_len in lengths:
+            assert (f_len, i_len, b_len) == (64, 56, 18)
+            assert v_len > 64
+
+        def check(t: pxt.Table, rows: list[dict]) -> None:
+            res = t.order_by(t.id).collect()
+            for row, expected in zip(res, rows):
+                for name in ('f', 'i', 'b', 'v'):
+                    assert row[name].dtype == expected[name].dtype
+                    assert np.array_equal(row[name], expected[name])
+                    assert row[name].flags.aligned
+
+        check(t, rows)
+        # raw values are returned without a copy
+        assert not any(row['f'].flags.writeable for row in t.select(t.f).collect())
+
+        # values in np.save() format (eg, written by earlier versions) can still be read
+        with Env.get().engine.begin() as conn:
+            f_col = cols['f']
+            buffer = io.BytesIO()
+            np.save(buffer, rows[3]['f'])
+            status = conn.execute(
+                sql.update(tbl_version.store_tbl.sa_tbl)
+                .values({f_col: buffer.getvalue()})
+                .where(tbl_version.store_tbl.rowid_columns()[0] == 3))
+            assert status.rowcount == 1
+        check(t, rows)
+
+        # arrays that don't match the column's dtype are converted to it
+        t.add_computed_column(f64=t.f.apply(lambda a: a.astype(np.float64), col_type=pxt.Array[(3, 4), pxt.Float]))
+        res = t.order_by(t.id).select(t.f64).collect()
+        for row, expected in zip(res, rows):
+            assert row['f64'].dtype == np.float32
+            assert np.array_equal(row['f64'], expected['f'])
+
+        # other integer dtypes are accepted for Int arrays and keep their dtype (the np.save() representation of an
+        # int32 (32,) array has the same length as the raw data of an int64 (32,) array)
+        t2 = pxt.create_table('test2', {'a': pxt.Array[(32,), pxt.Int]})
+        vals = [np.arange(32, dtype=np.int32) * i for i in range(3)]
+        validate_update_status(t2.insert({'a': val} for val in vals), expected_rows=3)
+        for _ in range(2):
+            res = t2.select(t2.a).collect()
+            assert all(a.dtype == np.int32 for a in res['a'])
+            assert sorted(a.tolist() for a in res['a']) == sorted(val.tolist() for val in vals)
+            reload_catalog()
+            t2 = pxt.get_table('test2')
+
+    def test_insert_from_generator(self, reset_db: None, monkeypatch: pytest.MonkeyPatch) -> None:
+        from pixeltable.exec import InMemoryDataNode
+        monkeypatch.setattr(InMemoryDataNode, 'CHUNK_SIZE', 10)
+        chunk_sizes: list[int] = []
+        create_batch = InMemoryDataNode._create_batch
+
+        def record_chunk(self: InMemoryDataNode, input_rows: list) -> 'pxt.exec.DataRowBatch':
+            chunk_sizes.append(len(input_rows))
+            return create_batch(self, input_rows)
+
+        monkeypatch.setattr(InMemoryDataNode, '_create_batch', record_chunk)
+        t = pxt.create_table('test', {'c1': pxt.Required[pxt.Int], 'c2': pxt.String})
+        t.add_column(c3=t.c1 * 2)
+        version = t._tbl_version.version
+
+        # the generator is consumed in chunks, but the result is a single version
+        status = t.insert({'c1': i, 'c2': str(i)} for i in range(95))
+        assert status.num_rows == 95 and status.num_excs == 0
+        assert chunk_sizes == [10] * 9 + [5]
+        assert t._tbl_version.version == version + 1
+        assert t.count() == 95
+        assert t.where(t.c3 != t.c1 * 2).count() == 0
+        assert t.select(t.c1).order_by(t.c1).collect()['c1'] == list(range(95))
+
+        # rows are validated as they're being consumed; a bad row aborts the entire insert
+        def bad_rows():
+            for i in range(50):
+                yield {'c1': i} if i != 37 else {'c1': 'not an int'}
+        with pytest.raises(excs.Error) as exc_info:
+            t.insert(bad_rows())
+        assert 'not an int' in str(exc_info.value)
+        assert t.count() == 95
+
+        with pytest.raises(excs.Error) as exc_info:
+            t.insert(iter([]))
+        assert 'empty' in str(exc_info.value)
+
+    def test_pipelined_execution(self, reset_db: None, monkeypatch: pytest.MonkeyPatch) -> None:
+        from pixeltable import exec
+        from pixeltable.dataframe import DataFrameResultSet
+
+        def run() -> tuple[DataFrameResultSet, DataFrameResultSet]:
+            t = pxt.create_table('test_pipelined', {'c1': pxt.Int, 'img': pxt.Image})
+            t.add_column(c2=t.c1 * 2)
+            t.add_column(c3=self.f1(t.c1))
+            img_files = get_image_files()[:20]
+            status = t.insert(
+                ({'c1': i, 'img': img_files[i % len(img_files)]} for i in range(100)), on_error='ignore')
+            assert status.num_rows == 100
+            t.add_column(c4=t.c3 + t.c2)
+            t.add_column(w=t.img.width)
+            res1 = t.select(t.c1, t.c2, t.c3, t.c4, t.w).where(t.c2 > 10).order_by(t.c1).collect()
+            res2 = t.select(t.c1, t.c4).order_by(t.c1).limit(5).collect()
+            pxt.drop_table('test_pipelined')
+            return res1, res2
+
+        expected = run()
+        monkeypatch.setenv('PIXELTABLE_PIPELINED_EXECUTION', 'true')
+        monkeypatch.setenv('PIXELTABLE_PIPELINE_QUEUE_SIZE', '2')
+        actual = run()
+        for e, a in zip(expected, actual):
+            assert_resultset_eq(e, a)
+
+        t = pxt.create_table('test_pipelined', {'c1': pxt.Int})
+        t.add_column(c2=self.f1(t.c1))
+        plan = t.select(self.f2(t.c2))._create_query_plan()
+        assert isinstance(plan, exec.PipelineNode)
+        assert plan.get_node(exec.ExprEvalNode) is not None
+        assert isinstance(plan.get_node(exec.ExprEvalNode).input, exec.PipelineNode)
+
+        # exceptions raised in a worker thread surface in the consumer
+        with pytest.raises(excs.ExprEvalError) as exc_info:
+            t.insert([{'c1': 10}], on_error='abort')
+        assert isinstance(exc_info.value.exc, ZeroDivisionError)
+
     def test_expr_udf_computed_cols(self, reset_db: None) -> None:
         t = pxt.create_table('test', {'c1': pxt.Int})
         rows = [{'c1': i} for i in range(100)]
@@ -1398,6 +1599,83 @@ class TestTable:
         t.insert(rows, on_error='ignore')
         _ = t[t.c3.errortype].collect()
 
+    def test_computed_img_format(self, reset_db: None, small_img_tbl: catalog.Table) -> None:
+        t = small_img_tbl
+        t.add_computed_column(rot_png=t.img.rotate(90), image_format='png')
+        t.add_computed_column(rot_jpeg=t.img.rotate(180), image_format='jpeg', image_quality=85)
+        t.add_computed_column(rot_webp=t.img.rotate(270), image_format='webp', image_quality=50)
+        # JPEG drops the alpha channel
+        t.add_computed_column(rgba_jpeg=t.img.convert('RGBA'), image_format='jpeg')
+        # the default is still JPEG, or WebP for images with transparency
+        t.add_computed_column(rot_default=t.img.rotate(45))
+        t.add_computed_column(rgba_default=t.img.convert('RGBA').rotate(90))
+        # new rows go through the same code path
+        t.insert(img=get_image_files()[0], category='x', split='y')
+
+        def check(tbl: catalog.Table) -> None:
+            res = tbl.select(
+                tbl.img, png=tbl.rot_png.localpath, jpeg=tbl.rot_jpeg.localpath, webp=tbl.rot_webp.localpath,
+                rgba_jpeg=tbl.rgba_jpeg.localpath, default=tbl.rot_default.localpath,
+                rgba_default=tbl.rgba_default.localpath
+            ).collect()
+            assert len(res) == 41
+            expected_formats = {
+                'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'rgba_jpeg': 'JPEG', 'default': 'JPEG',
+                'rgba_default': 'WEBP'
+            }
+            for row in res:
+                for col_name, expected_format in expected_formats.items():
+                    with PIL.Image.open(row[col_name]) as img:
+                        assert img.format == expected_format, col_name
+                        if col_name == 'png':
+                            # lossless
+                            expected = row['img'].rotate(90)
+                            assert img.mode == expected.mode
+                            assert np.array_equal(np.asarray(img), np.asarray(expected))
+                        if col_name == 'rgba_jpeg':
+                            assert img.mode == 'RGB'
+
+        check(t)
+        # quality affects the encoding
+        with PIL.Image.open(t.select(p=t.rot_jpeg.localpath).head(1)[0, 'p']) as img:
+            assert img.quantization != PIL.Image.open(t.select(p=t.rot_default.localpath).head(1)[0, 'p']).quantization
+
+        # the format is part of the persisted column metadata
+        reload_catalog()
+        t = pxt.get_table('small_img_tbl')
+        t.insert(img=get_image_files()[1], category='x', split='y')
+        res = t.where(t.category == 'x').select(p=t.rot_png.localpath, w=t.rot_webp.localpath).collect()
+        assert len(res) == 2
+        for row in res:
+            assert PIL.Image.open(row['p']).format == 'PNG'
+            assert PIL.Image.open(row['w']).format == 'WEBP'
+
+        # synchronous encoding produces the same files
+        t.delete(where=t.category == 'x')
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setenv('PIXELTABLE_IMAGE_ENCODER_THREADS', '0')
+            mp.setattr(ImageEncoder, '_ImageEncoder__instance', None)
+            assert ImageEncoder.get() is None
+            t.add_computed_column(rot_png2=t.img.rotate(30), image_format='png')
+            assert all(PIL.Image.open(p).format == 'PNG' for p in t.select(p=t.rot_png2.localpath).collect()['p'])
+
+        # errors
+        with pytest.raises(excs.Error) as exc_info:
+            t.add_computed_column(c1=t.img.rotate(90), image_format='gif')
+        assert '"image_format" must be one of' in str(exc_info.value)
+        with pytest.raises(excs.Error) as exc_info:
+            t.add_computed_column(c1=t.img.rotate(90), image_format='png', image_quality=90)
+        assert '"image_quality" requires' in str(exc_info.value)
+        with pytest.raises(excs.Error) as exc_info:
+            t.add_computed_column(c1=t.img.rotate(90), image_format='jpeg', image_quality=0)
+        assert 'between 1 and 100' in str(exc_info.value)
+        with pytest.raises(excs.Error) as exc_info:
+            t.add_computed_column(c1=t.img.width, image_format='png')
+        assert 'only applies to stored computed image columns' in str(exc_info.value)
+        with pytest.raises(excs.Error) as exc_info:
+            t.add_computed_column(c1=t.img.rotate(90), stored=False, image_format='png')
+        assert 'only applies to stored computed image columns' in str(exc_info.value)
+
     def test_computed_window_fn(self, reset_db: None, test_tbl: catalog.Table) -> None:
         t = test_tbl
         # backfill
@@ -1780,6 +2058,123 @@ class TestTable:
 
         _ = reload_tester.run_reload_test()
 
+    def test_add_computed_column_parallel(
+        self, test_tbl: catalog.Table, small_img_tbl: catalog.Table, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setenv('PIXELTABLE_BACKFILL_WORKERS', '3')
+        monkeypatch.setattr(catalog.TableVersion, 'PARALLEL_BACKFILL_MIN_ROWS', 0)
+
+        def serial_load_column(*args, **kwargs) -> int:
+            raise AssertionError('column was populated serially')
+
+        monkeypatch.setattr(StoreBase, 'load_column', serial_load_column)
+        t = test_tbl
+        status = t.add_column(add1=t.c2 + 10)
+        assert status.num_rows == 100
+        assert status.num_excs == 0
+        assert_resultset_eq(
+            t.order_by(t.c2).select(t.add1).collect(), t.order_by(t.c2).select(t.c2 + 10).collect())
+
+        # exceptions get recorded by the workers
+        status = t.add_column(add2=self.f2(self.f1(t.c2)), on_error='ignore')
+        assert status.num_excs == 10
+        assert t.where(t.add2.errortype != None).count() == 10
+        with pytest.raises(excs.Error) as exc:
+            t.add_column(add3=self.f2(self.f1(t.c2)), on_error='abort')
+        assert 'division by zero' in str(exc.value)
+        assert 'add3' not in t.columns
+
+        # views: the partitioning is based on the view's rowids
+        v = pxt.create_view('test_view', t.where(t.c2 < 50))
+        v.add_column(add4=v.add1 * 2)
+        assert_resultset_eq(
+            v.order_by(v.c2).select(v.add4).collect(), v.order_by(v.c2).select(v.c2 * 2 + 20).collect())
+
+        # stored images written by the workers end up in the media store
+        t = small_img_tbl
+        t.add_column(rotated=t.img.rotate(90))
+        assert MediaStore.count(t._id) == t.count()
+        for row in t.select(t.img, t.rotated).collect():
+            assert row['rotated'].size == row['img'].rotate(90).size
+
+        # the result is the same after a reload
+        reload_catalog()
+        t = pxt.get_table('test_tbl')
+        assert t.where(t.add2.errortype != None).count() == 10
+        assert t.where(t.add1 == t.c2 + 10).count() == 100
+
+    def test_add_computed_column_resume(self, test_tbl: catalog.Table, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(catalog.TableVersion, 'CHECKPOINTED_BACKFILL_MIN_ROWS', 0)
+        monkeypatch.setattr(StoreBase, 'BACKFILL_CHECKPOINT_ROWS', 10)
+        t = test_tbl
+
+        def add_interrupted(fail_at: int, **kwargs: pxt.exprs.Expr) -> None:
+            monkeypatch.setattr(f'{__name__}._resumable_square_fail_at', fail_at)
+            with pytest.raises(excs.Error) as exc_info:
+                t.add_computed_column(**kwargs)
+            assert 'failed for' in str(exc_info.value)
+            assert next(iter(kwargs)) not in t.columns
+            monkeypatch.setattr(f'{__name__}._resumable_square_fail_at', None)
+            _resumable_square_calls.clear()
+
+        # re-issuing add_computed_column() picks up where the interrupted attempt stopped
+        add_interrupted(70, sq1=resumable_square(t.c2))
+        status = t.add_computed_column(sq1=resumable_square(t.c2))
+        assert 0 < status.num_resumed_rows < 70
+        assert sorted(_resumable_square_calls) == list(range(status.num_resumed_rows, 100))
+        assert t.where(t.sq1 == t.c2 * t.c2).count() == 100
+
+        # so does resume()
+        add_interrupted(50, sq2=resumable_square(t.c2))
+        status = t.resume()
+        assert 0 < status.num_resumed_rows < 50
+        assert len(_resumable_square_calls) == 100 - status.num_resumed_rows
+        assert t.where(t.sq2 == t.c2 * t.c2).count() == 100
+        with pytest.raises(excs.Error, match='no interrupted computed column'):
+            t.resume()
+
+        # a different column definition starts from scratch
+        add_interrupted(50, sq3=resumable_square(t.c2))
+        status = t.add_computed_column(sq3=resumable_square(t.c2 + 1))
+        assert status.num_resumed_rows == 0
+        assert len(_resumable_square_calls) == 100
+
+        # so do changes to the data
+        add_interrupted(50, sq4=resumable_square(t.c2))
+        t.delete(t.c2 == 0)
+        status = t.add_computed_column(sq4=resumable_square(t.c2))
+        assert status.num_resumed_rows == 0
+        assert t.where(t.sq4 == t.c2 * t.c2).count() == 99
+
+        # interrupted parallel backfills can be resumed serially
+        monkeypatch.setenv('PIXELTABLE_BACKFILL_WORKERS', '3')
+        monkeypatch.setattr(catalog.TableVersion, 'PARALLEL_BACKFILL_MIN_ROWS', 0)
+        add_interrupted(50, sq5=resumable_square(t.c2))
+        monkeypatch.delenv('PIXELTABLE_BACKFILL_WORKERS')
+        status = t.add_computed_column(sq5=resumable_square(t.c2))
+        assert status.num_resumed_rows > 0
+        assert len(_resumable_square_calls) == 99 - status.num_resumed_rows
+        assert t.where(t.sq5 == t.c2 * t.c2).count() == 99
+
+        # after a crash, the reloaded catalog reuses the column id of the interrupted attempt, whose store column
+        # is still there
+        add_interrupted(50, sq7=resumable_square(t.c2))
+        reload_catalog()
+        t = pxt.get_table('test_tbl')
+        status = t.resume()
+        assert status.num_resumed_rows > 0
+        assert len(_resumable_square_calls) == 99 - status.num_resumed_rows
+        assert t.where(t.sq7 == t.c2 * t.c2).count() == 99
+
+        # dropping the table also drops the state of interrupted backfills
+        add_interrupted(50, sq6=resumable_square(t.c2))
+        prefix = f'backfill_{t._id.hex}'
+        with Env.get().engine.begin() as conn:
+            assert any(name.startswith(prefix) for name in sql.inspect(conn).get_table_names())
+        pxt.drop_table(t._name)
+        with Env.get().engine.begin() as conn:
+            assert not any(name.startswith(prefix) for name in sql.inspect(conn).get_table_names())
+
     def test_computed_column_types(self, reset_db: None) -> None:
         t = pxt.create_table(
             'test',
@@ -1,5 +1,7 @@
+from pathlib import Path
 from typing import Optional
 
+import numpy as np
 import PIL
 import pytest
 
@@ -7,6 +9,7 @@ import pixeltable as pxt
 from pixeltable import catalog
 from pixeltable import exceptions as excs
 from pixeltable.iterators import FrameIterator
+from pixeltable.utils.keyframe_index import KeyframeIndex
 from pixeltable.utils.media_store import MediaStore
 
 from .utils import get_video_files, reload_catalog, skip_test_if_not_installed, validate_update_status
@@ -97,6 +100,65 @@ class TestVideo:
             _ = pxt.create_view('invalid_args', videos, iterator=FrameIterator.create(video=videos.video, fps=1/2, num_frames=10))
         assert 'At most one of `fps` or `num_frames` may be specified' in str(exc_info.value)
 
+    def test_seeks(self, reset_db, monkeypatch: pytest.MonkeyPatch) -> None:
+        # a video with several keyframes
+        path = get_video_files()[0]
+        KeyframeIndex.get().clear()
+        all_frames = [np.asarray(row['frame']) for row in FrameIterator(path)]
+
+        # sparse sampling seeks to keyframes, but returns the same frames as sequential decoding
+        for kwargs in [{'fps': 1/3}, {'num_frames': 4}, {'fps': 1}]:
+            for row in FrameIterator(path, **kwargs):
+                assert np.array_equal(np.asarray(row['frame']), all_frames[row['pos_frame']])
+        keyframes = KeyframeIndex.get().get_keyframes(Path(path))
+        assert len(keyframes) > 1
+
+        # random access
+        it = FrameIterator(path)
+        for idx in [300, 5, 6, 100, 299, 0, 448]:
+            it.set_pos(idx)
+            row = next(it)
+            assert row['pos_frame'] == idx
+            assert np.array_equal(np.asarray(row['frame']), all_frames[idx])
+
+        # the keyframes are persisted
+        KeyframeIndex.init()
+        monkeypatch.setattr(KeyframeIndex, '_scan', lambda _: pytest.fail('keyframes were recomputed'))
+        assert np.array_equal(KeyframeIndex.get().get_keyframes(Path(path)), keyframes)
+
+    def test_decode_options(self, reset_db) -> None:
+        path = get_video_files()[0]
+        frames = [row['frame'] for row in FrameIterator(path, num_frames=10)]
+        assert frames[0].size == (640, 360)
+
+        # multi-threaded decoding returns the same frames
+        for thread_type in ['slice', 'frame', 'auto']:
+            rows = list(FrameIterator(path, num_frames=10, thread_type=thread_type))
+            assert all(np.array_equal(np.asarray(row['frame']), np.asarray(frame)) for row, frame in zip(rows, frames))
+
+        # frames are scaled by the decoder; the aspect ratio is preserved if only one dimension is given
+        rows = list(FrameIterator(path, num_frames=10, width=320))
+        assert all(row['frame'].size == (320, 180) for row in rows)
+        rows = list(FrameIterator(path, num_frames=10, height=90, as_array=True))
+        assert all(row['frame'].shape == (90, 160, 3) and row['frame'].dtype == np.uint8 for row in rows)
+        rows = list(FrameIterator(path, num_frames=10, as_array=True))
+        assert all(np.array_equal(row['frame'], np.asarray(frame)) for row, frame in zip(rows, frames))
+
+        videos = pxt.create_table('videos', {'video': pxt.Video})
+        frames_view = pxt.create_view(
+            'frames', videos,
+            iterator=FrameIterator.create(video=videos.video, num_frames=10, width=32, height=24, as_array=True))
+        assert frames_view.frame.col_type.matches(pxt.ArrayType((24, 32, 3), dtype=pxt.IntType()))
+        videos.insert(video=path)
+        res = frames_view.select(frames_view.frame).collect()
+        assert len(res) == 10
+        assert all(frame.shape == (24, 32, 3) and frame.dtype == np.uint8 for frame in res['frame'])
+
+        with pytest.raises(excs.Error, match='Invalid thread_type'):
+            pxt.create_view('invalid', videos, iterator=FrameIterator.create(video=videos.video, thread_type='all'))
+        with pytest.raises(excs.Error, match='`width` must be a positive integer'):
+            pxt.create_view('invalid', videos, iterator=FrameIterator.create(video=videos.video, width=0))
+
     def test_computed_cols(self, reset_db) -> None:
         video_filepaths = get_video_files()
         base_t, view_t = self.create_tbls()